@@ -2,7 +2,7 @@ import os
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity
 from backend.models import authenticate_user, log_login_attempt, get_failed_attempts, init_auth_db, ph
-from backend.riconciliazione.db_manager import get_db_connection
+from backend.riconciliazione.db_manager import connessione_pool
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -18,7 +18,7 @@ def register():
     if not username or not password or len(password) < 8:
         return jsonify({"msg": "Username e password (>8 char) obbligatori"}), 400
         
-    conn = get_db_connection(DB_PATH)
+    conn = connessione_pool(DB_PATH)
     cur = conn.cursor()
     cur.execute("SELECT id FROM users WHERE username = ?", (username,))
     if cur.fetchone():
@@ -63,7 +63,7 @@ def login():
         return jsonify(access_token=access_token, refresh_token=refresh_token, user=user_data['username']), 200
     else:
         # Prendi l'id utente se esiste solo per tracciarlo (anche se la pw è errata)
-        conn = get_db_connection(DB_PATH)
+        conn = connessione_pool(DB_PATH)
         cur = conn.cursor()
         cur.execute("SELECT id FROM users WHERE username = ?", (username,))
         user_row = cur.fetchone()
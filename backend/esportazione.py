@@ -0,0 +1,138 @@
+"""
+Esportazione dei report in streaming (Excel, CSV, Parquet).
+Le righe arrivano da un cursore SQLite a blocchi di fetchmany(): nessun
+formato tiene in memoria tutto il risultato. L'xlsx e il Parquet vengono
+scritti su un file temporaneo e inviati a blocchi, il CSV e' generato mentre
+si legge il cursore.
+"""
+import os
+import csv
+import io
+import tempfile
+import xlsxwriter
+
+RIGHE_PER_BLOCCO = 5000
+BYTE_PER_BLOCCO = 64 * 1024
+
+# Righe iniziali da cui si stima la larghezza delle colonne Excel
+RIGHE_CAMPIONE = 500
+LARGHEZZA_MAX = 60
+
+MIMETYPE = {
+    'excel': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+ESTENSIONE = {'excel': 'xlsx', 'csv': 'csv', 'parquet': 'parquet'}
+
+
+def _blocchi(cursore):
+    while True:
+        righe = cursore.fetchmany(RIGHE_PER_BLOCCO)
+        if not righe:
+            return
+        yield righe
+
+
+def _colonne(cursore):
+    return [d[0] for d in cursore.description]
+
+
+def scrivi_excel(cursore, path, nome_foglio='Riconciliazioni'):
+    """
+    Scrive il risultato del cursore in un xlsx con XlsxWriter in constant_memory
+    (una riga alla volta su disco). Larghezze delle colonne dalle prime
+    RIGHE_CAMPIONE righe; colonne *_EUR in formato valuta.
+    """
+    colonne = _colonne(cursore)
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    try:
+        worksheet = workbook.add_worksheet(nome_foglio)
+        money_fmt = workbook.add_format({'num_format': '€ #,##0.00'})
+        date_fmt = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+
+        campione = cursore.fetchmany(RIGHE_CAMPIONE)
+        for i, col in enumerate(colonne):
+            if 'EUR' in col:
+                worksheet.set_column(i, i, 15, money_fmt)
+            elif col == 'Data':
+                worksheet.set_column(i, i, 12, date_fmt)
+            else:
+                larghezza = max([len(str(r[i])) for r in campione] + [len(col)]) + 2
+                worksheet.set_column(i, i, min(larghezza, LARGHEZZA_MAX))
+
+        worksheet.write_row(0, 0, colonne)
+        n = 0
+        for riga in campione:
+            n += 1
+            worksheet.write_row(n, 0, riga)
+        for righe in _blocchi(cursore):
+            for riga in righe:
+                n += 1
+                worksheet.write_row(n, 0, riga)
+    finally:
+        workbook.close()
+    return n
+
+
+def scrivi_parquet(cursore, path):
+    """Scrive il risultato del cursore in Parquet, un row group per blocco (richiede pyarrow)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    colonne = _colonne(cursore)
+    writer = None
+    n = 0
+    try:
+        for righe in _blocchi(cursore):
+            tabella = pa.table({col: [r[i] for r in righe] for i, col in enumerate(colonne)})
+            if writer is None:
+                # Colonne tutte vuote nel primo blocco: testo
+                schema = pa.schema([
+                    c.with_type(pa.string()) if pa.types.is_null(c.type) else c for c in tabella.schema
+                ])
+                writer = pq.ParquetWriter(path, schema)
+                tabella = tabella.cast(schema)
+            else:
+                tabella = tabella.cast(writer.schema)
+            writer.write_table(tabella)
+            n += len(righe)
+        if writer is None:
+            pq.write_table(pa.table({col: pa.array([], pa.string()) for col in colonne}), path)
+    finally:
+        if writer is not None:
+            writer.close()
+    return n
+
+
+def csv_a_blocchi(cursore, separatore=';'):
+    """Genera il CSV (intestazione compresa) a blocchi di testo mentre legge il cursore."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=separatore, lineterminator='\n')
+    writer.writerow(_colonne(cursore))
+    for righe in _blocchi(cursore):
+        writer.writerows(righe)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def file_temporaneo(estensione):
+    fd, path = tempfile.mkstemp(suffix=f".{estensione}", prefix="export_")
+    os.close(fd)
+    return path
+
+
+def file_a_blocchi(path):
+    """Legge il file a blocchi di BYTE_PER_BLOCCO e lo elimina a fine invio."""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                blocco = f.read(BYTE_PER_BLOCCO)
+                if not blocco:
+                    break
+                yield blocco
+    finally:
+        os.remove(path)
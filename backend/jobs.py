@@ -0,0 +1,185 @@
+"""
+Job in background per le elaborazioni lunghe (upload + orchestratore).
+Coda locale in-process: un ThreadPoolExecutor esegue i job, mentre stato e
+avanzamento stanno nella tabella jobs, cosi' qualunque worker del server puo'
+rispondere a GET /api/jobs/<id>.
+"""
+import os
+import json
+import uuid
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from backend.riconciliazione.db_manager import connessione_pool
+
+STATI_ATTIVI = ('IN_CODA', 'IN_CORSO')
+
+# Job conclusi piu' vecchi di cosi' vengono eliminati all'avvio
+GIORNI_CONSERVAZIONE_JOBS = 30
+
+
+def _avvio_processo(pid):
+    """Avvio del processo come 'btime.starttime' da /proc (None se non disponibile)."""
+    try:
+        with open("/proc/stat", "r") as f:
+            btime = next(riga.split()[1] for riga in f if riga.startswith("btime"))
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # Campo 22 (starttime): si conta dopo il nome del comando tra parentesi
+            starttime = f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, StopIteration, IndexError):
+        return None
+    return f"{btime}.{starttime}"
+
+
+# Identita' di questo processo, salvata nel job insieme al pid: nei container e
+# con i worker di gunicorn i pid vengono riusati. Senza /proc, un UUID di avvio.
+TOKEN_PROCESSO = _avvio_processo(os.getpid()) or uuid.uuid4().hex
+
+
+def _processo_attivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _job_attivo(pid, token):
+    """
+    True se il processo che ha registrato il job e' ancora lo stesso: pid in vita
+    e token uguale all'avvio attuale di quel pid. Se l'avvio non e' leggibile
+    (niente /proc) vale il solo pid, tranne che per il pid di questo processo.
+    """
+    if not pid or not _processo_attivo(pid):
+        return False
+    if pid == os.getpid():
+        return token == TOKEN_PROCESSO
+    avvio = _avvio_processo(pid)
+    return token is None or avvio is None or avvio == token
+
+
+def init_jobs_db(db_path):
+    """
+    Crea la tabella jobs se non esiste. I job rimasti attivi di processi non piu'
+    in vita (riavvio del server, pid riusato: vedi _job_attivo) vengono chiusi in
+    ERRORE; i job conclusi vecchi vengono eliminati.
+    """
+    conn = connessione_pool(db_path)
+    try:
+        cur = conn.cursor()
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                tipo TEXT NOT NULL,
+                stato TEXT NOT NULL DEFAULT 'IN_CODA',   -- IN_CODA, IN_CORSO, COMPLETATO, ERRORE
+                fase TEXT,
+                percentuale INTEGER DEFAULT 0,
+                dettaglio TEXT,                          -- JSON: avanzamento per motore
+                risultato TEXT,                          -- JSON restituito dal job
+                errore TEXT,
+                pid INTEGER,
+                processo TEXT,                           -- TOKEN_PROCESSO di chi ha registrato il job
+                creato_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                avviato_il TIMESTAMP,
+                terminato_il TIMESTAMP
+            )
+        ''')
+        colonne = {row['name'] for row in cur.execute("PRAGMA table_info(jobs)")}
+        if 'processo' not in colonne:
+            cur.execute("ALTER TABLE jobs ADD COLUMN processo TEXT")
+        cur.execute("SELECT id, pid, processo FROM jobs WHERE stato IN (?, ?)", STATI_ATTIVI)
+        orfani = [row['id'] for row in cur.fetchall() if not _job_attivo(row['pid'], row['processo'])]
+        cur.executemany(
+            "UPDATE jobs SET stato = 'ERRORE', errore = 'Interrotto dal riavvio del server', "
+            "terminato_il = CURRENT_TIMESTAMP WHERE id = ?",
+            [(job_id,) for job_id in orfani]
+        )
+        cur.execute(
+            "DELETE FROM jobs WHERE stato NOT IN (?, ?) AND creato_il < datetime('now', ?)",
+            STATI_ATTIVI + (f'-{GIORNI_CONSERVAZIONE_JOBS} days',)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _aggiorna_job(db_path, job_id, **campi):
+    """Aggiorna i campi del job con una connessione del pool (i dict sono salvati come JSON)."""
+    assegnazioni = []
+    valori = []
+    for campo, valore in campi.items():
+        if campo.endswith('_il'):
+            assegnazioni.append(f"{campo} = CURRENT_TIMESTAMP")
+            continue
+        assegnazioni.append(f"{campo} = ?")
+        valori.append(json.dumps(valore) if isinstance(valore, (dict, list)) else valore)
+    conn = connessione_pool(db_path)
+    try:
+        conn.execute(f"UPDATE jobs SET {', '.join(assegnazioni)} WHERE id = ?", valori + [job_id])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def leggi_job(db_path, job_id):
+    """Stato del job come dict (None se non esiste)."""
+    conn = connessione_pool(db_path)
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None
+    job = dict(row)
+    for campo in ('dettaglio', 'risultato'):
+        job[campo] = json.loads(job[campo]) if job[campo] else None
+    del job['pid'], job['processo']
+    return job
+
+
+class CodaJobs:
+    """
+    Coda di job in-process. invia() registra il job e ritorna subito l'id;
+    la funzione gira in un thread del pool e riceve il callback progresso(fase, percentuale, dettaglio).
+    Con max_workers=1 (default) i job vengono eseguiti uno alla volta, come
+    richiede la scrittura su SQLite.
+    """
+
+    def __init__(self, db_path, max_workers=1):
+        self.db_path = db_path
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def invia(self, tipo, funzione, *args, **kwargs):
+        job_id = uuid.uuid4().hex
+        conn = connessione_pool(self.db_path)
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, tipo, stato, fase, pid, processo) VALUES (?, ?, 'IN_CODA', 'In coda', ?, ?)",
+                (job_id, tipo, os.getpid(), TOKEN_PROCESSO)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        self._pool.submit(self._esegui, job_id, funzione, args, kwargs)
+        return job_id
+
+    def _esegui(self, job_id, funzione, args, kwargs):
+        _aggiorna_job(self.db_path, job_id, stato='IN_CORSO', fase='Avvio', avviato_il=True)
+
+        def progresso(fase, percentuale, dettaglio=None):
+            campi = {'fase': fase, 'percentuale': int(percentuale)}
+            if dettaglio is not None:
+                campi['dettaglio'] = dettaglio
+            _aggiorna_job(self.db_path, job_id, **campi)
+
+        try:
+            risultato = funzione(*args, progresso=progresso, **kwargs)
+        except Exception as e:
+            traceback.print_exc()
+            _aggiorna_job(self.db_path, job_id, stato='ERRORE', fase='Errore', errore=str(e), terminato_il=True)
+            return
+        _aggiorna_job(
+            self.db_path, job_id, stato='COMPLETATO', fase='Completato', percentuale=100,
+            risultato=risultato, terminato_il=True
+        )
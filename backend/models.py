@@ -1,13 +1,13 @@
 import sqlite3
 import datetime
 from argon2 import PasswordHasher
-from backend.riconciliazione.db_manager import get_db_connection
+from backend.riconciliazione.db_manager import connessione_pool
 
 ph = PasswordHasher()
 
 def init_auth_db(db_path):
     """Crea le tabelle per l'autenticazione se non esistono e inserisce un utente admin di default."""
-    conn = get_db_connection(db_path)
+    conn = connessione_pool(db_path)
     cur = conn.cursor()
     
     # Crea tabella users
@@ -45,7 +45,7 @@ def init_auth_db(db_path):
 
 def authenticate_user(db_path, username, password):
     """Verifica le credenziali dell'utente usando Argon2."""
-    conn = get_db_connection(db_path)
+    conn = connessione_pool(db_path)
     cur = conn.cursor()
     
     cur.execute("SELECT id, username, password_hash, active FROM users WHERE username = ?", (username,))
@@ -72,7 +72,7 @@ def authenticate_user(db_path, username, password):
 
 def log_login_attempt(db_path, user_id, username_attempt, ip_address, success):
     """Registra il tentativo di login per audit e rate limiting."""
-    conn = get_db_connection(db_path)
+    conn = connessione_pool(db_path)
     cur = conn.cursor()
     cur.execute(
         "INSERT INTO login_audit (user_id, username_attempt, ip_address, success) VALUES (?, ?, ?, ?)",
@@ -83,7 +83,7 @@ def log_login_attempt(db_path, user_id, username_attempt, ip_address, success):
 
 def get_failed_attempts(db_path, ip_address, minutes=10):
     """Trova il numero di tentativi falliti negli ultimi X minuti da un IP."""
-    conn = get_db_connection(db_path)
+    conn = connessione_pool(db_path)
     cur = conn.cursor()
     
     cutoff = datetime.datetime.now() - datetime.timedelta(minutes=minutes)
@@ -98,7 +98,7 @@ def get_failed_attempts(db_path, ip_address, minutes=10):
 
 def update_user_password(db_path, username, old_password, new_password):
     """Verifica e cambia la password di un utente esistente."""
-    conn = get_db_connection(db_path)
+    conn = connessione_pool(db_path)
     cur = conn.cursor()
     
     cur.execute("SELECT id, password_hash FROM users WHERE username = ?", (username,))
@@ -0,0 +1,208 @@
+"""
+Abbinamento giornate Fortech <-> versamenti AS400 per la riconciliazione contanti.
+Lavora su array NumPy ordinati per data: la finestra di ogni giornata
+(-giorni_inf / +giorni_sup) si trova con una ricerca binaria e i versamenti
+gia' abbinati sono tenuti in una bitmap.
+Due modalita' (chiave 'modalita_abbinamento_contanti' di config.json):
+  greedy -> giornata per giornata, versamento piu' vicino (comportamento storico)
+  ottimo -> assegnazione globale a costo minimo, non dipende dall'ordine delle giornate
+Nell'import incrementale le giornate del master Fortech vicine al file vengono
+abbinate per prime e i loro versamenti esclusi (motore_contanti): lo stesso
+versamento AS400 non finisce su due giornate di caricamenti diversi.
+"""
+import heapq
+import numpy as np
+
+NESSUN_MATCH = -1
+
+
+def _giorni(date):
+    """datetime64 (anche Series/DatetimeIndex) -> numero di giorni interi."""
+    return np.asarray(date, dtype='datetime64[ns]').astype('datetime64[D]').astype(np.int64)
+
+
+def finestre_candidati(date_teo, date_rea, giorni_inf, giorni_sup):
+    """
+    Per ogni giornata restituisce (lo, hi): i versamenti candidati sono date_rea[lo:hi].
+    date_rea deve essere ordinato e senza NaT.
+    """
+    giorni_rea = _giorni(date_rea)
+    giorni_teo = _giorni(date_teo)
+    lo = np.searchsorted(giorni_rea, giorni_teo - giorni_inf, side='left')
+    hi = np.searchsorted(giorni_rea, giorni_teo + giorni_sup, side='right')
+    return lo, hi
+
+
+def abbina_greedy(date_teo, importi_teo, date_rea, importi_rea, giorni_inf, giorni_sup, tolleranza_larga):
+    """
+    Abbinamento greedy: le giornate, in ordine, prendono il versamento libero con
+    l'importo piu' vicino nella propria finestra (a parita' il primo in ordine di data).
+    Il versamento viene consumato solo se la differenza rientra in tolleranza_larga,
+    cioe' se l'esito non e' ANOMALIA_GRAVE.
+
+    Restituisce per ogni giornata l'indice del versamento scelto in date_rea/importi_rea
+    (NESSUN_MATCH se la finestra non ha versamenti liberi).
+    """
+    importi_teo = np.asarray(importi_teo, dtype=float)
+    importi_rea = np.asarray(importi_rea, dtype=float)
+    lo, hi = finestre_candidati(date_teo, date_rea, giorni_inf, giorni_sup)
+
+    usato = np.zeros(len(importi_rea), dtype=bool)
+    match = np.full(len(importi_teo), NESSUN_MATCH, dtype=np.int64)
+    for i, imp_t in enumerate(importi_teo):
+        a, b = lo[i], hi[i]
+        if a >= b:
+            continue
+        diff = np.abs(importi_rea[a:b] - imp_t)
+        diff[usato[a:b]] = np.inf
+        k = int(np.argmin(diff))
+        if diff[k] == np.inf:
+            continue
+        match[i] = a + k
+        if diff[k] <= tolleranza_larga:
+            usato[a + k] = True
+    return match
+
+
+def _archi_ammessi(importi_teo, importi_rea, lo, hi, tolleranza_larga):
+    """Archi giornata -> versamento nella finestra con differenza entro tolleranza_larga (costo in centesimi)."""
+    archi = []
+    for i, imp_t in enumerate(importi_teo):
+        a, b = lo[i], hi[i]
+        if a >= b:
+            continue
+        diff = np.abs(importi_rea[a:b] - imp_t)
+        for k in np.flatnonzero(diff <= tolleranza_larga):
+            archi.append((i, a + int(k), int(round(diff[k] * 100))))
+    return archi
+
+
+def _componenti(archi):
+    """Divide il grafo bipartito in componenti connesse: [(giornate, versamenti, archi), ...]."""
+    padre = {}
+
+    def radice(x):
+        while padre.setdefault(x, x) != x:
+            padre[x] = padre[padre[x]]
+            x = padre[x]
+        return x
+
+    for i, j, _ in archi:
+        padre[radice(('g', i))] = radice(('v', j))
+
+    gruppi = {}
+    for arco in archi:
+        gruppi.setdefault(radice(('g', arco[0])), []).append(arco)
+    return [
+        (sorted({i for i, _, _ in a}), sorted({j for _, j, _ in a}), a)
+        for a in gruppi.values()
+    ]
+
+
+def _flusso_min_costo(n_sx, n_dx, archi):
+    """
+    Assegnazione di cardinalita' massima e costo minimo sul grafo bipartito sparso
+    (cammini minimi successivi con Dijkstra e potenziali di Johnson).
+    Restituisce per ogni nodo sinistro l'indice del nodo destro assegnato o NESSUN_MATCH.
+    """
+    sorgente, pozzo = n_sx + n_dx, n_sx + n_dx + 1
+    n_nodi = n_sx + n_dx + 2
+    # Grafo residuo: per ogni arco [destinazione, capacita', costo, indice arco inverso]
+    grafo = [[] for _ in range(n_nodi)]
+
+    def aggiungi(u, v, costo):
+        grafo[u].append([v, 1, costo, len(grafo[v])])
+        grafo[v].append([u, 0, -costo, len(grafo[u]) - 1])
+
+    for i in sorted({i for i, _, _ in archi}):
+        aggiungi(sorgente, i, 0)
+    for j in sorted({j for _, j, _ in archi}):
+        aggiungi(n_sx + j, pozzo, 0)
+    for i, j, costo in archi:
+        aggiungi(i, n_sx + j, costo)
+
+    potenziale = [0] * n_nodi
+    while True:
+        dist = [None] * n_nodi
+        precedente = [None] * n_nodi
+        dist[sorgente] = 0
+        coda = [(0, sorgente)]
+        while coda:
+            d, u = heapq.heappop(coda)
+            if d > dist[u]:
+                continue
+            for idx, (v, cap, costo, _) in enumerate(grafo[u]):
+                if cap <= 0:
+                    continue
+                nd = d + costo + potenziale[u] - potenziale[v]
+                if dist[v] is None or nd < dist[v]:
+                    dist[v] = nd
+                    precedente[v] = (u, idx)
+                    heapq.heappush(coda, (nd, v))
+        if dist[pozzo] is None:
+            break
+        for v in range(n_nodi):
+            if dist[v] is not None:
+                potenziale[v] += dist[v]
+        v = pozzo
+        while v != sorgente:
+            u, idx = precedente[v]
+            arco = grafo[u][idx]
+            arco[1] -= 1
+            grafo[v][arco[3]][1] += 1
+            v = u
+
+    match = np.full(n_sx, NESSUN_MATCH, dtype=np.int64)
+    for i in range(n_sx):
+        for v, cap, _, _ in grafo[i]:
+            if n_sx <= v < n_sx + n_dx and cap == 0:
+                match[i] = v - n_sx
+    return match
+
+
+def abbina_ottimo(date_teo, importi_teo, date_rea, importi_rea, giorni_inf, giorni_sup, tolleranza_larga):
+    """
+    Abbinamento globale, indipendente dall'ordine delle giornate: massimizza il numero
+    di giornate abbinate entro tolleranza_larga e, a parita', minimizza la somma delle
+    differenze assolute (assegnazione a costo minimo sul grafo sparso dei candidati
+    nella finestra di date).
+    Le giornate rimaste senza abbinamento riportano, come nel greedy, il versamento
+    libero piu' vicino nella finestra (esito ANOMALIA_GRAVE, versamento non consumato).
+    Stessa interfaccia e stesso valore di ritorno di abbina_greedy.
+    """
+    importi_teo = np.asarray(importi_teo, dtype=float)
+    importi_rea = np.asarray(importi_rea, dtype=float)
+    lo, hi = finestre_candidati(date_teo, date_rea, giorni_inf, giorni_sup)
+
+    archi = _archi_ammessi(importi_teo, importi_rea, lo, hi, tolleranza_larga)
+    match = np.full(len(importi_teo), NESSUN_MATCH, dtype=np.int64)
+    for giornate, versamenti, archi_comp in _componenti(archi):
+        # Ogni componente connessa del grafo si risolve da sola (indici locali)
+        idx_sx = {g: k for k, g in enumerate(giornate)}
+        idx_dx = {v: k for k, v in enumerate(versamenti)}
+        locale = _flusso_min_costo(
+            len(giornate), len(versamenti),
+            [(idx_sx[i], idx_dx[j], costo) for i, j, costo in archi_comp]
+        )
+        for k, v in enumerate(locale):
+            if v != NESSUN_MATCH:
+                match[giornate[k]] = versamenti[v]
+
+    usato = np.zeros(len(importi_rea), dtype=bool)
+    usato[match[match != NESSUN_MATCH]] = True
+    for i in np.flatnonzero(match == NESSUN_MATCH):
+        a, b = lo[i], hi[i]
+        if a >= b:
+            continue
+        diff = np.abs(importi_rea[a:b] - importi_teo[i])
+        diff[usato[a:b]] = np.inf
+        k = int(np.argmin(diff))
+        if diff[k] != np.inf:
+            match[i] = a + k
+    return match
+
+
+MODALITA_ABBINAMENTO = {
+    'greedy': abbina_greedy,
+    'ottimo': abbina_ottimo,
+}
@@ -0,0 +1,217 @@
+"""
+Tabelle derivate da report_riconciliazioni per le letture della dashboard,
+mantenute dai trigger su report_riconciliazioni (scritture del motore, pulizia
+impianto, modifiche dagli endpoint).
+
+report_stato_corrente: per ogni (impianto, categoria) l'id della riga piu'
+recente, cosi' la griglia di /api/stato-verifiche legge impianti x categorie
+righe qualunque sia la lunghezza dello storico. Le modifiche a valori, stato e
+note non cambiano la riga puntata e si vedono subito con il join.
+
+report_rollup_giornaliero: conteggi e somme per (giorno, categoria, stato,
+risolto), da cui rispondono /api/chart-data e /api/stats. Le somme sono
+aggiornate per differenza: se si discostano dallo storico si ricostruiscono con
+    python -m backend.riconciliazione.aggregati [--db database_riconciliazioni.db]
+"""
+import os
+import argparse
+import sqlite3
+
+SQL_STATO_CORRENTE = """
+    CREATE TABLE IF NOT EXISTS report_stato_corrente (
+        impianto_id INTEGER NOT NULL,
+        categoria VARCHAR(50) NOT NULL,
+        report_id INTEGER NOT NULL,
+        data_riferimento DATE NOT NULL,
+        PRIMARY KEY (impianto_id, categoria)
+    )
+"""
+
+# Ricalcola la riga corrente di una coppia (impianto, categoria) dallo storico
+_RICALCOLA = """
+        DELETE FROM report_stato_corrente WHERE impianto_id = {rif}.impianto_id AND categoria = {rif}.categoria;
+        INSERT INTO report_stato_corrente (impianto_id, categoria, report_id, data_riferimento)
+        SELECT impianto_id, categoria, id, data_riferimento FROM report_riconciliazioni
+        WHERE impianto_id = {rif}.impianto_id AND categoria = {rif}.categoria
+        ORDER BY data_riferimento DESC LIMIT 1;
+"""
+
+TRIGGER_STATO_CORRENTE = (
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_report_stato_insert
+    AFTER INSERT ON report_riconciliazioni
+    BEGIN
+        INSERT INTO report_stato_corrente (impianto_id, categoria, report_id, data_riferimento)
+        VALUES (NEW.impianto_id, NEW.categoria, NEW.id, NEW.data_riferimento)
+        ON CONFLICT(impianto_id, categoria) DO UPDATE SET
+            report_id = excluded.report_id,
+            data_riferimento = excluded.data_riferimento
+        WHERE excluded.data_riferimento >= report_stato_corrente.data_riferimento;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_report_stato_delete
+    AFTER DELETE ON report_riconciliazioni
+    WHEN OLD.id = (
+        SELECT report_id FROM report_stato_corrente
+        WHERE impianto_id = OLD.impianto_id AND categoria = OLD.categoria
+    )
+    BEGIN{_RICALCOLA.format(rif='OLD')}    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_report_stato_update
+    AFTER UPDATE OF impianto_id, categoria, data_riferimento ON report_riconciliazioni
+    BEGIN{_RICALCOLA.format(rif='OLD')}{_RICALCOLA.format(rif='NEW')}    END
+    """,
+)
+
+SQL_ROLLUP = """
+    CREATE TABLE IF NOT EXISTS report_rollup_giornaliero (
+        data_riferimento DATE NOT NULL,
+        categoria VARCHAR(50) NOT NULL,
+        stato VARCHAR(50) NOT NULL,
+        risolto INTEGER NOT NULL,
+        num_record INTEGER NOT NULL DEFAULT 0,
+        tot_fortech REAL NOT NULL DEFAULT 0,
+        tot_reale REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (data_riferimento, categoria, stato, risolto)
+    )
+"""
+
+# Chiave della riga di rollup di una riga di report ({rif} = NEW/OLD)
+_CHIAVE_ROLLUP = (
+    "data_riferimento = {rif}.data_riferimento AND categoria = {rif}.categoria "
+    "AND stato = COALESCE({rif}.stato, '') AND risolto = COALESCE({rif}.risolto, 0)"
+)
+
+_AGGIUNGI_ROLLUP = """
+        INSERT INTO report_rollup_giornaliero
+        (data_riferimento, categoria, stato, risolto, num_record, tot_fortech, tot_reale)
+        VALUES ({rif}.data_riferimento, {rif}.categoria, COALESCE({rif}.stato, ''), COALESCE({rif}.risolto, 0),
+                1, COALESCE({rif}.valore_fortech, 0), COALESCE({rif}.valore_reale, 0))
+        ON CONFLICT(data_riferimento, categoria, stato, risolto) DO UPDATE SET
+            num_record = num_record + 1,
+            tot_fortech = tot_fortech + excluded.tot_fortech,
+            tot_reale = tot_reale + excluded.tot_reale;
+"""
+
+_TOGLI_ROLLUP = """
+        UPDATE report_rollup_giornaliero SET
+            num_record = num_record - 1,
+            tot_fortech = tot_fortech - COALESCE({rif}.valore_fortech, 0),
+            tot_reale = tot_reale - COALESCE({rif}.valore_reale, 0)
+        WHERE {chiave};
+        DELETE FROM report_rollup_giornaliero WHERE {chiave} AND num_record <= 0;
+"""
+
+
+def _aggiungi(rif):
+    return _AGGIUNGI_ROLLUP.format(rif=rif)
+
+
+def _togli(rif):
+    return _TOGLI_ROLLUP.format(rif=rif, chiave=_CHIAVE_ROLLUP.format(rif=rif))
+
+
+TRIGGER_ROLLUP = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_report_rollup_insert
+    AFTER INSERT ON report_riconciliazioni
+    BEGIN{_aggiungi('NEW')}    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_report_rollup_delete
+    AFTER DELETE ON report_riconciliazioni
+    BEGIN{_togli('OLD')}    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_report_rollup_update
+    AFTER UPDATE OF data_riferimento, categoria, stato, risolto, valore_fortech, valore_reale
+    ON report_riconciliazioni
+    BEGIN{_togli('OLD')}{_aggiungi('NEW')}    END
+    """,
+)
+
+# tabella -> (SQL di creazione, trigger, SQL di ricostruzione dallo storico)
+AGGREGATI = {
+    'report_stato_corrente': (
+        SQL_STATO_CORRENTE,
+        TRIGGER_STATO_CORRENTE,
+        (
+            "DELETE FROM report_stato_corrente",
+            # Con MAX() SQLite restituisce id e categoria della riga che ha la data massima
+            """
+            INSERT INTO report_stato_corrente (impianto_id, categoria, report_id, data_riferimento)
+            SELECT impianto_id, categoria, id, MAX(data_riferimento)
+            FROM report_riconciliazioni
+            GROUP BY impianto_id, categoria
+            """,
+        ),
+    ),
+    'report_rollup_giornaliero': (
+        SQL_ROLLUP,
+        TRIGGER_ROLLUP,
+        (
+            "DELETE FROM report_rollup_giornaliero",
+            """
+            INSERT INTO report_rollup_giornaliero
+            (data_riferimento, categoria, stato, risolto, num_record, tot_fortech, tot_reale)
+            SELECT data_riferimento, categoria, COALESCE(stato, ''), COALESCE(risolto, 0),
+                   COUNT(*), SUM(COALESCE(valore_fortech, 0)), SUM(COALESCE(valore_reale, 0))
+            FROM report_riconciliazioni
+            GROUP BY 1, 2, 3, 4
+            """,
+        ),
+    ),
+}
+
+
+def ricostruisci_aggregati(conn, tabelle=None):
+    """Ricalcola le tabelle derivate (tutte o quelle indicate) da tutto lo storico. Non esegue commit."""
+    for tabella in tabelle or AGGREGATI:
+        for sql in AGGREGATI[tabella][2]:
+            conn.execute(sql)
+
+
+def assicura_aggregati(conn):
+    """
+    Crea tabelle e trigger delle tabelle derivate se mancano; una tabella appena
+    creata viene popolata dallo storico esistente. Non esegue commit.
+    """
+    nuove = []
+    for tabella, (sql_tabella, trigger, _) in AGGREGATI.items():
+        esiste = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabella,)
+        ).fetchone()
+        conn.execute(sql_tabella)
+        for sql in trigger:
+            conn.execute(sql)
+        if not esiste:
+            nuove.append(tabella)
+    if nuove:
+        ricostruisci_aggregati(conn, nuove)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ricostruisce le tabelle derivate di report_riconciliazioni.")
+    parser.add_argument("--db", default=os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "database_riconciliazioni.db"
+    ))
+    parser.add_argument("--tabella", choices=sorted(AGGREGATI), action="append",
+                        help="solo questa tabella (ripetibile); default tutte")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, timeout=30)
+    try:
+        with conn:
+            assicura_aggregati(conn)
+            ricostruisci_aggregati(conn, args.tabella)
+        for tabella in args.tabella or AGGREGATI:
+            n = conn.execute(f"SELECT COUNT(*) FROM {tabella}").fetchone()[0]
+            print(f"{tabella}: {n} righe")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
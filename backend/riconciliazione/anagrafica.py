@@ -0,0 +1,123 @@
+"""
+Anagrafica impianti in memoria per l'esecuzione del motore.
+La tabella impianti viene letta con una sola query e tenuta in dizionari
+(codice PV Fortech, codice negozio Satispay, codice contabile AS400 -> impianto).
+La copia in cache resta valida finche' la versione 'impianti' di meta_versioni
+(incrementata dai trigger sulla tabella impianti) non cambia.
+"""
+import re
+
+import pandas as pd
+
+SQL_IMPIANTI = """
+    SELECT id, codice_pv_fortech, codice_contabile_as400, codice_negozio_satispay
+    FROM impianti
+"""
+
+# path del database -> AnagraficaImpianti caricata
+_CACHE = {}
+
+
+def normalizza_codice(valore):
+    """Normalizza un codice nella forma testuale dell'anagrafica: 43809, 43809.0, ' 43809 ' -> '43809'."""
+    if valore is None:
+        return None
+    if isinstance(valore, float):
+        if valore != valore:
+            return None
+        if valore.is_integer():
+            valore = int(valore)
+    testo = str(valore).strip()
+    return testo or None
+
+
+def _parte_numerica(codice):
+    """'43809 - OPT1' -> '43809' (None se non ci sono cifre)."""
+    trovato = re.search(r'\d+', codice)
+    return str(int(trovato.group())) if trovato else None
+
+
+def versione_impianti(conn):
+    """Versione corrente dell'anagrafica (None se meta_versioni non esiste ancora)."""
+    try:
+        row = conn.execute("SELECT versione FROM meta_versioni WHERE chiave = 'impianti'").fetchone()
+    except Exception:
+        return None
+    return row[0] if row else None
+
+
+def _percorso_db(conn):
+    row = conn.execute("PRAGMA database_list").fetchone()
+    return row[2] if row else ''
+
+
+class AnagraficaImpianti:
+    """Lookup in memoria degli impianti per codice PV Fortech, Satispay e AS400."""
+
+    def __init__(self, righe, versione=None):
+        self.versione = versione
+        self._per_pv = {}
+        self._per_satispay = {}
+        self._as400_per_id = {}
+        for impianto_id, codice_pv, codice_as400, codice_satispay in righe:
+            codice_pv = normalizza_codice(codice_pv)
+            if codice_pv:
+                self._per_pv[codice_pv] = impianto_id
+            codice_satispay = normalizza_codice(codice_satispay)
+            if codice_satispay:
+                self._per_satispay[codice_satispay] = impianto_id
+            codice_as400 = normalizza_codice(codice_as400)
+            if codice_as400:
+                self._as400_per_id[impianto_id] = codice_as400
+
+    @classmethod
+    def carica(cls, conn):
+        """Legge tutta la tabella impianti con una sola query."""
+        versione = versione_impianti(conn)
+        return cls(conn.execute(SQL_IMPIANTI).fetchall(), versione)
+
+    @classmethod
+    def corrente(cls, conn):
+        """
+        Anagrafica del database di conn, riletta solo se la versione 'impianti'
+        di meta_versioni e' cambiata dall'ultima lettura.
+        """
+        chiave = _percorso_db(conn)
+        versione = versione_impianti(conn)
+        cached = _CACHE.get(chiave)
+        if cached is not None and versione is not None and cached.versione == versione:
+            return cached
+        anagrafica = cls(conn.execute(SQL_IMPIANTI).fetchall(), versione)
+        if chiave:
+            _CACHE[chiave] = anagrafica
+        return anagrafica
+
+    def __len__(self):
+        return len(self._per_pv)
+
+    def impianto_id(self, pv_code):
+        """Id impianto per codice PV Fortech (None se non in anagrafica)."""
+        return self._per_pv.get(normalizza_codice(pv_code))
+
+    def tabella_pv(self):
+        """DataFrame PV (numerico, come CodicePV di Fortech) -> impianto_id, per i merge vettoriali."""
+        df = pd.DataFrame(list(self._per_pv.items()), columns=['codice_pv', 'impianto_id'])
+        df['PV'] = pd.to_numeric(df['codice_pv'], errors='coerce')
+        return df.dropna(subset=['PV']).drop_duplicates('PV')[['PV', 'impianto_id']]
+
+    def impianto_satispay(self, codice_negozio):
+        """
+        Id impianto per codice negozio Satispay: prima il codice esatto
+        ('43809 - OPT1'), poi la parte numerica come codice PV Fortech.
+        """
+        codice = normalizza_codice(codice_negozio)
+        if codice is None:
+            return None
+        impianto_id = self._per_satispay.get(codice)
+        if impianto_id is None:
+            impianto_id = self._per_pv.get(_parte_numerica(codice))
+        return impianto_id
+
+    def codice_as400(self, pv_code):
+        """Codice contabile AS400 (C.d.C.) dell'impianto del PV, None se non impostato."""
+        return self._as400_per_id.get(self.impianto_id(pv_code))
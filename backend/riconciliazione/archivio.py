@@ -0,0 +1,179 @@
+"""
+Archivio Parquet delle righe sorgente normalizzate.
+A ogni esecuzione i frame gia' letti dai loader (le colonne usate dai motori)
+e il Fortech aggregato vengono salvati in
+    archivio_sorgenti/fonte=<fonte>/pv=<codice>/mese=<AAAA-MM>/righe.parquet
+con un manifest.json delle partizioni e dei caricamenti. Un nuovo file di una
+fonte sostituisce le righe dell'archivio comprese nel suo intervallo di date,
+per gli impianti presenti nel file (come l'import incrementale sostituisce le
+giornate del file); le fonti senza codice impianto (pv=tutti) per data soltanto.
+Orchestratore.riesegui() riconcilia dall'archivio senza rileggere gli Excel.
+Richiede pyarrow.
+"""
+import os
+import json
+import time
+import shutil
+import threading
+import datetime
+
+import pandas as pd
+
+from .anagrafica import normalizza_codice
+
+ARCHIVIO_DIR = "archivio_sorgenti"
+MANIFEST = "manifest.json"
+FILE_PARTIZIONE = "righe.parquet"
+
+# fonte -> (colonna data, colonna codice impianto o None, colonne archiviate; None = tutte)
+COLONNE_ARCHIVIO = {
+    'fortech': ('DATA', 'PV', None),
+    'contanti': ('Data_Reale', 'Codice_AS400', ['Data_Reale', 'Importo_Reale', 'Codice_AS400']),
+    'carte': ('Data_Norm', None, ['Data_Norm', 'Importo_Numia']),
+    'petrolifere': ('Data_Norm', 'Punto_Clean', ['Punto_Clean', 'Data_Norm', 'Importo_Portal']),
+    'buoni': ('Data_Registrazione_iP', 'Punto_Clean', ['Punto_Clean', 'Data_Registrazione_iP', 'Importo_Reale']),
+    'satispay': ('Data_Norm', 'Codice_Satispay', ['Codice_Satispay', 'Punto_Clean', 'Data_Norm', 'Importo_Satispay']),
+}
+
+# Colonne di servizio: ordine originale delle righe (stesse somme e abbinamenti del run da file)
+COL_CARICAMENTO = '_caricamento'
+COL_RIGA = '_riga'
+
+_lock = threading.Lock()
+
+
+def _percorso(radice, *parti):
+    return os.path.join(radice, *parti)
+
+
+def _leggi_manifest(radice):
+    try:
+        with open(_percorso(radice, MANIFEST), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"partizioni": {}, "caricamenti": []}
+
+
+def _scrivi_manifest(radice, manifest):
+    tmp = _percorso(radice, MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, _percorso(radice, MANIFEST))
+
+
+def _codice_partizione(valore):
+    codice = normalizza_codice(valore)
+    return codice.replace("/", "_").replace("\\", "_") if codice else "nd"
+
+
+def _frame_archivio(fonte, df):
+    """Colonne archiviate della fonte, righe senza data escluse (i motori le scartano comunque)."""
+    col_data, col_codice, colonne = COLONNE_ARCHIVIO[fonte]
+    colonne = list(df.columns) if colonne is None else [c for c in colonne if c in df.columns]
+    out = df[colonne].copy()
+    out[COL_RIGA] = range(len(out))
+    out = out[out[col_data].notna()]
+    # Codici come testo normalizzato: i lookup dell'anagrafica normalizzano allo stesso modo
+    if col_codice in out.columns and out[col_codice].dtype == object:
+        out[col_codice] = out[col_codice].map(normalizza_codice)
+    return out
+
+
+def archivia(fonte, df, file_origine=None, radice=ARCHIVIO_DIR):
+    """
+    Salva le righe normalizzate della fonte nell'archivio: le righe gia'
+    archiviate nell'intervallo di date del frame vengono sostituite, solo nelle
+    partizioni degli impianti presenti nel frame.
+    Ritorna il numero di righe archiviate.
+    """
+    col_data, col_codice, _ = COLONNE_ARCHIVIO[fonte]
+    nuove = _frame_archivio(fonte, df)
+    if nuove.empty:
+        return 0
+    da, a = nuove[col_data].min(), nuove[col_data].max()
+    caricamento = time.time_ns()
+    nuove[COL_CARICAMENTO] = caricamento
+
+    mese = nuove[col_data].dt.strftime("%Y-%m")
+    codice = nuove[col_codice].map(_codice_partizione) if col_codice in nuove.columns else pd.Series("tutti", index=nuove.index)
+
+    with _lock:
+        os.makedirs(radice, exist_ok=True)
+        manifest = _leggi_manifest(radice)
+        partizioni = manifest["partizioni"]
+        mesi_intervallo = set(pd.period_range(da, a, freq="M").strftime("%Y-%m"))
+
+        # Partizioni esistenti della fonte che si sovrappongono all'intervallo del file,
+        # solo per gli impianti presenti nel file: gli altri restano intatti
+        prefisso = f"fonte={fonte}/"
+        codici = set(codice.unique())
+        toccate = {
+            chiave for chiave, info in partizioni.items()
+            if info["fonte"] == fonte and info["mese"] in mesi_intervallo and info["pv"] in codici
+        }
+        gruppi = dict(tuple(nuove.groupby([codice, mese])))
+        toccate |= {f"{prefisso}pv={c}/mese={m}" for c, m in gruppi}
+
+        for chiave in sorted(toccate):
+            path = _percorso(radice, chiave, FILE_PARTIZIONE)
+            _, pv, m = chiave.split("/")
+            parti = []
+            if os.path.exists(path):
+                esistenti = pd.read_parquet(path)
+                parti.append(esistenti[(esistenti[col_data] < da) | (esistenti[col_data] > a)])
+            gruppo = gruppi.get((pv[3:], m[5:]))
+            if gruppo is not None:
+                parti.append(gruppo)
+            righe = pd.concat(parti, ignore_index=True) if parti else None
+            if righe is None or righe.empty:
+                shutil.rmtree(_percorso(radice, chiave), ignore_errors=True)
+                partizioni.pop(chiave, None)
+                continue
+            os.makedirs(_percorso(radice, chiave), exist_ok=True)
+            righe.to_parquet(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+            partizioni[chiave] = {
+                "fonte": fonte, "pv": pv[3:], "mese": m[5:], "righe": len(righe),
+                "da": str(righe[col_data].min().date()), "a": str(righe[col_data].max().date()),
+            }
+
+        manifest["caricamenti"].append({
+            "id": caricamento, "fonte": fonte, "file": file_origine, "righe": len(nuove),
+            "da": str(da.date()), "a": str(a.date()),
+            "il": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        _scrivi_manifest(radice, manifest)
+    return len(nuove)
+
+
+def fonti_archiviate(radice=ARCHIVIO_DIR):
+    return sorted({info["fonte"] for info in _leggi_manifest(radice)["partizioni"].values()})
+
+
+def carica(fonte, da=None, a=None, radice=ARCHIVIO_DIR):
+    """
+    Righe archiviate della fonte (opzionalmente tra le date da/a), nell'ordine
+    di caricamento e di riga originale. None se la fonte non e' in archivio.
+    """
+    col_data = COLONNE_ARCHIVIO[fonte][0]
+    da = pd.Timestamp(da) if da else None
+    a = pd.Timestamp(a) if a else None
+    with _lock:
+        partizioni = _leggi_manifest(radice)["partizioni"]
+        parti = []
+        for chiave, info in sorted(partizioni.items()):
+            if info["fonte"] != fonte:
+                continue
+            if (da is not None and pd.Timestamp(info["a"]) < da) or (a is not None and pd.Timestamp(info["da"]) > a):
+                continue
+            parti.append(pd.read_parquet(_percorso(radice, chiave, FILE_PARTIZIONE)))
+    if not parti:
+        return None
+    df = pd.concat(parti, ignore_index=True)
+    if da is not None:
+        df = df[df[col_data] >= da]
+    if a is not None:
+        df = df[df[col_data] <= a]
+    df = df.sort_values([COL_CARICAMENTO, COL_RIGA], kind="stable")
+    return df.drop(columns=[COL_CARICAMENTO, COL_RIGA]).reset_index(drop=True)
+
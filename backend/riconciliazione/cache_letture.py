@@ -0,0 +1,109 @@
+"""
+Cache dei file sorgente gia' letti, indicizzata per contenuto.
+Il frame normalizzato di un loader (colonne usate dai motori, vedi
+archivio.COLONNE_ARCHIVIO, e chiavi naturali per unire piu' file) viene salvato in
+    cache_sorgenti/<fonte>-<sha256 del file>.parquet
+Un file ricaricato identico (stesso AS400, Numia, iP Portal insieme a un nuovo
+Fortech) non viene riletto. Lo SHA-256 dei file caricati e' calcolato mentre
+api_upload li salva. La dimensione totale resta sotto cache_sorgenti_mb
+(config.json; 0 = cache disattivata) eliminando i file usati meno di recente:
+a ogni lettura riuscita si aggiorna l'mtime.
+Un errore della cache non blocca mai la lettura del file.
+"""
+import os
+import hashlib
+import threading
+
+import pandas as pd
+
+from .configurazione import valore
+from .archivio import COLONNE_ARCHIVIO
+
+CACHE_DIR = "cache_sorgenti"
+BYTE_PER_BLOCCO = 1024 * 1024
+
+# Da incrementare quando cambiano i loader di sorgenti.py: invalida i frame salvati
+VERSIONE = 2
+
+_lock = threading.Lock()
+
+
+def limite_byte():
+    return valore("cache_sorgenti_mb") * 1024 * 1024
+
+
+def hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for blocco in iter(lambda: f.read(BYTE_PER_BLOCCO), b""):
+            sha.update(blocco)
+    return sha.hexdigest()
+
+
+def salva_upload(stream, path):
+    """Scrive lo stream del file caricato in path calcolandone lo SHA-256; ritorna l'hash."""
+    sha = hashlib.sha256()
+    with open(path, "wb") as f:
+        for blocco in iter(lambda: stream.read(BYTE_PER_BLOCCO), b""):
+            sha.update(blocco)
+            f.write(blocco)
+    return sha.hexdigest()
+
+
+def _percorso(fonte, sha, radice):
+    return os.path.join(radice, f"{fonte}-v{VERSIONE}-{sha}.parquet")
+
+
+def leggi(fonte, sha, radice=CACHE_DIR):
+    """Frame salvato per il file con questo hash, None se assente o cache disattivata."""
+    if not sha or limite_byte() <= 0:
+        return None
+    path = _percorso(fonte, sha, radice)
+    try:
+        df = pd.read_parquet(path)
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Cache sorgenti: {os.path.basename(path)} illeggibile ({e})")
+        return None
+    return df
+
+
+def salva(fonte, sha, df, altre_colonne=(), radice=CACHE_DIR):
+    """
+    Salva le colonne dei motori (piu' altre_colonne, ad es. le chiavi naturali)
+    e libera spazio oltre il limite.
+    """
+    limite = limite_byte()
+    if not sha or limite <= 0:
+        return
+    colonne = list(dict.fromkeys(COLONNE_ARCHIVIO[fonte][2] + list(altre_colonne)))
+    path = _percorso(fonte, sha, radice)
+    try:
+        with _lock:
+            os.makedirs(radice, exist_ok=True)
+            df[[c for c in colonne if c in df.columns]].to_parquet(path + ".tmp")
+            os.replace(path + ".tmp", path)
+            _sfoltisci(radice, limite)
+    except Exception as e:
+        print(f"Cache sorgenti: {fonte} non salvato ({e})")
+        try:
+            os.remove(path + ".tmp")
+        except OSError:
+            pass
+
+
+def _sfoltisci(radice, limite):
+    """Elimina i file meno usati di recente finche' il totale non rientra nel limite."""
+    voci = []
+    for nome in os.listdir(radice):
+        if nome.endswith(".parquet"):
+            st = os.stat(os.path.join(radice, nome))
+            voci.append((st.st_mtime_ns, st.st_size, nome))
+    totale = sum(v[1] for v in voci)
+    for _, dimensione, nome in sorted(voci):
+        if totale <= limite:
+            break
+        os.remove(os.path.join(radice, nome))
+        totale -= dimensione
@@ -0,0 +1,119 @@
+"""
+Riconoscimento del tipo di file sorgente dal contenuto.
+Di ogni file si leggono solo i nomi dei fogli e le prime righe
+(lettori.prime_righe); le celle di testo vengono confrontate con la firma di
+ogni tipo (nomi di colonna e di foglio tipici dell'export). La confidenza e' la
+frazione della firma trovata nel file. Sotto SOGLIA_CONTENUTO si ricade sul
+nome del file (le vecchie regole: "fortech", "numia", "2_", ...).
+"""
+import os
+import glob
+
+from .lettori import prime_righe
+
+ESTENSIONI = ("*.xlsx", "*.xls", "*.csv")
+
+# tipo -> celle (minuscole, spazi normalizzati) tipiche dell'export
+FIRME = {
+    'fortech': frozenset({
+        'vendite', 'incassi', 'codicepv', 'datacontabile', 'statogiornata', 'corrispettivo totale',
+        'contanti', 'bancomat gestore', 'carta credito gestore', 'cartapetrolifera', 'buoni',
+        'pagamentiinnovativi', 'pagobancomat',
+    }),
+    'contanti': frozenset({
+        'wgrec01', 'registrazione//data', 'registrazione//tipo', 'registrazione//numero', 'c.d.c.',
+        'importo segnato', 'progressivo', 'documento//tipo', 'documento//data', 'data comp.',
+        'data val.', 'intestatario//codice',
+    }),
+    'carte': frozenset({
+        'transazioni', 'data e ora', 'codice autorizzazione', 'numero carta', 'circuito',
+        'tipo transazione', 'stato operazione', 'importo in valuta originale', 'importo cashback',
+        'id punto vendita', 'mid', 'id terminale / tml', 'alias terminale',
+    }),
+    'petrolifere': frozenset({
+        'transazioni fuelcard rimborsate', 'gestore', 'pv', 'data operazione', 'ora operazione',
+        'circuito', 'cod. prod.', 'prodotto', 'riferimento scontrino', 'quantità', 'prezzo',
+        'segno', 'numero fattura', 'data fattura',
+    }),
+    'buoni': frozenset({
+        'dettaglio transazioni buoni', 'data documento', 'codice cliente', 'ragione sociale cliente',
+        'numero documento', 'data registrazione documento', 'punto vendita', 'serial number',
+        'stato buono', 'descrizione esercente', 'pan', 'auth code',
+    }),
+    'satispay': frozenset({
+        'payment report', 'id transazione', 'data transazione', 'negozio', 'codice negozio',
+        'importo totale', 'totale commissioni', 'tipo transazione', 'codice transazione', 'id gruppo',
+    }),
+}
+
+SOGLIA_CONTENUTO = 0.4
+
+
+def _normalizza(valore):
+    return " ".join(str(valore).split()).lower()
+
+
+def punteggi(file_path):
+    """{tipo: frazione della firma presente tra fogli e prime righe del file}."""
+    celle = set()
+    for foglio, righe in prime_righe(file_path).items():
+        if isinstance(foglio, str):
+            celle.add(_normalizza(foglio))
+        for riga in righe:
+            celle.update(_normalizza(v) for v in riga if isinstance(v, str) and v.strip())
+    return {tipo: len(firma & celle) / len(firma) for tipo, firma in FIRME.items()}
+
+
+def tipo_da_nome(nome_file):
+    """Tipo dedotto dal solo nome del file (None se non riconosciuto)."""
+    nome_file = nome_file.lower()
+    nome_norm = nome_file.replace("_", " ")
+    if "fortech" in nome_norm or nome_file.startswith("a_"):
+        return 'fortech'
+    if "contanti" in nome_norm or nome_file.startswith("1_"):
+        return 'contanti'
+    if ("carte bancarie" in nome_norm or "numia" in nome_norm or nome_file.startswith("2_")) and "petrolifere" not in nome_norm:
+        return 'carte'
+    if "petrolifere" in nome_norm or "azzurro" in nome_norm or nome_file.startswith("3_"):
+        return 'petrolifere'
+    if "buoni" in nome_norm or "rosso" in nome_norm or nome_file.startswith("4_"):
+        return 'buoni'
+    if "satispay" in nome_norm or "grigio" in nome_norm or nome_file.startswith("5_"):
+        return 'satispay'
+    return None
+
+
+def classifica(file_path):
+    """
+    {"file", "tipo", "confidenza", "metodo"}: metodo 'contenuto' se la firma
+    migliore supera SOGLIA_CONTENUTO, altrimenti 'nome' (o tipo None).
+    """
+    nome = os.path.basename(file_path)
+    try:
+        p = punteggi(file_path)
+    except Exception as e:
+        print(f"Classificazione: {nome} illeggibile ({e})")
+        p = {}
+    tipo, confidenza = max(p.items(), key=lambda x: x[1], default=(None, 0.0))
+    metodo = 'contenuto'
+    if confidenza < SOGLIA_CONTENUTO:
+        tipo = tipo_da_nome(nome)
+        confidenza = p.get(tipo, 0.0)
+        metodo = 'nome' if tipo else None
+    return {"file": nome, "tipo": tipo, "confidenza": round(confidenza, 2), "metodo": metodo}
+
+
+def classifica_cartella(input_dir):
+    """
+    Classifica tutti i file della cartella. Ritorna ({tipo: [path]}, esiti):
+    ogni tipo puo' avere piu' file (periodi o terminali diversi), in ordine di nome.
+    """
+    percorsi = sorted(p for est in ESTENSIONI for p in glob.glob(os.path.join(input_dir, est)))
+    esiti = []
+    file_per_tipo = {}
+    for path in percorsi:
+        esito = classifica(path)
+        esiti.append(esito)
+        if esito["tipo"]:
+            file_per_tipo.setdefault(esito["tipo"], []).append(path)
+    return file_per_tipo, esiti
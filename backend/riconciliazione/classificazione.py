@@ -0,0 +1,63 @@
+"""
+Classificazione vettoriale dello stato di riconciliazione, condivisa dai motori.
+Lavora su colonne intere (np.select) invece che riga per riga.
+"""
+import numpy as np
+import pandas as pd
+
+from .db_manager import COLONNE_REPORT
+
+
+def classifica_stato(teo, rea, tolleranza_stretta, tolleranza_larga):
+    """
+    Scala comune a tutti i motori, applicata a intere colonne:
+      teorico e reale a zero              -> QUADRATO
+      reale assente/zero con teorico > 0  -> NON_TROVATO
+      |differenza| <= tolleranza_stretta  -> QUADRATO
+      |differenza| <= tolleranza_larga    -> ANOMALIA_LIEVE
+      altrimenti                          -> ANOMALIA_GRAVE
+    Le bande di tolleranza sono quelle della categoria (vedi i singoli motori).
+    """
+    teo = np.asarray(teo, dtype=float)
+    rea = np.asarray(rea, dtype=float)
+    diff_abs = np.abs(teo - rea)
+    condizioni = [
+        (teo == 0) & (rea == 0),
+        np.isnan(rea) | ((teo > 0) & (rea == 0)),
+        diff_abs <= tolleranza_stretta,
+        diff_abs <= tolleranza_larga,
+    ]
+    scelte = ["QUADRATO", "NON_TROVATO", "QUADRATO", "ANOMALIA_LIEVE"]
+    return np.select(condizioni, scelte, default="ANOMALIA_GRAVE")
+
+
+def testo_percentuale(teo, rea):
+    """Differenza percentuale come testo ('-350.67'), '0' quando il teorico non e' positivo."""
+    teo = pd.Series(np.asarray(teo, dtype=float))
+    diff = teo - np.asarray(rea, dtype=float)
+    perc = np.round(diff / teo.where(teo > 0) * 100, 2)
+    return perc.astype(str).where(teo > 0, "0")
+
+
+def note_per_stato(stato, note_stato, default=""):
+    """Sceglie la nota in base allo stato; i valori di note_stato possono essere stringhe o colonne."""
+    stato = np.asarray(stato)
+    condizioni = [stato == s for s in note_stato]
+    scelte = [np.asarray(v, dtype=object) for v in note_stato.values()]
+    return np.select(condizioni, scelte, default=np.asarray(default, dtype=object))
+
+
+def frame_report(df, impianto_id, categoria, col_data, col_teo, col_rea, stato, note):
+    """DataFrame di record pronto per salva_report_riconciliazioni."""
+    teo = df[col_teo].to_numpy(dtype=float)
+    rea = df[col_rea].to_numpy(dtype=float) if col_rea else np.zeros(len(df))
+    return pd.DataFrame({
+        'impianto_id': impianto_id,
+        'data_riferimento': df[col_data].dt.strftime("%Y-%m-%d").to_numpy(),
+        'categoria': categoria,
+        'valore_fortech': teo,
+        'valore_reale': rea,
+        'differenza': teo - rea,
+        'stato': stato,
+        'note': note,
+    }, columns=list(COLONNE_REPORT))
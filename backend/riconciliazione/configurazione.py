@@ -0,0 +1,102 @@
+"""
+Configurazione della riconciliazione (backend/config.json) in memoria.
+Il file viene letto e validato una volta sola; la copia in cache resta valida
+finche' l'mtime del file non cambia o finche' non si chiama ricarica() (POST di
+/api/settings/config). I default e le bande di tolleranza per categoria stanno
+solo qui.
+"""
+import os
+import json
+import threading
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.json")
+
+# chiave -> (default, conversione, valori ammessi o None)
+PARAMETRI = {
+    "tolleranza_contanti_arrotondamento": (5.00, float, None),
+    "tolleranza_carte_fisiologica": (0.50, float, None),
+    "tolleranza_satispay": (0.01, float, None),
+    "scarto_giorni_buoni": (1, int, None),
+    "scarto_giorni_contanti_inf": (3, int, None),
+    "scarto_giorni_contanti_sup": (7, int, None),
+    "modalita_abbinamento_contanti": ("greedy", str, ("greedy", "ottimo")),
+    "modalita_import_fortech": ("incrementale", str, ("incrementale", "completo")),
+    "worker_riconciliazione": (1, int, None),
+    "lettore_excel": ("auto", str, ("auto", "calamine", "openpyxl")),
+    "cache_sorgenti_mb": (256, int, None),
+}
+
+# categoria report -> (chiave della tolleranza stretta, tolleranza larga fissa)
+BANDE_TOLLERANZA = {
+    "contanti": ("tolleranza_contanti_arrotondamento", 20.00),
+    "carte_bancarie": ("tolleranza_carte_fisiologica", 5.00),
+    "carte_petrolifere": ("tolleranza_carte_fisiologica", 10.00),
+    "buoni_ip": ("tolleranza_carte_fisiologica", 10.00),
+    "satispay": ("tolleranza_satispay", 5.00),
+}
+
+_lock = threading.Lock()
+_cache = {"firma": None, "valori": None}
+
+
+def valida(cfg):
+    """
+    Valori tipizzati per tutte le chiavi di PARAMETRI: le chiavi mancanti o non
+    valide (tipo errato, negative, fuori dai valori ammessi) prendono il default.
+    Le chiavi sconosciute vengono mantenute cosi' come sono.
+    """
+    valori = dict(cfg)
+    for chiave, (default, conversione, ammessi) in PARAMETRI.items():
+        if chiave not in cfg:
+            valori[chiave] = default
+            continue
+        try:
+            valore = conversione(cfg[chiave])
+        except (TypeError, ValueError):
+            valore = None
+        if valore is None or (ammessi and valore not in ammessi) or (conversione is not str and valore < 0):
+            print(f"Config: valore non valido per {chiave} ({cfg[chiave]!r}), uso {default!r}")
+            valore = default
+        valori[chiave] = valore
+    return valori
+
+
+def _firma_file():
+    try:
+        st = os.stat(CONFIG_PATH)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def configurazione():
+    """Configurazione validata, riletta dal disco solo se config.json e' cambiato."""
+    firma = _firma_file()
+    with _lock:
+        if _cache["valori"] is None or _cache["firma"] != firma:
+            cfg = {}
+            try:
+                with open(CONFIG_PATH, "r") as f:
+                    cfg = json.load(f)
+            except (OSError, ValueError):
+                pass
+            _cache["valori"] = valida(cfg if isinstance(cfg, dict) else {})
+            _cache["firma"] = firma
+        return dict(_cache["valori"])
+
+
+def valore(chiave):
+    return configurazione()[chiave]
+
+
+def bande_tolleranza(categoria):
+    """(tolleranza_stretta, tolleranza_larga) della categoria di report."""
+    chiave, larga = BANDE_TOLLERANZA[categoria]
+    return valore(chiave), larga
+
+
+def ricarica():
+    """Invalida la cache (da chiamare dopo aver scritto config.json)."""
+    with _lock:
+        _cache["valori"] = None
+        _cache["firma"] = None
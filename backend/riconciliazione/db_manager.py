@@ -1,62 +1,350 @@
+import os
+import queue
 import sqlite3
+import threading
 import pandas as pd
 import datetime
+from .aggregati import assicura_aggregati
+from urllib.request import pathname2url
 
-def get_db_connection(db_path):
-    conn = sqlite3.connect(db_path)
+# Attesa massima (secondi) su un database bloccato da un altro writer
+TIMEOUT_BUSY = 30
+
+PRAGMA_CONNESSIONE = (
+    "PRAGMA synchronous = NORMAL",     # sicuro in WAL, un fsync per checkpoint invece che per commit
+    "PRAGMA cache_size = -32000",      # ~32 MB di page cache per connessione
+    "PRAGMA mmap_size = 268435456",    # letture via mmap fino a 256 MB
+    "PRAGMA temp_store = MEMORY",
+)
+
+# Connessioni libere tenute da ogni pool
+DIMENSIONE_POOL = 8
+
+
+def _configura(conn):
     conn.row_factory = sqlite3.Row
+    for pragma in PRAGMA_CONNESSIONE:
+        conn.execute(pragma)
     return conn
 
-def get_impianto_id(conn, pv_code):
+
+def get_db_connection(db_path):
+    conn = sqlite3.connect(db_path, timeout=TIMEOUT_BUSY)
+    return _configura(conn)
+
+
+def attiva_wal(db_path):
     """
-    Trova l'id dell'impianto corrispondente al pv_code nella tabella 'impianti'.
-    Ritorna None se non trovato.
+    Mette il database in journal_mode=WAL (persistente nel file): le letture della
+    dashboard non vengono bloccate mentre un upload scrive.
     """
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM impianti WHERE codice_pv_fortech = ?", (str(pv_code),))
-    row = cur.fetchone()
-    return row['id'] if row else None
+    conn = sqlite3.connect(db_path, timeout=TIMEOUT_BUSY)
+    try:
+        return conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    finally:
+        conn.close()
+
+
+class ConnessionePool(sqlite3.Connection):
+    """Connessione di un PoolConnessioni: close() la restituisce al pool invece di chiuderla."""
+
+    pool = None
+
+    def close(self):
+        if self.pool is not None and self.pool._restituisci(self):
+            return
+        super().close()
 
-def salva_report_riconciliazione(conn, record):
+
+class PoolConnessioni:
     """
-    Inserisce una singola riga nella tabella report_riconciliazioni.
-    Record dict deve contenere:
-        impianto_id, data_riferimento, categoria, valore_fortech,
-        valore_reale, differenza, stato, note (opzionale)
+    Pool di connessioni SQLite gia' configurate (pragma, row_factory) per un database.
+    sola_lettura apre le connessioni con l'URI mode=ro: qualunque scrittura fallisce.
+    Le connessioni aperte prima di un fork non vengono riusate nel processo figlio.
+    """
+
+    def __init__(self, db_path, sola_lettura=False, dimensione=DIMENSIONE_POOL):
+        self.db_path = os.path.abspath(db_path)
+        self.sola_lettura = sola_lettura
+        self._libere = queue.LifoQueue(maxsize=dimensione)
+        self._pid = os.getpid()
+
+    def _apri(self):
+        if self.sola_lettura:
+            uri = f"file:{pathname2url(self.db_path)}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=TIMEOUT_BUSY,
+                                   factory=ConnessionePool, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=TIMEOUT_BUSY,
+                                   factory=ConnessionePool, check_same_thread=False)
+        _configura(conn)
+        conn.pool = self
+        return conn
+
+    def connessione(self):
+        if os.getpid() != self._pid:
+            # Processo figlio: le connessioni del padre non si possono usare
+            self._libere = queue.LifoQueue(maxsize=self._libere.maxsize)
+            self._pid = os.getpid()
+        try:
+            return self._libere.get_nowait()
+        except queue.Empty:
+            return self._apri()
+
+    def _restituisci(self, conn):
+        if os.getpid() != self._pid:
+            return False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = sqlite3.Row
+            self._libere.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.pool = None
+            return False
+        return True
+
+
+_POOL = {}
+_lock_pool = threading.Lock()
+
+
+def connessione_pool(db_path, sola_lettura=False):
+    """
+    Connessione dal pool del database (uno per path e modalita'); va chiusa con
+    close() come una connessione normale, che la rimette nel pool.
+    """
+    chiave = (os.path.abspath(db_path), sola_lettura)
+    with _lock_pool:
+        pool = _POOL.get(chiave)
+        if pool is None:
+            pool = _POOL[chiave] = PoolConnessioni(db_path, sola_lettura)
+    return pool.connessione()
+
+COLONNE_FORTECH_MASTER = (
+    'impianto_id', 'codice_pv', 'data_contabile', 'data_inizio', 'data_fine', 'stato_giornata',
+    'corrispettivo_totale',
+    'corrispettivo_verde',
+    'volume_verde_fai_da_te', 'importo_verde_fai_da_te', 'prezzo_verde_fai_da_te',
+    'volume_verde_servito', 'importo_verde_servito', 'prezzo_verde_servito',
+    'volume_verde_prepay', 'importo_verde_prepay', 'prezzo_verde_prepay',
+    'corrispettivo_diesel',
+    'volume_diesel_fai_da_te', 'importo_diesel_fai_da_te', 'prezzo_diesel_fai_da_te',
+    'volume_diesel_servito', 'importo_diesel_servito', 'prezzo_diesel_servito',
+    'volume_diesel_prepay', 'importo_diesel_prepay', 'prezzo_diesel_prepay',
+    'corrispettivo_adblue', 'corrispettivo_adblue_confezione', 'corrispettivo_liquido_radiatore',
+    'corrispettivo_lubrificanti', 'corrispettivo_lavavetri',
+    'fatture_postpagate_totale', 'fatture_prepagate_totale',
+    'fatture_immediate_totale', 'fatture_differite_totale', 'buoni_totale',
+    'incasso_carte_bancarie_teorico', 'incasso_carte_petrolifere_teorico',
+    'incasso_buoni_teorico', 'incasso_satispay_teorico',
+    'incasso_credito_finemese_teorico', 'incasso_contanti_teorico',
+    'file_origine',
+)
+
+def leggi_contanti_fortech(conn, da, a):
+    """Righe (impianto_id, data_contabile, incasso_contanti_teorico) del master tra da e a ('AAAA-MM-GG')."""
+    return conn.execute(
+        "SELECT impianto_id, data_contabile, incasso_contanti_teorico FROM import_fortech_master "
+        "WHERE data_contabile BETWEEN ? AND ?", (da, a)
+    ).fetchall()
+
+# Colonne sommate sulle righe Incassi di uno stesso impianto e giorno (ad es. turni
+# separati), come fa la riconciliazione; le colonne di Vendite sono gia' per giorno
+COLONNE_FORTECH_SOMMA = ('corrispettivo_totale',) + tuple(c for c in COLONNE_FORTECH_MASTER if c.startswith('incasso_'))
+
+def _righe_tabella(df, colonne):
+    """DataFrame -> tuple per executemany nell'ordine di colonne, con NaN/NaT come NULL."""
+    df = df.reindex(columns=colonne).astype(object)
+    return list(df.where(df.notna(), None).itertuples(index=False, name=None))
+
+def _sql_upsert(tabella, colonne, chiave):
+    """INSERT ... ON CONFLICT(chiave) DO UPDATE di tutte le altre colonne."""
+    aggiorna = ",\n        ".join(f"{c} = excluded.{c}" for c in colonne if c not in chiave)
+    return (
+        f"INSERT INTO {tabella} ({', '.join(colonne)})\n"
+        f"    VALUES ({', '.join('?' * len(colonne))})\n"
+        f"    ON CONFLICT({', '.join(chiave)}) DO UPDATE SET\n        {aggiorna}"
+    )
+
+SQL_UPSERT_FORTECH_MASTER = _sql_upsert(
+    'import_fortech_master', COLONNE_FORTECH_MASTER, ('impianto_id', 'data_contabile')
+) + ",\n        data_importazione = CURRENT_TIMESTAMP"
+
+def salva_import_fortech_master(conn, df_master, sostituisci=True):
+    """
+    Scrive df_master (colonne di COLONNE_FORTECH_MASTER, le mancanti restano NULL)
+    in import_fortech_master con un unico executemany, in una sola transazione.
+    sostituisci=True: svuota prima la tabella (import completo);
+    sostituisci=False: UPSERT dei soli giorni presenti, lo storico resta (import incrementale).
+    """
+    righe = _righe_tabella(df_master, COLONNE_FORTECH_MASTER)
+    with conn:
+        if sostituisci:
+            conn.execute("DELETE FROM import_fortech_master")
+        conn.executemany(SQL_UPSERT_FORTECH_MASTER, righe)
+    return len(righe)
+
+COLONNE_REPORT = (
+    'impianto_id', 'data_riferimento', 'categoria', 'valore_fortech',
+    'valore_reale', 'differenza', 'stato', 'note'
+)
+
+SQL_UPSERT_REPORT = """
+    INSERT INTO report_riconciliazioni
+    (impianto_id, data_riferimento, categoria, valore_fortech, valore_reale, differenza, stato, note)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(impianto_id, data_riferimento, categoria) DO UPDATE SET
+        valore_fortech = excluded.valore_fortech,
+        valore_reale = excluded.valore_reale,
+        differenza = excluded.differenza,
+        stato = excluded.stato,
+        note = excluded.note,
+        data_elaborazione = CURRENT_TIMESTAMP
+"""
+
+SQL_META_VERSIONI = (
+    """
+    CREATE TABLE IF NOT EXISTS meta_versioni (
+        chiave VARCHAR(50) PRIMARY KEY,
+        versione INTEGER NOT NULL DEFAULT 0,
+        aggiornato_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "INSERT OR IGNORE INTO meta_versioni (chiave, versione) VALUES ('impianti', 0)",
+    # 'dati': report e master Fortech, incrementata da orchestratore ed endpoint di modifica
+    "INSERT OR IGNORE INTO meta_versioni (chiave, versione) VALUES ('dati', 0)",
+) + tuple(
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_impianti_versione_{evento.lower()}
+    AFTER {evento} ON impianti
+    BEGIN
+        UPDATE meta_versioni SET versione = versione + 1, aggiornato_il = CURRENT_TIMESTAMP
+        WHERE chiave = 'impianti';
+    END
+    """
+    for evento in ('INSERT', 'UPDATE', 'DELETE')
+)
+
+def incrementa_versione(conn, chiave):
+    """Incrementa la versione di meta_versioni (non esegue commit)."""
+    conn.execute("""
+        INSERT INTO meta_versioni (chiave, versione) VALUES (?, 1)
+        ON CONFLICT(chiave) DO UPDATE SET versione = versione + 1, aggiornato_il = CURRENT_TIMESTAMP
+    """, (chiave,))
+
+def leggi_versioni(conn):
+    """{chiave: (versione, aggiornato_il)} di meta_versioni."""
+    return {
+        chiave: (versione, aggiornato_il)
+        for chiave, versione, aggiornato_il in conn.execute("SELECT chiave, versione, aggiornato_il FROM meta_versioni")
+    }
+
+SQL_INSERT_REPORT_SE_ASSENTE = """
+    INSERT INTO report_riconciliazioni
+    (impianto_id, data_riferimento, categoria, valore_fortech, valore_reale, differenza, stato, note)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(impianto_id, data_riferimento, categoria) DO NOTHING
+"""
+
+# (nome indice, tabella, colonne): chiavi univoche usate dagli UPSERT
+INDICI_UNIVOCI = (
+    ('ux_report_impianto_data_categoria', 'report_riconciliazioni', ('impianto_id', 'data_riferimento', 'categoria')),
+    ('ux_fortech_impianto_data', 'import_fortech_master', ('impianto_id', 'data_contabile')),
+)
+
+# tabella -> {colonna: funzione SQL}: prima di creare l'indice univoco i duplicati
+# vengono aggregati nella riga piu' recente invece di essere solo eliminati
+AGGREGA_DUPLICATI = {
+    'import_fortech_master': {
+        **{c: 'SUM' for c in COLONNE_FORTECH_SOMMA},
+        'data_inizio': 'MIN', 'data_fine': 'MAX',
+    },
+}
+
+# (nome indice, tabella, colonne): indici di lettura per le API della dashboard
+INDICI = (
+    # Copre le subquery correlate dei conteggi per stato di /api/impianti
+    # (impianto_id = ? AND stato = ? [AND risolto = 0]): ricerche solo-indice
+    ('idx_report_impianto_stato', 'report_riconciliazioni', ('impianto_id', 'stato', 'risolto', 'data_riferimento')),
+    # Paginazione keyset per (data_riferimento, id) con i filtri di /api/riconciliazioni:
+    # il rowid in coda a ogni indice da' l'ordine per id a parita' di data
+    ('idx_report_data', 'report_riconciliazioni', ('data_riferimento',)),
+    ('idx_report_impianto_data', 'report_riconciliazioni', ('impianto_id', 'data_riferimento')),
+    ('idx_report_categoria_data', 'report_riconciliazioni', ('categoria', 'data_riferimento')),
+    ('idx_report_stato_data', 'report_riconciliazioni', ('stato', 'data_riferimento')),
+)
+
+def assicura_schema(conn):
+    """
+    Allinea un database esistente allo schema atteso dal motore.
+    - meta_versioni con i trigger che incrementano la versione 'impianti' a ogni
+      modifica dell'anagrafica (invalida la cache di AnagraficaImpianti);
+    - gli UPSERT richiedono gli indici univoci di INDICI_UNIVOCI (report per
+      impianto/giorno/categoria, Fortech per impianto/giorno): prima di crearli si
+      eliminano gli eventuali duplicati storici, tenendo il piu' recente; per le
+      tabelle di AGGREGA_DUPLICATI (piu' righe Incassi dello stesso giorno nel
+      master Fortech) la riga tenuta riceve prima somme e min/max dei duplicati;
+    - gli indici di lettura di INDICI;
+    - le tabelle derivate mantenute dai trigger (aggregati.py).
     """
     cur = conn.cursor()
-    
-    # Controlla se esiste gia per evitare duplicati
-    cur.execute('''
-        SELECT id FROM report_riconciliazioni
-        WHERE impianto_id = ? AND data_riferimento = ? AND categoria = ?
-    ''', (record['impianto_id'], record['data_riferimento'], record['categoria']))
-    esistente = cur.fetchone()
-
-    if esistente:
-        cur.execute('''
-            UPDATE report_riconciliazioni
-            SET valore_fortech = ?, valore_reale = ?, differenza = ?, stato = ?, note = ?, data_elaborazione = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (
-            record['valore_fortech'], record['valore_reale'], record['differenza'], 
-            record['stato'], record.get('note', ''),
-            esistente['id']
-        ))
-    else:
-        cur.execute('''
-            INSERT INTO report_riconciliazioni
-            (impianto_id, data_riferimento, categoria, valore_fortech, valore_reale, differenza, stato, note)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            record['impianto_id'], record['data_riferimento'], record['categoria'],
-            record['valore_fortech'], record['valore_reale'], record['differenza'],
-            record['stato'], record.get('note', '')
-        ))
+    for sql in SQL_META_VERSIONI:
+        cur.execute(sql)
+    for nome, tabella, colonne in INDICI_UNIVOCI:
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (nome,))
+        if cur.fetchone():
+            continue
+        elenco = ", ".join(colonne)
+        aggrega = AGGREGA_DUPLICATI.get(tabella)
+        if aggrega:
+            uguali = " AND ".join(f"d.{c} = {tabella}.{c}" for c in colonne)
+            assegnazioni = ",\n                ".join(
+                f"{c} = (SELECT {funzione}(d.{c}) FROM {tabella} d WHERE {uguali})"
+                for c, funzione in aggrega.items()
+            )
+            cur.execute(f"""
+                UPDATE {tabella} SET
+                {assegnazioni}
+                WHERE id IN (SELECT MAX(id) FROM {tabella} GROUP BY {elenco} HAVING COUNT(*) > 1)
+            """)
+        cur.execute(f"""
+            DELETE FROM {tabella}
+            WHERE id NOT IN (SELECT MAX(id) FROM {tabella} GROUP BY {elenco})
+        """)
+        cur.execute(f"CREATE UNIQUE INDEX {nome} ON {tabella}({elenco})")
+    for nome, tabella, colonne in INDICI:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON {tabella}({', '.join(colonne)})")
+    assicura_aggregati(conn)
     conn.commit()
 
-def pulisci_report_impianto(conn, impianto_id):
+def _righe_report(records):
+    """Converte una lista di dict o un DataFrame di record in tuple pronte per executemany."""
+    if isinstance(records, pd.DataFrame):
+        df = records.reindex(columns=COLONNE_REPORT)
+        df['note'] = df['note'].fillna('')
+        return list(df.astype(object).itertuples(index=False, name=None))
+    return [
+        tuple(r.get('note', '') if c == 'note' else r[c] for c in COLONNE_REPORT)
+        for r in records
+    ]
+
+def salva_report_riconciliazioni(conn, records, sovrascrivi=True):
+    """
+    Scrive in blocco i record di riconciliazione con un unico executemany (UPSERT
+    su impianto_id, data_riferimento, categoria). Non esegue commit: il chiamante
+    decide il perimetro della transazione (una per esecuzione dell'orchestratore).
+    records: lista di dict o DataFrame con le colonne di COLONNE_REPORT (note opzionale).
+    sovrascrivi=False: le celle gia' presenti restano invariate (DO NOTHING).
+    """
+    righe = _righe_report(records)
+    if righe:
+        conn.executemany(SQL_UPSERT_REPORT if sovrascrivi else SQL_INSERT_REPORT_SE_ASSENTE, righe)
+    return len(righe)
+
+def pulisci_report_impianto(conn, impianto_id, commit=True):
     """Rimuove vecchi report prima di una nuova esecuzione per un certo impianto."""
     cur = conn.cursor()
     cur.execute("DELETE FROM report_riconciliazioni WHERE impianto_id = ?", (impianto_id,))
-    conn.commit()
+    if commit:
+        conn.commit()
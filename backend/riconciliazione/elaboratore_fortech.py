@@ -1,20 +1,154 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import datetime
-from .db_manager import get_impianto_id
+from .db_manager import salva_import_fortech_master, COLONNE_FORTECH_SOMMA
+from .lettori import leggi_fogli
+from .sorgenti import THREAD_LETTURA
 
-def elabora_dati_fortech(file_fortech, conn):
+# Colonne del foglio Vendite -> colonne di import_fortech_master
+COLONNE_VENDITE = {
+    'Corrispettivo Totale': 'corrispettivo_totale',
+    'CorrispettivoVerde': 'corrispettivo_verde',
+    'VolumeVerdeFai da te': 'volume_verde_fai_da_te',
+    'ImportoVerdeFai da te': 'importo_verde_fai_da_te',
+    'PrezzoVerdeFai da te': 'prezzo_verde_fai_da_te',
+    'VolumeVerdeServito': 'volume_verde_servito',
+    'ImportoVerdeServito': 'importo_verde_servito',
+    'PrezzoVerdeServito': 'prezzo_verde_servito',
+    'VolumeVerdePrepay': 'volume_verde_prepay',
+    'ImportoVerdePrepay': 'importo_verde_prepay',
+    'PrezzoVerdePrepay': 'prezzo_verde_prepay',
+    'CorrispettivoDiesel': 'corrispettivo_diesel',
+    'VolumeDieselFai da te': 'volume_diesel_fai_da_te',
+    'ImportoDieselFai da te': 'importo_diesel_fai_da_te',
+    'PrezzoDieselFai da te': 'prezzo_diesel_fai_da_te',
+    'VolumeDieselServito': 'volume_diesel_servito',
+    'ImportoDieselServito': 'importo_diesel_servito',
+    'PrezzoDieselServito': 'prezzo_diesel_servito',
+    'VolumeDieselPrepay': 'volume_diesel_prepay',
+    'ImportoDieselPrepay': 'importo_diesel_prepay',
+    'PrezzoDieselPrepay': 'prezzo_diesel_prepay',
+    'CorrispettivoAdBlue': 'corrispettivo_adblue',
+    'CorrispettivoAdBlue Confezione': 'corrispettivo_adblue_confezione',
+    'CorrispettivoLiquido Radiatore': 'corrispettivo_liquido_radiatore',
+    'CorrispettivoLubrificanti': 'corrispettivo_lubrificanti',
+    'CorrispettivoLAVAVETRI': 'corrispettivo_lavavetri',
+    'Fatture Postpagate Totale': 'fatture_postpagate_totale',
+    'Fatture Prepagate Totale': 'fatture_prepagate_totale',
+    'Fatture Immediate Totale': 'fatture_immediate_totale',
+    'Fatture Differite Totale': 'fatture_differite_totale',
+    'Buoni Totale': 'buoni_totale',
+}
+
+def _formatta_datetime(serie, formato):
+    """Colonna di date -> testo per SQLite (None dove la data manca)."""
+    date = pd.to_datetime(serie, errors='coerce', dayfirst=True)
+    return date.dt.strftime(formato).where(date.notna(), None)
+
+def _frame_master(df_orig, df_vendite, anagrafica):
+    """
+    Righe di import_fortech_master calcolate per colonne: impianto_id con un merge
+    sull'anagrafica, date formattate in blocco, volumi/prezzi dal foglio Vendite.
+    Una riga per impianto e giorno: piu' righe Incassi dello stesso giorno (ad es.
+    turni separati) vengono sommate come nella riconciliazione (COLONNE_FORTECH_SOMMA),
+    con il primo inizio e l'ultima fine giornata.
+    Le righe senza impianto in anagrafica o senza data contabile sono escluse.
+    """
+    df = df_orig.merge(anagrafica.tabella_pv(), on='PV', how='inner')
+    df = df[df['DATA'].notna()]
+
+    righe = pd.DataFrame({
+        'impianto_id': df['impianto_id'],
+        'PV': df['PV'],
+        'DATA': df['DATA'],
+        'corrispettivo_totale': df['CorrispettivoTotale'],
+        'incasso_carte_bancarie_teorico': df['CARTE DI CREDITO'],
+        'incasso_carte_petrolifere_teorico': df['CARTA PETROLIFERA'],
+        'incasso_buoni_teorico': df['BUONI_CALCOLATI'],
+        'incasso_satispay_teorico': df['SATISPAY_CALC'],
+        'incasso_contanti_teorico': df['CONTANTI_CALC'],
+        'file_origine': df['FILE_ORIGINE'],
+    })
+    # Colonne facoltative dell'export: se mancano restano NULL nel master
+    if 'CLIENTI CON FATTURA FINE MESE' in df:
+        righe['incasso_credito_finemese_teorico'] = df['CLIENTI CON FATTURA FINE MESE'].fillna(0)
+    if 'DataInizio' in df:
+        righe['data_inizio'] = _formatta_datetime(df['DataInizio'], "%Y-%m-%d %H:%M:%S")
+    if 'DataFine' in df:
+        righe['data_fine'] = _formatta_datetime(df['DataFine'], "%Y-%m-%d %H:%M:%S")
+    if 'StatoGiornata' in df:
+        righe['stato_giornata'] = df['StatoGiornata']
+
+    gruppi = righe.groupby(['impianto_id', 'PV', 'DATA'], sort=False)
+    somme = [c for c in COLONNE_FORTECH_SOMMA if c in righe]
+    altre = {'data_inizio': 'min', 'data_fine': 'max', 'stato_giornata': 'last', 'file_origine': 'last'}
+    # min_count=1: un importo assente in tutte le righe del giorno resta NULL
+    master = pd.concat([
+        gruppi[somme].sum(min_count=1),
+        gruppi.agg({c: f for c, f in altre.items() if c in righe}),
+    ], axis=1).reset_index()
+    master['codice_pv'] = master['PV'].astype('Int64').astype(str)
+    master['data_contabile'] = master['DATA'].dt.strftime("%Y-%m-%d")
+
+    if df_vendite is not None and not df_vendite.empty:
+        colonne = {c: n for c, n in COLONNE_VENDITE.items() if c in df_vendite.columns}
+        vendite = df_vendite[['CodicePV', 'DataContabile'] + list(colonne)].rename(columns=colonne)
+        vendite['PV'] = pd.to_numeric(vendite.pop('CodicePV'), errors='coerce')
+        vendite['DATA'] = pd.to_datetime(vendite.pop('DataContabile'), errors='coerce', dayfirst=True).dt.normalize()
+        vendite = vendite.drop_duplicates(['PV', 'DATA'], keep='last')
+        # Un'unica riga Vendite per (PV, giorno), allineata alle righe del master
+        vendite = master[['PV', 'DATA']].merge(vendite, on=['PV', 'DATA'], how='left')
+        for col in colonne.values():
+            master[col] = vendite[col].to_numpy()
+    return master.drop(columns=['PV', 'DATA'])
+
+
+def _leggi_fortech(file_fortech):
+    """Fogli Incassi (con PV, DATA e FILE_ORIGINE) e Vendite di un file Fortech."""
+    # Vendite (volumi, prezzi, corrispettivi) serve solo per import_fortech_master
+    fogli = leggi_fogli(file_fortech, {
+        'Incassi': None,
+        'Vendite': ['CodicePV', 'DataContabile', *COLONNE_VENDITE],
+    })
+    if 'Incassi' not in fogli:
+        raise ValueError(f"Foglio 'Incassi' assente nel file Fortech {os.path.basename(file_fortech)}")
+    df_orig, df_vendite = fogli['Incassi'], fogli.get('Vendite')
+    df_orig['PV'] = pd.to_numeric(df_orig['CodicePV'], errors='coerce')
+    df_orig['DATA'] = pd.to_datetime(df_orig['DataContabile'], errors='coerce', dayfirst=True).dt.normalize()
+    df_orig['FILE_ORIGINE'] = os.path.basename(file_fortech)
+    return df_orig, df_vendite
+
+
+def _unisci_fortech(letti):
+    """
+    Unisce piu' file Fortech (nell'ordine dei file): per ogni (PV, giorno) valgono
+    le righe Incassi dell'ultimo file che lo contiene, come nell'import
+    incrementale; le righe Vendite doppie sono gia' scartate da _frame_master.
+    """
+    if len(letti) == 1:
+        return letti[0]
+    incassi = pd.concat([df.assign(_file=i) for i, (df, _) in enumerate(letti)], ignore_index=True)
+    ultimo = incassi.groupby(['PV', 'DATA'], dropna=False)['_file'].transform('max')
+    incassi = incassi[incassi['_file'] == ultimo].drop(columns='_file').reset_index(drop=True)
+    vendite = [v for _, v in letti if v is not None]
+    return incassi, (pd.concat(vendite, ignore_index=True) if vendite else None)
+
+
+def elabora_dati_fortech(file_fortech, conn, anagrafica, incrementale=False):
     """
     Estrae i dati Fortech, salva in master se necessario e restituisce 
     un DataFrame raggruppato e la lista dei pv.
+    file_fortech: path o lista di path (ad es. un trimestre di export), letti in parallelo.
+    anagrafica: AnagraficaImpianti dell'esecuzione (codice PV -> impianto_id).
+    incrementale: aggiorna solo le giornate del file invece di ricaricare tutto il master.
     """
     if not file_fortech: return None, []
     print("\n--- AVVIO ESTRAZIONE FORTECH ---")
+    percorsi = [file_fortech] if isinstance(file_fortech, str) else list(file_fortech)
     
     try:
-        df_orig = pd.read_excel(file_fortech, sheet_name='Incassi')
-        
-        df_orig['PV'] = pd.to_numeric(df_orig['CodicePV'], errors='coerce')
-        df_orig['DATA'] = pd.to_datetime(df_orig['DataContabile'], errors='coerce', dayfirst=True).dt.normalize()
+        with ThreadPoolExecutor(max_workers=min(THREAD_LETTURA, len(percorsi))) as pool:
+            df_orig, df_vendite = _unisci_fortech(list(pool.map(_leggi_fortech, percorsi)))
         
         cols_to_fill = ['BANCOMAT GESTORE', 'CARTA CREDITO GESTORE', 'AMEX', 'CARTA CREDITO GENERICA', 
                         'PAGOBANCOMAT', 'TBS', 'DKV', 'UTA', 'CARTAMAXIMA', 'CARTAPETROLIFERA', 
@@ -43,30 +177,8 @@ def elabora_dati_fortech(file_fortech, conn):
         df_final = df_orig[final_cols].copy()
         
         # Salvataggio nel database relazionale master (import_fortech_master)
-        # Svuotiamo i record vecchi per semplicit in questa demo
-        cur = conn.cursor()
-        cur.execute("DELETE FROM import_fortech_master")
-        
-        for idx, row in df_orig.iterrows():
-            pv = row['PV']
-            impianto_id = get_impianto_id(conn, pv)
-            if not impianto_id: continue
-            
-            data_str = row['DATA'].strftime("%Y-%m-%d")
-            
-            # Mettiamo solo i totali principali per mantenere la compatibilita con LavoroGiupponi
-            cur.execute("""
-                INSERT INTO import_fortech_master 
-                (impianto_id, codice_pv, data_contabile, corrispettivo_totale, 
-                 incasso_carte_bancarie_teorico, incasso_carte_petrolifere_teorico, 
-                 incasso_buoni_teorico, incasso_satispay_teorico, incasso_contanti_teorico)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                impianto_id, str(pv), data_str, float(row.get('CorrispettivoTotale', 0)),
-                float(row['CARTE DI CREDITO']), float(row['CARTA PETROLIFERA']),
-                float(row['BUONI_CALCOLATI']), float(row['SATISPAY_CALC']), float(row['CONTANTI_CALC'])
-            ))
-        conn.commit()
+        df_master = _frame_master(df_orig, df_vendite, anagrafica)
+        salva_import_fortech_master(conn, df_master, sostituisci=not incrementale)
 
         # Raggruppamento in corso...
         df_grouped = df_final.groupby(['PV', 'DATA']).sum().reset_index()
@@ -0,0 +1,307 @@
+"""
+Lettura dei file sorgente in righe di valori tipizzati e DataFrame.
+Il formato si riconosce dal contenuto (firma zip = xlsx, OLE = xls, testo = CSV),
+non dall'estensione. Ogni lettore espone fogli() e righe(foglio, colonne); il
+frame e' sempre costruito dalle righe con lo stesso TextParser, cosi' i motori
+ricevono gli stessi DataFrame qualunque sia il lettore:
+- LettoreCalamine: xlsx/xls con python-calamine, se installato;
+- LettoreXlsx: xlsx con openpyxl read_only (iter_rows in streaming);
+- LettoreCsv: csv del modulo standard, separatore e decimali rilevati dal file,
+  date con formati espliciti.
+Il lettore Excel si sceglie con la chiave 'lettore_excel' (auto/calamine/openpyxl).
+"""
+import csv
+import codecs
+import datetime
+import itertools
+
+import numpy as np
+import pandas as pd
+from openpyxl.cell.cell import ERROR_CODES
+from pandas.io.parsers import TextParser
+
+from .configurazione import valore
+
+# Righe esaminate per trovare l'intestazione (gli export hanno al massimo qualche riga di titolo)
+MAX_RIGHE_HEADER = 50
+
+FIRMA_ZIP = b'PK\x03\x04'
+FIRMA_OLE = b'\xd0\xcf\x11\xe0'
+
+# Byte letti per rilevare separatore e codifica di un CSV
+CAMPIONE_CSV = 64 * 1024
+SEPARATORI_CSV = ';,\t|'
+CODIFICHE_CSV = ('utf-8-sig', 'cp1252')
+
+# Formati delle colonne data nei CSV (il primo che legge tutti i valori della colonna)
+FORMATI_DATA_CSV = (
+    '%d/%m/%Y %H:%M:%S.%f', '%d/%m/%Y %H:%M:%S', '%d/%m/%Y %H:%M', '%d/%m/%Y',
+    '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d',
+    '%d-%m-%Y %H:%M:%S', '%d-%m-%Y', '%d.%m.%Y',
+)
+
+
+def _valore_openpyxl(v):
+    """
+    Conversioni di read_excel (OpenpyxlReader._convert_cell) sui valori di
+    iter_rows: vuoto -> "", errore -> NaN, numeri interi -> int.
+    """
+    if v is None:
+        return ""
+    if type(v) is float:
+        return int(v) if v.is_integer() else v
+    if type(v) is str and v in ERROR_CODES:
+        return np.nan
+    return v
+
+
+def _righe_convertite(grezze, converti, colonne=None):
+    """
+    Righe del foglio con i valori convertiti e senza celle vuote in coda.
+    colonne: se indicato, dopo la prima riga (intestazione) si tengono solo le
+    celle delle colonne con quei nomi; le altre restano vuote.
+    """
+    ammesse = None
+    for grezza in grezze:
+        if ammesse is None:
+            riga = [converti(v) for v in grezza]
+            if colonne is not None:
+                ammesse = {i for i, v in enumerate(riga) if v in colonne}
+        else:
+            riga = [converti(v) if i in ammesse else "" for i, v in enumerate(grezza)]
+        while riga and riga[-1] == "":
+            riga.pop()
+        yield riga
+
+
+class LettoreXlsx:
+    """xlsx/xlsm con openpyxl read_only: righe in streaming con iter_rows(values_only=True)."""
+
+    def __init__(self, file_path):
+        from openpyxl import load_workbook
+        self.wb = load_workbook(file_path, read_only=True, data_only=True, keep_links=False)
+
+    def fogli(self):
+        return list(self.wb.sheetnames)
+
+    def righe(self, foglio=0, colonne=None):
+        ws = self.wb.worksheets[foglio] if isinstance(foglio, int) else self.wb[foglio]
+        return _righe_convertite(ws.iter_rows(values_only=True), _valore_openpyxl, colonne)
+
+    def close(self):
+        self.wb.close()
+
+
+def _valore_calamine(v):
+    """Stesse conversioni di _valore_openpyxl: numeri interi -> int, date -> datetime."""
+    if type(v) is float:
+        return int(v) if v.is_integer() else v
+    if type(v) is datetime.date:
+        return datetime.datetime(v.year, v.month, v.day)
+    return v
+
+
+class LettoreCalamine:
+    """xlsx/xls con python-calamine (lettura in Rust, molto piu' veloce di openpyxl)."""
+
+    def __init__(self, file_path):
+        from python_calamine import CalamineWorkbook
+        self.wb = CalamineWorkbook.from_path(file_path)
+
+    def fogli(self):
+        return list(self.wb.sheet_names)
+
+    def righe(self, foglio=0, colonne=None):
+        ws = self.wb.get_sheet_by_index(foglio) if isinstance(foglio, int) else self.wb.get_sheet_by_name(foglio)
+        return _righe_convertite(ws.to_python(skip_empty_area=False), _valore_calamine, colonne)
+
+    def close(self):
+        self.wb.close()
+
+
+def _decodifica_campione(campione, completo):
+    """
+    (codifica, testo) con la prima di CODIFICHE_CSV che decodifica il campione.
+    Se il campione e' stato tagliato a CAMPIONE_CSV byte (completo=False) un
+    carattere multibyte spezzato in fondo non e' un errore: il decoder
+    incrementale lo tiene da parte. Se nessuna codifica va bene vale l'ultima,
+    con i byte non validi sostituiti.
+    """
+    for codifica in CODIFICHE_CSV:
+        try:
+            return codifica, codecs.getincrementaldecoder(codifica)().decode(campione, final=completo)
+        except UnicodeDecodeError:
+            continue
+    return CODIFICHE_CSV[-1], campione.decode(CODIFICHE_CSV[-1], errors='replace')
+
+
+class LettoreCsv:
+    """
+    CSV come foglio unico. Separatore rilevato sul primo blocco; con ';' (export
+    Excel italiano) la virgola e' il separatore decimale e il punto delle migliaia.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            campione = f.read(CAMPIONE_CSV)
+        self.codifica, testo = _decodifica_campione(campione, completo=len(campione) < CAMPIONE_CSV)
+        try:
+            self.separatore = csv.Sniffer().sniff(testo, delimiters=SEPARATORI_CSV).delimiter
+        except csv.Error:
+            self.separatore = ';' if testo.count(';') > testo.count(',') else ','
+        self.decimale, self.migliaia = (',', '.') if self.separatore == ';' else ('.', None)
+
+    def fogli(self):
+        return [0]
+
+    def righe(self, foglio=0, colonne=None):
+        with open(self.file_path, 'r', encoding=self.codifica, errors='replace', newline='') as f:
+            ammesse = None
+            for riga in csv.reader(f, delimiter=self.separatore):
+                if colonne is not None:
+                    if ammesse is None:
+                        ammesse = {i for i, v in enumerate(riga) if v.strip() in colonne}
+                    else:
+                        riga = [v if i in ammesse else "" for i, v in enumerate(riga)]
+                while riga and riga[-1] == "":
+                    riga.pop()
+                yield riga
+
+    def tipizza(self, df):
+        """Colonne di testo che sono tutte date in uno dei FORMATI_DATA_CSV -> datetime."""
+        for col in df.columns[df.dtypes == object]:
+            valori = df[col].dropna()
+            if valori.empty or not all(isinstance(v, str) for v in valori):
+                continue
+            valori = valori.str.strip()
+            for formato in FORMATI_DATA_CSV:
+                date = pd.to_datetime(valori, format=formato, errors='coerce')
+                if date.notna().all():
+                    df[col] = pd.to_datetime(df[col].str.strip(), format=formato, errors='coerce')
+                    break
+        return df
+
+    def close(self):
+        pass
+
+
+def formato_file(file_path):
+    """'xlsx', 'xls' o 'csv' dai primi byte del file."""
+    with open(file_path, 'rb') as f:
+        testa = f.read(8)
+    if testa.startswith(FIRMA_ZIP):
+        return 'xlsx'
+    if testa.startswith(FIRMA_OLE):
+        return 'xls'
+    return 'csv'
+
+
+def calamine_disponibile():
+    try:
+        import python_calamine  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def apri_lettore(file_path):
+    """Lettore adatto al contenuto del file (vedi docstring del modulo)."""
+    formato = formato_file(file_path)
+    if formato == 'csv':
+        return LettoreCsv(file_path)
+    scelta = valore("lettore_excel")
+    if scelta == 'calamine' or (scelta == 'auto' and calamine_disponibile()) or formato == 'xls':
+        return LettoreCalamine(file_path)
+    return LettoreXlsx(file_path)
+
+
+def prime_righe(file_path, n=MAX_RIGHE_HEADER):
+    """
+    {foglio: prime n righe} di tutti i fogli (un CSV ha il solo foglio 0), per
+    riconoscere il tipo di file senza leggerlo tutto. Gli xlsx usano sempre il
+    lettore openpyxl in streaming: calamine caricherebbe l'intero foglio.
+    """
+    formato = formato_file(file_path)
+    if formato == 'csv':
+        lettore = LettoreCsv(file_path)
+    elif formato == 'xls':
+        lettore = LettoreCalamine(file_path)
+    else:
+        lettore = LettoreXlsx(file_path)
+    try:
+        risultato = {}
+        for foglio in lettore.fogli():
+            righe = lettore.righe(foglio)
+            risultato[foglio] = list(itertools.islice(righe, n))
+            righe.close()
+        return risultato
+    finally:
+        lettore.close()
+
+
+def _frame_da_righe(righe, header_row, lettore=None):
+    """Costruisce il DataFrame dalle righe gia' lette con lo stesso parser usato da read_excel."""
+    ultima = max((i for i, r in enumerate(righe) if r), default=-1)
+    righe = righe[:ultima + 1]
+    if not righe:
+        return pd.DataFrame()
+    larghezza = max(len(r) for r in righe)
+    righe = [r + [""] * (larghezza - len(r)) for r in righe]
+    if isinstance(lettore, LettoreCsv):
+        df = TextParser(
+            righe, header=header_row, skip_blank_lines=False,
+            decimal=lettore.decimale, thousands=lettore.migliaia
+        ).read()
+        return lettore.tipizza(df)
+    return TextParser(righe, header=header_row, skip_blank_lines=False).read()
+
+
+def leggi_con_intestazione(file_path, riconosci, max_righe_header=MAX_RIGHE_HEADER, sheet_name=0):
+    """
+    Legge un export con righe di titolo sopra l'intestazione in un solo passaggio.
+    L'intestazione e' la prima riga, tra le prime `max_righe_header`, per cui
+    `riconosci(valori)` e' vero (0 se nessuna); il frame viene poi costruito dalle
+    stesse righe gia' lette, senza riaprire il file.
+    """
+    lettore = apri_lettore(file_path)
+    try:
+        righe = []
+        header_row = None
+        for i, riga in enumerate(lettore.righe(sheet_name)):
+            righe.append(riga)
+            if header_row is None and i < max_righe_header and riconosci(riga):
+                header_row = i
+    finally:
+        lettore.close()
+    return _frame_da_righe(righe, header_row or 0, lettore)
+
+
+def leggi_foglio(file_path, sheet_name=0):
+    """Foglio con l'intestazione nella prima riga (come pd.read_excel)."""
+    return leggi_con_intestazione(file_path, lambda valori: True, sheet_name=sheet_name)
+
+
+def leggi_fogli(file_path, fogli):
+    """
+    Legge piu' fogli (intestazione nella prima riga) aprendo il file una sola volta.
+    fogli: {nome foglio: colonne da leggere o None per tutte}; i fogli assenti nel
+    file non compaiono nel risultato. Un CSV vale come il primo foglio richiesto.
+    """
+    lettore = apri_lettore(file_path)
+    try:
+        if isinstance(lettore, LettoreCsv):
+            primo = next(iter(fogli))
+            frame = {primo: _frame_da_righe(list(lettore.righe(0, fogli[primo])), 0, lettore)}
+        else:
+            presenti = lettore.fogli()
+            frame = {
+                f: _frame_da_righe(list(lettore.righe(f, fogli[f])), 0, lettore)
+                for f in fogli if f in presenti
+            }
+    finally:
+        lettore.close()
+    return {
+        f: df if fogli[f] is None else df[[c for c in df.columns if c in fogli[f]]]
+        for f, df in frame.items()
+    }
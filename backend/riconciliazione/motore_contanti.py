@@ -1,17 +1,40 @@
+import numpy as np
 import pandas as pd
-from datetime import timedelta
-from .db_manager import salva_report_riconciliazione, get_impianto_id
+from .classificazione import frame_report
+from .abbinamento_contanti import MODALITA_ABBINAMENTO, NESSUN_MATCH
+from .configurazione import configurazione, bande_tolleranza
 
-def riconcilia_contanti(df_fortech_agg, pv_code, file_contanti, conn):
-    """Calcola differenze e salva nel nuovo schema DB report_riconciliazioni"""
+def _escludi_versamenti_usati(df_rea, vicini, abbina, giorni_inf, giorni_sup, tolleranza_larga):
+    """
+    Versamenti di df_rea senza quelli abbinati (entro tolleranza_larga) alle
+    giornate vicine gia' nel master: l'abbinamento delle giornate del file non
+    puo' riusarli. Le giornate vicine si abbinano con la stessa modalita', prima.
+    """
+    vicini = vicini[vicini['Importo_Teorico'] > 0].sort_values('Data_Teorica')
+    if vicini.empty or df_rea.empty:
+        return df_rea
+    importi_vicini = vicini['Importo_Teorico'].to_numpy(dtype=float)
+    importi_rea = df_rea['Importo_Reale'].to_numpy(dtype=float)
+    match = abbina(
+        vicini['Data_Teorica'], importi_vicini, df_rea['Data_Reale'], importi_rea,
+        giorni_inf, giorni_sup, tolleranza_larga
+    )
+    trovato = match != NESSUN_MATCH
+    usati = match[trovato][np.abs(importi_rea[match[trovato]] - importi_vicini[trovato]) <= tolleranza_larga]
+    libero = np.ones(len(df_rea), dtype=bool)
+    libero[usati] = False
+    return df_rea[libero]
+
+def riconcilia_contanti(df_fortech_agg, pv_code, sorgenti, anagrafica):
+    """Calcola le differenze e restituisce i record per report_riconciliazioni"""
     print(f"\n[-] Contanti per PV {pv_code}...")
     
-    impianto_id = get_impianto_id(conn, pv_code)
+    impianto_id = anagrafica.impianto_id(pv_code)
     if not impianto_id: return
 
     df_teo = df_fortech_agg[df_fortech_agg['PV'] == pv_code].copy()
     if df_teo.empty: return
-    if not file_contanti: return
+    if not sorgenti.presente('contanti'): return
     
     df_teo = df_teo[['DATA', 'CONTANTI']].rename(
         columns={'DATA': 'Data_Teorica', 'CONTANTI': 'Importo_Teorico'}
@@ -19,84 +42,48 @@ def riconcilia_contanti(df_fortech_agg, pv_code, file_contanti, conn):
     df_teo = df_teo[df_teo['Importo_Teorico'] > 0]
     
     try:
-        df_rea = pd.read_excel(file_contanti)
-        df_rea = df_rea[['Registrazione//Data', 'Importo']].rename(
-            columns={'Registrazione//Data': 'Data_Reale', 'Importo': 'Importo_Reale'}
-        )
-        df_rea.dropna(subset=['Data_Reale'], inplace=True)
-        df_rea['Data_Reale'] = pd.to_datetime(df_rea['Data_Reale'], errors='coerce').dt.normalize()
-        df_rea['Importo_Reale'] = pd.to_numeric(df_rea['Importo_Reale'], errors='coerce').fillna(0)
-        df_rea = df_rea[df_rea['Importo_Reale'] > 0].sort_values('Data_Reale').reset_index(drop=True)
-        df_rea['Matchato'] = False
+        df_rea = sorgenti.per_pv('contanti', pv_code)
     except Exception as e:
         print(f"Errore caricamento contanti {pv_code}: {e}")
         return
 
-    giorni_inf, giorni_sup = 3, 7
-    
-    import os
-    import json
-    
-    config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.json")
-    tolleranza_stretta = 5.00
-    tolleranza_larga = 20.00
-    try:
-        with open(config_path, "r") as f:
-            cfg = json.load(f)
-            tolleranza_stretta = float(cfg.get("tolleranza_contanti_arrotondamento", 5.00))
-            giorni_inf = int(cfg.get("scarto_giorni_contanti_inf", 3))
-            giorni_sup = int(cfg.get("scarto_giorni_contanti_sup", 7))
-    except Exception:
-        pass
+    cfg = configurazione()
+    tolleranza_stretta, tolleranza_larga = bande_tolleranza('contanti')
+    giorni_inf = cfg["scarto_giorni_contanti_inf"]
+    giorni_sup = cfg["scarto_giorni_contanti_sup"]
+    modalita = cfg["modalita_abbinamento_contanti"]
     
-    for idx_teo, row_teo in df_teo.iterrows():
-        data_t, imp_t = row_teo['Data_Teorica'], row_teo['Importo_Teorico']
-        lim_inf = data_t - timedelta(days=giorni_inf)
-        lim_sup = data_t + timedelta(days=giorni_sup)
-        
-        candidati = df_rea[(df_rea['Data_Reale'] >= lim_inf) & 
-                           (df_rea['Data_Reale'] <= lim_sup) & (~df_rea['Matchato'])]
-        
-        match_row = None
-        min_diff = float('inf')
-        for idx_rea, row_rea in candidati.iterrows():
-            diff = abs(row_rea['Importo_Reale'] - imp_t)
-            if diff < min_diff:
-                min_diff = diff
-                match_row = row_rea
-                match_row['index_originale'] = idx_rea
-        
-        data_rif = data_t.strftime("%Y-%m-%d")
-        record = {
-            'impianto_id': impianto_id,
-            'data_riferimento': data_rif,
-            'categoria': 'contanti',
-            'valore_fortech': float(imp_t),
-            'valore_reale': 0.0,
-            'differenza': float(imp_t),
-            'stato': "ANOMALIA_GRAVE",
-            'note': "NO_MATCH - Nessun versamento AS400 trovato in range (+7/-3)."
-        }
+    # Solo versamenti con data valida: la ricerca binaria richiede date ordinate senza NaT
+    df_rea = df_rea[df_rea['Data_Reale'].notna()]
+    abbina = MODALITA_ABBINAMENTO[modalita]
 
-        if match_row is not None:
-            imp_r = float(match_row['Importo_Reale'])
-            diff_netta = imp_t - imp_r
-            diff_assoluta = abs(diff_netta)
-            
-            if diff_assoluta <= tolleranza_stretta: 
-                stato = "QUADRATO"
-            elif diff_assoluta <= tolleranza_larga: 
-                stato = "ANOMALIA_LIEVE"
-            else: 
-                stato = "ANOMALIA_GRAVE"
+    # Import incrementale: i versamenti gia' abbinati alle giornate vicine del
+    # master (caricamenti precedenti) non sono candidati per quelle del file
+    vicini = sorgenti.contanti_vicini_pv(pv_code)
+    if vicini is not None:
+        df_rea = _escludi_versamenti_usati(df_rea, vicini, abbina, giorni_inf, giorni_sup, tolleranza_larga)
 
-            if stato != "ANOMALIA_GRAVE":
-                df_rea.at[match_row['index_originale'], 'Matchato'] = True
-                record['note'] = "Vedi database AS400 per dettagli arrotondamenti."
+    importi_teo = df_teo['Importo_Teorico'].to_numpy(dtype=float)
+    importi_rea = df_rea['Importo_Reale'].to_numpy(dtype=float)
+    match = abbina(
+        df_teo['Data_Teorica'], importi_teo, df_rea['Data_Reale'], importi_rea,
+        giorni_inf, giorni_sup, tolleranza_larga
+    )
 
-            record['valore_reale'] = imp_r
-            record['differenza'] = diff_netta
-            record['stato'] = stato
+    trovato = match != NESSUN_MATCH
+    importi_match = np.zeros(len(importi_teo))
+    importi_match[trovato] = importi_rea[match[trovato]]
+    diff_assoluta = np.abs(importi_teo - importi_match)
 
-        # Salva nel DB schema corretto
-        salva_report_riconciliazione(conn, record)
+    stato = np.select(
+        [trovato & (diff_assoluta <= tolleranza_stretta), trovato & (diff_assoluta <= tolleranza_larga)],
+        ["QUADRATO", "ANOMALIA_LIEVE"],
+        default="ANOMALIA_GRAVE"
+    )
+    note = np.where(
+        stato != "ANOMALIA_GRAVE",
+        "Vedi database AS400 per dettagli arrotondamenti.",
+        "NO_MATCH - Nessun versamento AS400 trovato in range (+7/-3)."
+    )
+    df_teo = df_teo.assign(Importo_Reale=importi_match)
+    return frame_report(df_teo, impianto_id, 'contanti', 'Data_Teorica', 'Importo_Teorico', 'Importo_Reale', stato, note)
@@ -1,15 +1,128 @@
 import os
-import glob
-from .db_manager import get_db_connection, pulisci_report_impianto, get_impianto_id
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from .db_manager import (
+    get_db_connection, pulisci_report_impianto,
+    assicura_schema, salva_report_riconciliazioni, incrementa_versione, leggi_contanti_fortech
+)
+from .anagrafica import AnagraficaImpianti
+from .configurazione import valore
 from .elaboratore_fortech import elabora_dati_fortech
 from .motore_contanti import riconcilia_contanti
 from .motore_carte import riconcilia_carte
 from .motore_petrolifere import riconcilia_petrolifere
 from .motore_buoni import riconcilia_buoni
 from .motore_satispay import riconcilia_satispay
+from .sorgenti import CacheSorgenti
+from .classificatore import classifica_cartella
+from . import archivio
 
 DB_PATH = "database_riconciliazioni.db"
 
+# Giorni di fonti letti dall'archivio prima e dopo le giornate Fortech da riconciliare
+MARGINE_GIORNI_ARCHIVIO = 31
+
+# (fonte, motore): la fonte indica il file da cui dipende l'esito del motore
+MOTORI = (
+    ('contanti', riconcilia_contanti),
+    ('carte', riconcilia_carte),
+    ('petrolifere', riconcilia_petrolifere),
+    ('buoni', riconcilia_buoni),
+    ('satispay', riconcilia_satispay),
+)
+
+def modalita_import():
+    """
+    'incrementale' (default): aggiorna solo le giornate presenti nel file caricato;
+    'completo': ricarica il master Fortech e riscrive tutti i report degli impianti del file.
+    """
+    return valore("modalita_import_fortech")
+
+
+def worker_riconciliazione():
+    """
+    Processi per la riconciliazione dei PV (chiave 'worker_riconciliazione'):
+    1 = sequenziale (default), N > 1 = pool di N processi, 0 = un processo per core.
+    Il parallelo e' da attivare esplicitamente. I worker partono con "spawn", non
+    con il fork di Linux: il pool nasce da un thread dei job del server, e un figlio
+    ottenuto con fork mentre un altro thread tiene un lock (configurazione, pool di
+    connessioni, cache, archivio) lo erediterebbe gia' preso e resterebbe bloccato.
+    Con spawn ogni worker reimporta il modulo principale (__mp_main__): l'avvio
+    del server (schema, tabella jobs) va saltato in quel caso.
+    """
+    n = valore("worker_riconciliazione")
+    return n if n > 0 else (os.cpu_count() or 1)
+
+
+def riconcilia_pv(df_pv, pv, sorgenti, anagrafica):
+    """
+    Esegue i motori di un PV e restituisce (pv, esiti, segnaposto).
+    Non usa il database: puo' girare in un processo worker con le sole viste del PV.
+    """
+    esiti = []
+    # Esiti "file non caricato": non devono coprire celle gia' riconciliate
+    segnaposto = []
+    for fonte, riconcilia in MOTORI:
+        df_rec = riconcilia(df_pv, pv, sorgenti, anagrafica)
+        if df_rec is not None:
+            (esiti if sorgenti.presente(fonte) else segnaposto).append(df_rec)
+    return pv, esiti, segnaposto
+
+
+def _contanti_vicini(conn, df_fortech_agg, pv_validi, anagrafica):
+    """
+    {PV: giornate del master Fortech (Data_Teorica, Importo_Teorico)} fuori dal
+    file ma entro scarto_giorni_contanti_inf + _sup dalle sue giornate: possono
+    contendere alle giornate del file gli stessi versamenti AS400.
+    """
+    giorni = df_fortech_agg[df_fortech_agg['PV'].isin(pv_validi)]
+    if giorni.empty:
+        return {}
+    margine = pd.Timedelta(days=valore("scarto_giorni_contanti_inf") + valore("scarto_giorni_contanti_sup"))
+    righe = leggi_contanti_fortech(
+        conn, (giorni['DATA'].min() - margine).strftime("%Y-%m-%d"), (giorni['DATA'].max() + margine).strftime("%Y-%m-%d")
+    )
+    master = pd.DataFrame([tuple(r) for r in righe], columns=['impianto_id', 'Data_Teorica', 'Importo_Teorico'])
+    master = master[master['Importo_Teorico'].notna()]
+    if master.empty:
+        return {}
+    master['Data_Teorica'] = pd.to_datetime(master['Data_Teorica'])
+    master['Importo_Teorico'] = master['Importo_Teorico'].astype(float)
+
+    vicini = {}
+    for pv, g in giorni.groupby('PV'):
+        m = master[master['impianto_id'] == anagrafica.impianto_id(pv)]
+        m = m[
+            (m['Data_Teorica'] >= g['DATA'].min() - margine) & (m['Data_Teorica'] <= g['DATA'].max() + margine)
+            & ~m['Data_Teorica'].isin(g['DATA'])
+        ]
+        if not m.empty:
+            vicini[pv] = m[['Data_Teorica', 'Importo_Teorico']].reset_index(drop=True)
+    return vicini
+
+
+def _riconcilia_tutti(pv_validi, fortech_per_pv, sorgenti, anagrafica):
+    """
+    Risultati di riconcilia_pv per ogni PV, nell'ordine di completamento.
+    Con piu' worker i PV vanno a un ProcessPoolExecutor: ogni task riceve il frame
+    Fortech del PV e il sottoinsieme gia' diviso delle fonti; la scrittura resta
+    al processo principale.
+    """
+    n_worker = min(worker_riconciliazione(), len(pv_validi))
+    if n_worker <= 1:
+        for pv in pv_validi:
+            yield riconcilia_pv(fortech_per_pv[pv], pv, sorgenti, anagrafica)
+        return
+    with ProcessPoolExecutor(max_workers=n_worker, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [
+            pool.submit(riconcilia_pv, fortech_per_pv[pv], pv, sorgenti.sottoinsieme_pv(pv), anagrafica)
+            for pv in pv_validi
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
 class Orchestratore:
     def __init__(self):
         self.file_fortech = None
@@ -18,30 +131,32 @@ class Orchestratore:
         self.file_petrolifere = None
         self.file_buoni = None
         self.file_satispay = None
+        # File presi dalla cache dei file gia' letti nell'ultima esecuzione
+        self.file_da_cache = []
+        self.classificazione = []
         
     def _identifica_file(self, input_dir):
-        file_excel = glob.glob(os.path.join(input_dir, "*.xlsx")) + \
-                     glob.glob(os.path.join(input_dir, "*.xls")) + \
-                     glob.glob(os.path.join(input_dir, "*.csv"))
-        for file_path in file_excel:
-            nome_file = os.path.basename(file_path).lower()
-            nome_norm = nome_file.replace("_", " ")
-
-            if "fortech" in nome_norm or nome_file.startswith("a_"):
-                self.file_fortech = file_path
-            elif "contanti" in nome_norm or nome_file.startswith("1_"):
-                self.file_contanti = file_path
-            elif ("carte bancarie" in nome_norm or "numia" in nome_norm or nome_file.startswith("2_")) and "petrolifere" not in nome_norm:
-                self.file_carte = file_path
-            elif "petrolifere" in nome_norm or "azzurro" in nome_norm or nome_file.startswith("3_"):
-                self.file_petrolifere = file_path
-            elif "buoni" in nome_norm or "rosso" in nome_norm or nome_file.startswith("4_"):
-                self.file_buoni = file_path
-            elif "satispay" in nome_norm or "grigio" in nome_norm or nome_file.startswith("5_"):
-                self.file_satispay = file_path
-
-    def esegui(self, input_dir):
-        """Metodo principale richiamato dal server API upload"""
+        """
+        Tipo di ogni file dal contenuto (classificatore.py); esiti in self.classificazione.
+        Ogni attributo file_* e' la lista dei file di quel tipo (None se nessuno).
+        """
+        file_per_tipo, self.classificazione = classifica_cartella(input_dir)
+        self.file_fortech = file_per_tipo.get('fortech')
+        self.file_contanti = file_per_tipo.get('contanti')
+        self.file_carte = file_per_tipo.get('carte')
+        self.file_petrolifere = file_per_tipo.get('petrolifere')
+        self.file_buoni = file_per_tipo.get('buoni')
+        self.file_satispay = file_per_tipo.get('satispay')
+
+    def esegui(self, input_dir, progresso=None, hash_file=None):
+        """
+        Metodo principale richiamato dal server API upload.
+        progresso(fase, percentuale, dettaglio) opzionale: riceve l'avanzamento
+        (fase, 0-100 e, durante i motori, lo stato per motore).
+        hash_file opzionale: nome file -> SHA-256 gia' calcolato all'upload.
+        """
+        notifica = _notificatore(progresso)
+
         self._identifica_file(input_dir)
         
         if not self.file_fortech:
@@ -49,24 +164,151 @@ class Orchestratore:
             
         conn = get_db_connection(DB_PATH)
         try:
+            assicura_schema(conn)
+            incrementale = modalita_import() == "incrementale"
+            # Anagrafica impianti in memoria per tutta l'esecuzione (riletta solo se cambiata)
+            anagrafica = AnagraficaImpianti.corrente(conn)
+
             # 1. Fortech master
-            df_fortech_agg, lista_pv = elabora_dati_fortech(self.file_fortech, conn)
+            notifica("Import Fortech", 5)
+            df_fortech_agg, lista_pv = elabora_dati_fortech(self.file_fortech, conn, anagrafica, incrementale)
             
             if df_fortech_agg is not None and len(lista_pv) > 0:
-                for pv in lista_pv:
-                    impianto_id = get_impianto_id(conn, pv)
-                    if not impianto_id:
-                        print(f"PV {pv} ignorato xke non in anagrafica")
-                        continue
-                        
-                    pulisci_report_impianto(conn, impianto_id)
-                    str_pv_code = str(int(pv))
-                    riconcilia_contanti(df_fortech_agg, pv, self.file_contanti, conn)
-                    riconcilia_carte(df_fortech_agg, pv, self.file_carte, conn)
-                    riconcilia_petrolifere(df_fortech_agg, pv, self.file_petrolifere, conn)
-                    riconcilia_buoni(df_fortech_agg, pv, self.file_buoni, conn)
-                    riconcilia_satispay(df_fortech_agg, pv, str_pv_code, self.file_satispay, conn)
-                    
+                # Ogni file sorgente viene letto una sola volta per tutta l'esecuzione
+                file_per_fonte = {
+                    'contanti': self.file_contanti,
+                    'carte': self.file_carte,
+                    'petrolifere': self.file_petrolifere,
+                    'buoni': self.file_buoni,
+                    'satispay': self.file_satispay,
+                }
+                sorgenti = CacheSorgenti(file_per_fonte, anagrafica, hash_file)
+                _riconcilia_e_salva(conn, df_fortech_agg, lista_pv, sorgenti, anagrafica, incrementale, notifica)
+
+                notifica("Archivio sorgenti", 96)
+                _archivia_sorgenti(df_fortech_agg, self.file_fortech, sorgenti)
+                self.file_da_cache = sorgenti.da_cache
+
+            # Nuova versione dei dati: invalida ETag e cache delle API della dashboard
+            with conn:
+                incrementa_versione(conn, 'dati')
             return len(lista_pv) # Ritorna Punti vendita analizzati
         finally:
             conn.close()
+
+    def riesegui(self, da=None, a=None, progresso=None):
+        """
+        Riconcilia di nuovo dall'archivio Parquet (archivio.py), senza rileggere
+        gli Excel: serve dopo un cambio di tolleranze o di anagrafica. da/a
+        limitano le giornate Fortech; le fonti sono lette con MARGINE_GIORNI_ARCHIVIO
+        in piu' per gli scarti di data dei motori. Le celle vengono aggiornate
+        con UPSERT come nell'import incrementale.
+        """
+        notifica = _notificatore(progresso)
+        notifica("Lettura archivio", 5)
+        df_fortech_agg = archivio.carica('fortech', da, a)
+        if df_fortech_agg is None or df_fortech_agg.empty:
+            raise ValueError("Archivio Fortech vuoto per il periodo richiesto.")
+        lista_pv = df_fortech_agg['PV'].dropna().unique()
+
+        margine = pd.Timedelta(days=MARGINE_GIORNI_ARCHIVIO)
+        da_fonti = df_fortech_agg['DATA'].min() - margine
+        a_fonti = df_fortech_agg['DATA'].max() + margine
+        frame_per_fonte = {}
+        for fonte, _ in MOTORI:
+            df = archivio.carica(fonte, da_fonti, a_fonti)
+            if df is not None:
+                frame_per_fonte[fonte] = df
+
+        conn = get_db_connection(DB_PATH)
+        try:
+            assicura_schema(conn)
+            anagrafica = AnagraficaImpianti.corrente(conn)
+            sorgenti = CacheSorgenti.da_frame(frame_per_fonte, anagrafica)
+            _riconcilia_e_salva(conn, df_fortech_agg, lista_pv, sorgenti, anagrafica, True, notifica)
+            with conn:
+                incrementa_versione(conn, 'dati')
+            return len(lista_pv)
+        finally:
+            conn.close()
+
+
+def _notificatore(progresso):
+    def notifica(fase, percentuale, dettaglio=None):
+        if progresso:
+            progresso(fase, percentuale, dettaglio)
+    return notifica
+
+
+def _riconcilia_e_salva(conn, df_fortech_agg, lista_pv, sorgenti, anagrafica, incrementale, notifica):
+    """Esegue i motori su tutti i PV e scrive i report in un'unica transazione."""
+    fortech_per_pv = {pv: g for pv, g in df_fortech_agg.groupby('PV')}
+    avanzamento = {
+        'pv_totali': len(lista_pv),
+        'pv_elaborati': 0,
+        'motori': {fonte: 0 for fonte, _ in MOTORI},
+    }
+    notifica("Riconciliazione", 20, avanzamento)
+
+    impianti_elaborati = []
+    pv_validi = []
+    for pv in lista_pv:
+        impianto_id = anagrafica.impianto_id(pv)
+        if not impianto_id:
+            print(f"PV {pv} ignorato xke non in anagrafica")
+            avanzamento['pv_elaborati'] += 1
+            continue
+        impianti_elaborati.append(impianto_id)
+        pv_validi.append(pv)
+
+    # Incrementale: le giornate gia' nel master attorno al file tengono i loro versamenti
+    if incrementale and sorgenti.presente('contanti'):
+        sorgenti.contanti_vicini = _contanti_vicini(conn, df_fortech_agg, pv_validi, anagrafica)
+
+    esiti_per_pv = {}
+    for pv, esiti, segnaposto_pv in _riconcilia_tutti(pv_validi, fortech_per_pv, sorgenti, anagrafica):
+        esiti_per_pv[pv] = (esiti, segnaposto_pv)
+        for fonte, _ in MOTORI:
+            avanzamento['motori'][fonte] += 1
+        avanzamento['pv_elaborati'] += 1
+        notifica(f"Riconciliazione PV {pv}", 20 + 70 * avanzamento['pv_elaborati'] // len(lista_pv), avanzamento)
+
+    # Ordine dei PV di lista_pv, qualunque sia l'ordine di completamento
+    parti = [df for pv in pv_validi for df in esiti_per_pv[pv][0]]
+    segnaposto = [df for pv in pv_validi for df in esiti_per_pv[pv][1]]
+    records = pd.concat(parti, ignore_index=True) if parti else []
+    records_segnaposto = pd.concat(segnaposto, ignore_index=True) if segnaposto else []
+
+    notifica("Scrittura report", 92, avanzamento)
+    # 2. Scrittura report: un'unica transazione per tutta l'esecuzione.
+    # Incrementale: UPSERT delle sole celle (impianto, giorno, categoria) del file,
+    # il resto dello storico non viene toccato.
+    with conn:
+        if not incrementale:
+            for impianto_id in impianti_elaborati:
+                pulisci_report_impianto(conn, impianto_id, commit=False)
+        salva_report_riconciliazioni(conn, records)
+        salva_report_riconciliazioni(conn, records_segnaposto, sovrascrivi=not incrementale)
+
+
+def _nomi_file(percorsi):
+    if isinstance(percorsi, str):
+        percorsi = [percorsi]
+    return ", ".join(os.path.basename(p) for p in percorsi)
+
+
+def _archivia_sorgenti(df_fortech_agg, file_fortech, sorgenti):
+    """
+    Salva nell'archivio Parquet il Fortech aggregato e le fonti lette. Un errore
+    dell'archivio (ad es. pyarrow assente) non interrompe l'import.
+    """
+    try:
+        archivio.archivia('fortech', df_fortech_agg, _nomi_file(file_fortech))
+        for fonte, percorsi in sorgenti.file_per_fonte.items():
+            try:
+                df = sorgenti.frame(fonte)
+            except Exception:
+                continue  # fonte illeggibile: gia' segnalata dai motori
+            archivio.archivia(fonte, df, _nomi_file(percorsi))
+    except Exception as e:
+        print(f"Archivio sorgenti non aggiornato: {e}")
@@ -0,0 +1,328 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from .lettori import leggi_con_intestazione, leggi_foglio
+from .anagrafica import normalizza_codice
+from . import cache_letture
+
+
+def _normalizza_colonne(df, minuscolo=False):
+    """Rimuove a-capo e spazi dai nomi colonna (gli export iP Portal/Numia li contengono)."""
+    colonne = [str(c).replace('\n', ' ').strip() for c in df.columns]
+    df.columns = [c.lower() for c in colonne] if minuscolo else colonne
+    return df
+
+
+def _contiene(valori, testo):
+    return any(isinstance(v, str) and testo in v.lower() for v in valori)
+
+
+def _estrai_codice_pv(serie):
+    """'43809 - OPT1' / 'PV 43809' -> 43809 (numerico, NaN se assente)."""
+    return pd.to_numeric(serie.astype(str).str.extract(r'(\d+)')[0], errors='coerce')
+
+
+def carica_contanti(file_contanti):
+    """
+    AS400: versamenti con data registrazione e importo positivo, ordinati per data.
+    Il centro di costo (C.d.C.), se presente, diventa Codice_AS400; il numero di
+    registrazione Numero_Registrazione.
+    """
+    df_rea = leggi_foglio(file_contanti)
+    colonne = ['Registrazione//Data', 'Importo'] + [
+        c for c in ('C.d.C.', 'Registrazione//Numero') if c in df_rea.columns
+    ]
+    df_rea = df_rea[colonne].rename(columns={
+        'Registrazione//Data': 'Data_Reale', 'Importo': 'Importo_Reale',
+        'C.d.C.': 'Codice_AS400', 'Registrazione//Numero': 'Numero_Registrazione',
+    })
+    df_rea.dropna(subset=['Data_Reale'], inplace=True)
+    df_rea['Data_Reale'] = pd.to_datetime(df_rea['Data_Reale'], errors='coerce').dt.normalize()
+    df_rea['Importo_Reale'] = pd.to_numeric(df_rea['Importo_Reale'], errors='coerce').fillna(0)
+    return df_rea[df_rea['Importo_Reale'] > 0].sort_values('Data_Reale').reset_index(drop=True)
+
+
+def carica_carte(file_carte):
+    """Numia: transazioni con data normalizzata (Data_Norm) e importo (Importo_Numia)."""
+    df_rea = _normalizza_colonne(leggi_con_intestazione(
+        file_carte, lambda v: _contiene(v, 'data') and _contiene(v, 'importo')
+    ))
+
+    col_data = next((c for c in df_rea.columns if c.lower() in ['data e ora', 'data transazione', 'data']), 'Data e ora')
+    col_importo = next((c for c in df_rea.columns if 'importo' in c.lower()), 'Importo')
+
+    if col_data not in df_rea.columns:
+        raise ValueError("Colonna data/ora non trovata")
+
+    df_rea.dropna(subset=[col_data], inplace=True)
+    df_rea['Data_Norm'] = pd.to_datetime(df_rea[col_data], errors='coerce', dayfirst=True).dt.normalize()
+    df_rea['Importo_Numia'] = pd.to_numeric(df_rea[col_importo], errors='coerce').fillna(0)
+    return df_rea
+
+
+def carica_petrolifere(file_petrolifere):
+    """iP Portal carte: codice PV (Punto_Clean), data (Data_Norm) e importo con segno (Importo_Portal)."""
+    df_rea = _normalizza_colonne(leggi_con_intestazione(
+        file_petrolifere, lambda v: _contiene(v, 'punto vendita') or _contiene(v, 'circuito')
+    ))
+
+    col_pv = next((c for c in df_rea.columns if c.lower() in ['punto vendita', 'pv', 'codice site']), 'Punto vendita')
+    df_rea['Punto_Clean'] = _estrai_codice_pv(df_rea[col_pv])
+
+    df_rea['Data_Norm'] = pd.to_datetime(df_rea['Data operazione'], errors='coerce', dayfirst=True).dt.normalize()
+    df_rea['Importo_Portal'] = pd.to_numeric(df_rea['Importo'], errors='coerce').fillna(0)
+
+    if 'Segno' in df_rea.columns:
+        is_neg = df_rea['Segno'].astype(str).str.contains('-')
+        df_rea.loc[is_neg, 'Importo_Portal'] = -1 * df_rea.loc[is_neg, 'Importo_Portal'].abs()
+    return df_rea
+
+
+def carica_buoni(file_buoni):
+    """iP Portal buoni: codice PV (Punto_Clean), data registrazione (Data_Registrazione_iP) e importo con segno."""
+    df_rea = _normalizza_colonne(leggi_con_intestazione(
+        file_buoni, lambda v: _contiene(v, 'punto vendita') or _contiene(v, 'importo')
+    ))
+
+    col_pv = next((c for c in df_rea.columns if c.lower() in ['punto vendita', 'pv', 'codice site te']), 'Punto vendita')
+    col_data = next((c for c in df_rea.columns if c.lower() in ['data registrazione documento', 'data registrazione', 'data documento']), None)
+
+    df_rea['Punto_Clean'] = _estrai_codice_pv(df_rea[col_pv])
+    df_rea['Importo_Reale'] = pd.to_numeric(df_rea['Importo'], errors='coerce').fillna(0)
+
+    # Gestione segno negativo col_segno (dalla logica utente)
+    col_segno = next((c for c in df_rea.columns if c.lower() == 'segno'), None)
+    if col_segno:
+        is_neg = df_rea[col_segno].astype(str).str.contains('-')
+        df_rea.loc[is_neg, 'Importo_Reale'] = -1 * df_rea.loc[is_neg, 'Importo_Reale'].abs()
+
+    df_rea.dropna(subset=[col_data], inplace=True)
+    df_rea['Data_Registrazione_iP'] = pd.to_datetime(df_rea[col_data], errors='coerce').dt.normalize()
+    return df_rea
+
+
+def carica_satispay(file_satispay):
+    """Satispay: codice negozio (Codice_Satispay e numerico in Punto_Clean), data (Data_Norm) e importo totale."""
+    df_rea = _normalizza_colonne(leggi_foglio(file_satispay), minuscolo=True)
+
+    col_data = next((c for c in ['data transazione', 'data'] if c in df_rea.columns), None)
+    col_pv = 'codice negozio' if 'codice negozio' in df_rea.columns else next((c for c in ['negozio', 'punto vendita'] if c in df_rea.columns), None)
+
+    df_rea['Codice_Satispay'] = df_rea[col_pv] if col_pv else None
+    df_rea['Punto_Clean'] = _estrai_codice_pv(df_rea[col_pv]) if col_pv else float('nan')
+    df_rea['Importo_Satispay'] = pd.to_numeric(df_rea['importo totale'], errors='coerce').fillna(0)
+    df_rea.dropna(subset=[col_data], inplace=True)
+    df_rea['Data_Norm'] = pd.to_datetime(df_rea[col_data], errors='coerce').dt.normalize()
+    return df_rea
+
+
+# fonte -> (loader, colonna con il codice dell'impianto; None = file senza codice, vista unica)
+LOADER_FONTI = {
+    'contanti': (carica_contanti, 'Codice_AS400'),
+    'carte': (carica_carte, None),
+    'petrolifere': (carica_petrolifere, 'Punto_Clean'),
+    'buoni': (carica_buoni, 'Punto_Clean'),
+    'satispay': (carica_satispay, 'Codice_Satispay'),
+}
+
+# fonte -> chiavi naturali alternative (colonne dopo il loader) di una transazione:
+# con piu' file della stessa fonte si usa la prima presente in tutti i file
+CHIAVI_NATURALI = {
+    'contanti': (['Data_Reale', 'Numero_Registrazione'],),
+    'carte': (['ID Transazione'], ['Codice autorizzazione', 'Data e ora', 'Importo_Numia']),
+    'petrolifere': (['Punto_Clean', 'Data operazione', 'Ora operazione', 'Riferimento Scontrino', 'Cod. Prod.', 'Importo_Portal'],),
+    'buoni': (['Numero documento', 'Serial number'],),
+    'satispay': (['id transazione'],),
+}
+
+# Colonna di ordinamento dei loader che restituiscono le righe ordinate
+ORDINE_FONTI = {'contanti': 'Data_Reale'}
+
+# Thread per leggere i file di una fonte caricata in piu' file
+THREAD_LETTURA = 4
+
+
+def unisci_file(fonte, frame):
+    """
+    Unisce i frame di piu' file della stessa fonte (nell'ordine dei file). Le
+    transazioni presenti in piu' file (periodi sovrapposti, export ripetuti)
+    restano una volta sola, prese dall'ultimo file che le contiene; i doppioni
+    dentro lo stesso file non vengono toccati.
+    """
+    if len(frame) == 1:
+        return frame[0]
+    df = pd.concat([f.assign(_file=i) for i, f in enumerate(frame)], ignore_index=True)
+    chiavi = next((k for k in CHIAVI_NATURALI[fonte] if all(c in f.columns for f in frame for c in k)), None)
+    if chiavi is None:
+        print(f"{fonte}: chiavi naturali assenti, file uniti senza togliere i doppioni")
+    else:
+        ultimo = df.groupby(chiavi, dropna=False, sort=False)['_file'].transform('max')
+        df = df[df['_file'] == ultimo]
+    df = df.drop(columns='_file')
+    if fonte in ORDINE_FONTI:
+        df = df.sort_values(ORDINE_FONTI[fonte], kind='stable')
+    return df.reset_index(drop=True)
+
+
+class CacheSorgenti:
+    """
+    Cache per-esecuzione dei file sorgente.
+    Ogni file viene letto e normalizzato una sola volta (alla prima richiesta) e
+    diviso per impianto con un unico groupby: i motori ricevono la vista gia' filtrata.
+    I codici di AS400 (C.d.C.) e Satispay (codice negozio) sono risolti con l'anagrafica.
+    Una fonte puo' avere piu' file (lista di path): vengono letti in parallelo
+    su THREAD_LETTURA thread e uniti con unisci_file. Un file gia' letto in un'esecuzione precedente (stesso SHA-256) viene preso
+    da cache_letture senza rileggerlo; hash_per_file (nome file -> hash) evita
+    di ricalcolare gli hash gia' noti dall'upload.
+    """
+
+    def __init__(self, file_per_fonte, anagrafica, hash_per_file=None):
+        self.file_per_fonte = {f: p for f, p in file_per_fonte.items() if p}
+        self.anagrafica = anagrafica
+        self.hash_per_file = hash_per_file or {}
+        self.da_cache = []
+        # PV -> giornate Fortech gia' nel master attorno al file (Data_Teorica,
+        # Importo_Teorico): il motore contanti esclude i versamenti che usano
+        self.contanti_vicini = {}
+        self._frame = {}
+        self._split = {}
+        self._errori = {}
+
+    @classmethod
+    def da_frame(cls, frame_per_fonte, anagrafica):
+        """Cache gia' popolata con frame normalizzati (ad es. letti dall'archivio Parquet)."""
+        cache = cls({}, anagrafica)
+        for fonte, df in frame_per_fonte.items():
+            cache.file_per_fonte[fonte] = None
+            cache._registra(fonte, df)
+        return cache
+
+    def presente(self, fonte):
+        return fonte in self.file_per_fonte
+
+    def frame(self, fonte):
+        """Frame normalizzato dell'intera fonte (lo carica se serve)."""
+        return self._carica(fonte)
+
+    def _chiavi_righe(self, fonte, df):
+        """Chiave di split di ogni riga (None se il file non permette di distinguere gli impianti)."""
+        col = LOADER_FONTI[fonte][1]
+        if not col or col not in df.columns or df[col].isna().all():
+            return None
+        if fonte == 'satispay':
+            codici = df[col]
+            mappa = {c: self.anagrafica.impianto_satispay(c) for c in codici.dropna().unique()}
+            return codici.map(mappa)
+        if fonte == 'contanti':
+            return df[col].map(normalizza_codice)
+        return df[col]
+
+    def _chiave_pv(self, fonte, pv_code):
+        """Chiave di split corrispondente al PV Fortech."""
+        if fonte == 'contanti':
+            return self.anagrafica.codice_as400(pv_code)
+        if fonte == 'satispay':
+            return self.anagrafica.impianto_id(pv_code)
+        return pv_code
+
+    def _carica(self, fonte):
+        if fonte in self._errori:
+            raise self._errori[fonte]
+        if fonte not in self._frame:
+            percorsi = self.file_per_fonte[fonte]
+            if isinstance(percorsi, str):
+                percorsi = [percorsi]
+            try:
+                if len(percorsi) == 1:
+                    frame = [self._leggi_file(fonte, percorsi[0])]
+                else:
+                    with ThreadPoolExecutor(max_workers=min(THREAD_LETTURA, len(percorsi))) as pool:
+                        frame = list(pool.map(lambda p: self._leggi_file(fonte, p), percorsi))
+            except Exception as e:
+                self._errori[fonte] = e
+                raise
+            self._registra(fonte, unisci_file(fonte, frame))
+        return self._frame[fonte]
+
+    def _leggi_file(self, fonte, path):
+        """Frame normalizzato di un file: dalla cache se gia' letto, altrimenti dal loader."""
+        sha = self._hash(path)
+        df = cache_letture.leggi(fonte, sha)
+        if df is not None:
+            self.da_cache.append(os.path.basename(path))
+            return df
+        df = LOADER_FONTI[fonte][0](path)
+        cache_letture.salva(fonte, sha, df, [c for chiavi in CHIAVI_NATURALI[fonte] for c in chiavi])
+        return df
+
+    def _hash(self, path):
+        if path is None:
+            return None
+        sha = self.hash_per_file.get(os.path.basename(path))
+        if sha is None and cache_letture.limite_byte() > 0:
+            try:
+                sha = cache_letture.hash_file(path)
+            except OSError:
+                return None
+        return sha
+
+    def _registra(self, fonte, df):
+        self._frame[fonte] = df
+        chiavi = self._chiavi_righe(fonte, df)
+        if chiavi is not None:
+            self._split[fonte] = {k: g for k, g in df.groupby(chiavi)}
+
+    def per_pv(self, fonte, pv_code):
+        """
+        Vista della fonte per il PV. Per i file senza codice impianto (Numia, AS400
+        senza C.d.C. o PV senza codice AS400 in anagrafica) e' l'intero frame; per
+        Satispay, se il PV non compare, si usa l'intero file come faceva il motore
+        originale. Rilancia l'errore di caricamento, se c'e' stato.
+        """
+        df = self._carica(fonte)
+        if fonte not in self._split:
+            return df
+        chiave = self._chiave_pv(fonte, pv_code)
+        if fonte == 'contanti' and chiave is None:
+            return df
+        vista = self._split[fonte].get(chiave)
+        if vista is None:
+            return df if fonte == 'satispay' else df.iloc[0:0]
+        return vista
+
+    def contanti_vicini_pv(self, pv_code):
+        """Giornate del master vicine al file per il PV (None se non ce ne sono)."""
+        return self.contanti_vicini.get(pv_code)
+
+    def sottoinsieme_pv(self, pv_code):
+        """
+        Viste gia' filtrate di tutte le fonti per un PV (SorgentiPV), da spedire a un
+        processo worker: il worker non rilegge i file e non usa il database.
+        """
+        viste, errori = {}, {}
+        for fonte in self.file_per_fonte:
+            try:
+                viste[fonte] = self.per_pv(fonte, pv_code)
+            except Exception as e:
+                errori[fonte] = e
+        return SorgentiPV(viste, errori, self.contanti_vicini_pv(pv_code))
+
+
+class SorgentiPV:
+    """Stessa interfaccia di CacheSorgenti (presente/per_pv) limitata alle viste di un PV."""
+
+    def __init__(self, viste, errori, contanti_vicini=None):
+        self._viste = viste
+        self._errori = errori
+        self._contanti_vicini = contanti_vicini
+
+    def contanti_vicini_pv(self, pv_code):
+        return self._contanti_vicini
+
+    def presente(self, fonte):
+        return fonte in self._viste or fonte in self._errori
+
+    def per_pv(self, fonte, pv_code):
+        if fonte in self._errori:
+            raise self._errori[fonte]
+        return self._viste[fonte]
@@ -0,0 +1,169 @@
+"""
+Benchmark query di /api/impianti: subquery correlate vs aggregazione unica.
+
+Crea un database sintetico dallo schema (db/calor_systems_schema.sql) con
+N impianti x N giorni x 6 categorie di report_riconciliazioni e misura le due
+versioni della query, prima e dopo l'indice coprente
+idx_report_impianto_stato(impianto_id, stato, risolto, data_riferimento).
+Stampa anche il piano di esecuzione (EXPLAIN QUERY PLAN) di ogni variante.
+
+Con l'indice ogni subquery correlata diventa una ricerca per intervallo solo
+sull'indice, mentre l'aggregazione con SUM(CASE ...) deve comunque scorrere e
+valutare tutte le righe: per questo /api/impianti tiene le subquery.
+
+Uso:
+    python benchmarks/bench_api_impianti.py [--impianti 20] [--giorni 730] [--ripetizioni 20]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+
+SCHEMA = os.path.join(PROJECT_ROOT, "db", "calor_systems_schema.sql")
+CATEGORIE = ("contanti", "carte_bancarie", "carte_petrolifere", "buoni_ip", "satispay", "credito")
+STATI = ("QUADRATO", "ANOMALIA_LIEVE", "ANOMALIA_GRAVE", "NON_TROVATO")
+
+SQL_SUBQUERY = """
+    SELECT
+        i.id, i.nome_impianto, i.codice_pv_fortech, i.tipo_gestione, i.citta, i.attivo,
+        (SELECT COUNT(*) FROM report_riconciliazioni r
+         WHERE r.impianto_id = i.id AND r.stato = 'QUADRATO') as cnt_ok,
+        (SELECT COUNT(*) FROM report_riconciliazioni r
+         WHERE r.impianto_id = i.id AND r.stato = 'ANOMALIA_LIEVE') as cnt_warn,
+        (SELECT COUNT(*) FROM report_riconciliazioni r
+         WHERE r.impianto_id = i.id AND r.stato = 'ANOMALIA_GRAVE' AND r.risolto = 0) as cnt_grave,
+        (SELECT MAX(r.data_riferimento) FROM report_riconciliazioni r
+         WHERE r.impianto_id = i.id) as last_date
+    FROM impianti i
+    WHERE i.attivo = 1
+    ORDER BY i.nome_impianto
+"""
+
+SQL_AGGREGATA = """
+    SELECT
+        i.id, i.nome_impianto, i.codice_pv_fortech, i.tipo_gestione, i.citta, i.attivo,
+        COALESCE(r.cnt_ok, 0) as cnt_ok,
+        COALESCE(r.cnt_warn, 0) as cnt_warn,
+        COALESCE(r.cnt_grave, 0) as cnt_grave,
+        r.last_date
+    FROM impianti i
+    LEFT JOIN (
+        SELECT
+            impianto_id,
+            SUM(CASE WHEN stato = 'QUADRATO' THEN 1 ELSE 0 END) as cnt_ok,
+            SUM(CASE WHEN stato = 'ANOMALIA_LIEVE' THEN 1 ELSE 0 END) as cnt_warn,
+            SUM(CASE WHEN stato = 'ANOMALIA_GRAVE' AND risolto = 0 THEN 1 ELSE 0 END) as cnt_grave,
+            MAX(data_riferimento) as last_date
+        FROM report_riconciliazioni
+        GROUP BY impianto_id
+    ) r ON r.impianto_id = i.id
+    WHERE i.attivo = 1
+    ORDER BY i.nome_impianto
+"""
+
+QUERY = {"subquery": SQL_SUBQUERY, "aggregata": SQL_AGGREGATA}
+
+
+def crea_database(path, n_impianti, giorni, seed):
+    """Database sintetico: schema del progetto senza l'indice coprente."""
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(path)
+    with open(SCHEMA, "r") as f:
+        conn.executescript(f.read())
+    conn.execute("DROP INDEX IF EXISTS idx_report_impianto_stato")
+    conn.execute("DELETE FROM impianti")
+    conn.executemany(
+        "INSERT INTO impianti (id, nome_impianto, codice_pv_fortech, tipo_gestione, citta) VALUES (?, ?, ?, ?, ?)",
+        [(i, f"Impianto {i:02d}", str(40000 + i), "PRESIDIATO", "Milano") for i in range(1, n_impianti + 1)]
+    )
+
+    date = pd.date_range("2024-01-01", periods=giorni, freq="D").strftime("%Y-%m-%d")
+    impianti, giorno, categoria = np.meshgrid(
+        np.arange(1, n_impianti + 1), np.arange(giorni), np.arange(len(CATEGORIE)), indexing="ij"
+    )
+    n = impianti.size
+    stato = rng.choice(len(STATI), n, p=[0.8, 0.1, 0.07, 0.03])
+    righe = zip(
+        impianti.ravel().tolist(),
+        date.to_numpy()[giorno.ravel()].tolist(),
+        np.array(CATEGORIE)[categoria.ravel()].tolist(),
+        np.array(STATI)[stato].tolist(),
+        (rng.random(n) < 0.3).astype(int).tolist(),
+    )
+    conn.executemany(
+        "INSERT INTO report_riconciliazioni (impianto_id, data_riferimento, categoria, stato, risolto) "
+        "VALUES (?, ?, ?, ?, ?)", righe
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    return conn, n
+
+
+def piano(conn, sql, parametri=()):
+    return [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, parametri)]
+
+
+def misura(conn, sql, ripetizioni, parametri=()):
+    conn.execute(sql, parametri).fetchall()  # riscaldamento cache
+    t0 = time.perf_counter()
+    for _ in range(ripetizioni):
+        righe = conn.execute(sql, parametri).fetchall()
+    return (time.perf_counter() - t0) / ripetizioni * 1000, righe
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--impianti", type=int, default=20)
+    parser.add_argument("--giorni", type=int, default=730)
+    parser.add_argument("--ripetizioni", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="salva i risultati in questo file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn, n_righe = crea_database(os.path.join(tmp, "bench.db"), args.impianti, args.giorni, args.seed)
+        print(f"{args.impianti} impianti x {args.giorni} giorni x {len(CATEGORIE)} categorie = {n_righe} righe\n")
+
+        risultati = {}
+        for indice in ("senza indice", "con indice"):
+            if indice == "con indice":
+                conn.execute(
+                    "CREATE INDEX idx_report_impianto_stato "
+                    "ON report_riconciliazioni(impianto_id, stato, risolto, data_riferimento)"
+                )
+                conn.execute("ANALYZE")
+            righe_attese = None
+            for nome, sql in QUERY.items():
+                ms, righe = misura(conn, sql, args.ripetizioni)
+                if righe_attese is None:
+                    righe_attese = righe
+                elif righe != righe_attese:
+                    raise SystemExit(f"Risultati diversi tra le query ({indice})")
+                chiave = f"{nome} / {indice}"
+                risultati[chiave] = {"ms": round(ms, 2), "piano": piano(conn, sql)}
+
+        print(f"{'variante':<28} {'ms':>9}")
+        for chiave, r in risultati.items():
+            print(f"{chiave:<28} {r['ms']:>9}")
+        for chiave, r in risultati.items():
+            print(f"\n{chiave}:")
+            for passo in r["piano"]:
+                print(f"  {passo}")
+        conn.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"parametri": vars(args), "righe": n_righe, "risultati": risultati}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Benchmark lettura dei file sorgente: pd.read_excel (openpyxl) vs lettori.py.
+
+Parte dagli export di Dati_excel (contanti, carte, petrolifere, buoni,
+satispay), moltiplica le righe dati per --scala e scrive per ognuno un xlsx
+(XlsxWriter) e un CSV come li esportano i portali (';', virgola decimale, date
+gg/mm/aaaa). Per ogni fonte misura:
+    read_excel   pd.read_excel(engine='openpyxl') del foglio, il vecchio percorso
+    xlsx         loader di sorgenti.py con LettoreXlsx (openpyxl read_only, iter_rows)
+    calamine     loader con LettoreCalamine (se python-calamine e' installato)
+    csv          loader sul CSV (LettoreCsv)
+e verifica che le colonne usate dai motori siano identiche tra i lettori.
+
+Uso:
+    python benchmarks/bench_lettori.py [--scala 100] [--ripetizioni 1]
+"""
+import argparse
+import csv
+import datetime
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import pandas as pd
+import xlsxwriter
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+
+from backend.riconciliazione import lettori  # noqa: E402
+from backend.riconciliazione.sorgenti import LOADER_FONTI  # noqa: E402
+from backend.riconciliazione.archivio import COLONNE_ARCHIVIO  # noqa: E402
+
+DATI_EXCEL = os.path.join(PROJECT_ROOT, "Dati_excel")
+PREFISSI = {'contanti': '1_', 'carte': '2_', 'petrolifere': '3_', 'buoni': '4_', 'satispay': '5_'}
+
+
+def _valore_csv(v):
+    if isinstance(v, datetime.datetime):
+        if v.microsecond:
+            return v.strftime('%d/%m/%Y %H:%M:%S.%f')
+        return v.strftime('%d/%m/%Y %H:%M:%S')
+    if isinstance(v, float):
+        return repr(v).replace('.', ',')
+    return v
+
+
+def genera(path_origine, scala, cartella):
+    """Scrive xlsx e CSV con le righe dati del file ripetute scala volte. Ritorna (xlsx, csv, righe)."""
+    lettore = lettori.LettoreXlsx(path_origine)
+    try:
+        righe = list(lettore.righe(0))
+    finally:
+        lettore.close()
+    # Intestazione = prima riga con il massimo di celle piene; sopra restano i titoli
+    piene = [sum(1 for v in r if v not in ("", None)) for r in righe]
+    header = piene.index(max(piene))
+    testa, corpo = righe[:header + 1], [r for r in righe[header + 1:] if r]
+    tutte = testa + corpo * scala
+
+    nome = os.path.splitext(os.path.basename(path_origine))[0]
+    path_xlsx = os.path.join(cartella, nome + ".xlsx")
+    path_csv = os.path.join(cartella, nome + ".csv")
+    workbook = xlsxwriter.Workbook(path_xlsx, {
+        'constant_memory': True, 'default_date_format': 'dd/mm/yyyy hh:mm:ss'
+    })
+    foglio = workbook.add_worksheet()
+    for i, riga in enumerate(tutte):
+        foglio.write_row(i, 0, riga)
+    workbook.close()
+    with open(path_csv, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f, delimiter=";")
+        for riga in tutte:
+            writer.writerow([_valore_csv(v) for v in riga])
+    return path_xlsx, path_csv, len(corpo) * scala
+
+
+def cronometra(funzione, ripetizioni):
+    """Tempo migliore in ms e ultimo risultato."""
+    migliore, risultato = None, None
+    for _ in range(ripetizioni):
+        t = time.perf_counter()
+        risultato = funzione()
+        ms = (time.perf_counter() - t) * 1000
+        migliore = ms if migliore is None else min(migliore, ms)
+    return migliore, risultato
+
+
+def con_lettore(scelta, loader, path):
+    """Esegue il loader forzando la chiave lettore_excel."""
+    originale = lettori.valore
+
+    def valore(chiave):
+        return scelta if chiave == "lettore_excel" else originale(chiave)
+
+    with mock.patch.object(lettori, "valore", valore):
+        return loader(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scala", type=int, default=100)
+    parser.add_argument("--ripetizioni", type=int, default=1)
+    parser.add_argument("--json", help="salva i risultati in questo file")
+    args = parser.parse_args()
+
+    calamine = lettori.calamine_disponibile()
+    if not calamine:
+        print("python-calamine non installato: variante calamine saltata\n")
+
+    risultati = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'fonte':<12} {'righe':>7} {'read_excel':>11} {'xlsx':>9} {'calamine':>9} {'csv':>9}  (ms)")
+        for fonte, prefisso in PREFISSI.items():
+            origine = glob.glob(os.path.join(DATI_EXCEL, prefisso + "*.xlsx"))[0]
+            path_xlsx, path_csv, n = genera(origine, args.scala, tmp)
+            loader = LOADER_FONTI[fonte][0]
+
+            tempi = {}
+            tempi["read_excel"], _ = cronometra(
+                lambda: pd.read_excel(path_xlsx, header=None, engine="openpyxl"), args.ripetizioni
+            )
+            tempi["xlsx"], df_xlsx = cronometra(lambda: con_lettore("openpyxl", loader, path_xlsx), args.ripetizioni)
+            frame = {"csv": None}
+            if calamine:
+                tempi["calamine"], frame["calamine"] = cronometra(
+                    lambda: con_lettore("calamine", loader, path_xlsx), args.ripetizioni
+                )
+            tempi["csv"], frame["csv"] = cronometra(lambda: loader(path_csv), args.ripetizioni)
+
+            colonne = [c for c in COLONNE_ARCHIVIO[fonte][2] if c in df_xlsx.columns]
+            for nome, df in frame.items():
+                pd.testing.assert_frame_equal(df_xlsx[colonne], df[colonne], obj=f"{fonte} xlsx vs {nome}")
+
+            risultati[fonte] = {"righe": n, **{k: round(v, 1) for k, v in tempi.items()}}
+            cal = f"{tempi['calamine']:>9.1f}" if calamine else f"{'-':>9}"
+            print(f"{fonte:<12} {n:>7} {tempi['read_excel']:>11.1f} {tempi['xlsx']:>9.1f} {cal} {tempi['csv']:>9.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"parametri": vars(args), "risultati": risultati}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
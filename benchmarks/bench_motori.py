@@ -0,0 +1,194 @@
+"""
+Benchmark del motore di riconciliazione per fase, su dati sintetici.
+
+Genera con genera_sorgenti.py i sei export per --pv impianti, --giorni giorni e
+--transazioni transazioni medie per PV e giorno, crea un database dallo schema
+(db/calor_systems_schema.sql) con l'anagrafica corrispondente e misura:
+    classificazione     classifica_cartella sulla cartella
+    lettura_<fonte>     loader di sorgenti.py sul file (senza cache_letture)
+    fortech             elabora_dati_fortech: lettura, aggregazione, import_fortech_master
+    suddivisione_pv     split per PV di Fortech e fonti (CacheSorgenti)
+    riconcilia_<fonte>  il motore della fonte su tutti i PV
+    scrittura_db        salva_report_riconciliazioni in un'unica transazione
+    orchestratore       Orchestratore().esegui() completo (archivio compreso)
+Di ogni fase vale il tempo migliore su --ripetizioni. Con --json i risultati
+(parametri, ambiente, commit, righe per file, tempi in ms) vanno in un file che
+--confronta puo' rileggere per il confronto tra commit.
+
+Uso:
+    python benchmarks/bench_motori.py [--pv 10] [--giorni 30] [--transazioni 100]
+        [--ripetizioni 3] [--json risultati.json] [--confronta precedente.json]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from genera_sorgenti import genera, crea_anagrafica  # noqa: E402
+from backend.riconciliazione import cache_letture  # noqa: E402
+from backend.riconciliazione.anagrafica import AnagraficaImpianti  # noqa: E402
+from backend.riconciliazione.classificatore import classifica_cartella  # noqa: E402
+from backend.riconciliazione.db_manager import get_db_connection, assicura_schema, salva_report_riconciliazioni  # noqa: E402
+from backend.riconciliazione.elaboratore_fortech import elabora_dati_fortech  # noqa: E402
+from backend.riconciliazione.orchestratore import MOTORI, Orchestratore  # noqa: E402
+from backend.riconciliazione.sorgenti import LOADER_FONTI, CacheSorgenti  # noqa: E402
+
+SCHEMA = os.path.join(PROJECT_ROOT, "db", "calor_systems_schema.sql")
+DB_NOME = "database_riconciliazioni.db"
+
+
+def crea_database(path, n_pv):
+    conn = sqlite3.connect(path)
+    with open(SCHEMA, "r") as f:
+        conn.executescript(f.read())
+    conn.execute("DELETE FROM impianti")
+    crea_anagrafica(conn, n_pv)
+    conn.commit()
+    conn.close()
+    conn = get_db_connection(path)
+    with conn:
+        assicura_schema(conn)
+    return conn
+
+
+def cronometra(funzione, ripetizioni):
+    """Tempo migliore in ms e ultimo risultato; l'output dei motori viene scartato."""
+    migliore, risultato = None, None
+    with open(os.devnull, "w") as nulla, contextlib.redirect_stdout(nulla):
+        for _ in range(ripetizioni):
+            t = time.perf_counter()
+            risultato = funzione()
+            ms = (time.perf_counter() - t) * 1000
+            migliore = ms if migliore is None else min(migliore, ms)
+    return migliore, risultato
+
+
+def ambiente():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "cpu": os.cpu_count(),
+        "sistema": platform.platform(),
+    }
+
+
+def misura_fasi(cartella, conn, ripetizioni):
+    tempi = {}
+    anagrafica = AnagraficaImpianti.carica(conn)
+
+    tempi["classificazione"], (file_per_tipo, _) = cronometra(lambda: classifica_cartella(cartella), ripetizioni)
+
+    frame = {}
+    for fonte, (loader, _) in LOADER_FONTI.items():
+        path = file_per_tipo[fonte][0]
+        tempi[f"lettura_{fonte}"], frame[fonte] = cronometra(lambda: loader(path), ripetizioni)
+
+    tempi["fortech"], (df_fortech, lista_pv) = cronometra(
+        lambda: elabora_dati_fortech(file_per_tipo['fortech'][0], conn, anagrafica, True), ripetizioni
+    )
+    conn.commit()
+
+    def suddividi():
+        return {pv: g for pv, g in df_fortech.groupby('PV')}, CacheSorgenti.da_frame(frame, anagrafica)
+
+    tempi["suddivisione_pv"], (fortech_per_pv, sorgenti) = cronometra(suddividi, ripetizioni)
+
+    esiti = []
+    for fonte, riconcilia in MOTORI:
+        def tutti_i_pv():
+            return [riconcilia(fortech_per_pv[pv], pv, sorgenti, anagrafica) for pv in lista_pv]
+        tempi[f"riconcilia_{fonte}"], risultati = cronometra(tutti_i_pv, ripetizioni)
+        esiti.extend(df for df in risultati if df is not None)
+
+    records = pd.concat(esiti, ignore_index=True)
+
+    def scrivi():
+        with conn:
+            return salva_report_riconciliazioni(conn, records)
+
+    tempi["scrittura_db"], _ = cronometra(scrivi, ripetizioni)
+    return tempi, len(records)
+
+
+def confronta(tempi, path):
+    with open(path, "r") as f:
+        precedente = json.load(f)
+    vecchi = precedente.get("tempi_ms", {})
+    print(f"\nConfronto con {path} (commit {precedente.get('ambiente', {}).get('commit')})")
+    print(f"{'fase':<24} {'prima ms':>10} {'ora ms':>10} {'rapporto':>9}")
+    for fase, ms in tempi.items():
+        if fase in vecchi and vecchi[fase]:
+            print(f"{fase:<24} {vecchi[fase]:>10.1f} {ms:>10.1f} {ms / vecchi[fase]:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pv", type=int, default=10)
+    parser.add_argument("--giorni", type=int, default=30)
+    parser.add_argument("--transazioni", type=int, default=100, help="transazioni medie per PV e giorno")
+    parser.add_argument("--ripetizioni", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="salva i risultati in questo file")
+    parser.add_argument("--confronta", help="risultati JSON di un'esecuzione precedente")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    json_out = os.path.abspath(args.json) if args.json else None
+    with tempfile.TemporaryDirectory() as tmp:
+        cartella = os.path.join(tmp, "input")
+        t = time.perf_counter()
+        _, righe = genera(cartella, args.pv, args.giorni, args.transazioni, args.seed)
+        print(f"Dati generati in {time.perf_counter() - t:.1f}s: " + ", ".join(f"{k} {v}" for k, v in righe.items()))
+
+        # L'orchestratore usa database e archivio relativi alla cartella corrente
+        os.chdir(tmp)
+        try:
+            conn = crea_database(DB_NOME, args.pv)
+            tempi, n_report = misura_fasi(cartella, conn, args.ripetizioni)
+            conn.close()
+            # Niente cache dei file gia' letti: ogni ripetizione rilegge tutto
+            with mock.patch.object(cache_letture, "limite_byte", lambda: 0):
+                tempi["orchestratore"], _ = cronometra(lambda: Orchestratore().esegui(cartella), args.ripetizioni)
+        finally:
+            os.chdir(cwd)
+
+    print(f"\n{n_report} righe di report\n")
+    print(f"{'fase':<24} {'ms':>10}")
+    for fase, ms in tempi.items():
+        print(f"{fase:<24} {ms:>10.1f}")
+
+    if args.confronta:
+        confronta(tempi, args.confronta)
+
+    if json_out:
+        with open(json_out, "w") as f:
+            json.dump({
+                "parametri": vars(args), "ambiente": ambiente(), "righe": righe,
+                "righe_report": n_report, "tempi_ms": {k: round(v, 1) for k, v in tempi.items()},
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark paginazione di /api/riconciliazioni: OFFSET vs keyset (cursore).
+
+Sullo stesso database sintetico di bench_api_impianti.py (con tutti gli indici
+dello schema) misura il tempo di una pagina a profondita' crescenti, senza
+filtri e con i filtri per impianto, categoria e stato. Con OFFSET SQLite deve
+scorrere e scartare tutte le righe precedenti; con il cursore
+(data_riferimento, id) < (?, ?) parte direttamente dall'indice, quindi il tempo
+resta costante.
+
+Uso:
+    python benchmarks/bench_paginazione.py [--impianti 20] [--giorni 730] [--pagina 200]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from bench_api_impianti import crea_database, misura, piano  # noqa: E402
+
+SELECT = """
+    SELECT r.id, r.data_riferimento as data, i.nome_impianto as impianto, r.categoria,
+           r.valore_fortech, r.valore_reale, r.differenza, r.stato, r.tipo_anomalia, r.note
+    FROM report_riconciliazioni r
+    JOIN impianti i ON r.impianto_id = i.id
+    WHERE 1=1
+"""
+
+# nome -> (condizione, parametri)
+FILTRI = {
+    "nessuno": ("", ()),
+    "impianto": (" AND r.impianto_id = ?", (3,)),
+    "categoria": (" AND r.categoria = ?", ("contanti",)),
+    "stato": (" AND r.stato = ? AND r.risolto = ?", ("ANOMALIA_GRAVE", 0)),
+}
+
+ORDINE = " ORDER BY r.data_riferimento DESC, r.id DESC"
+
+
+def sql_offset(filtro, pagina, profondita):
+    condizione, parametri = FILTRI[filtro]
+    sql = SELECT + condizione + ORDINE + f" LIMIT {pagina} OFFSET {pagina * profondita}"
+    return sql, parametri
+
+
+def sql_keyset(conn, filtro, pagina, profondita):
+    """Query della pagina con il cursore preso dall'ultima riga della pagina precedente."""
+    condizione, parametri = FILTRI[filtro]
+    if profondita == 0:
+        return SELECT + condizione + ORDINE + f" LIMIT {pagina}", parametri
+    ultima = conn.execute(
+        SELECT + condizione + ORDINE + f" LIMIT 1 OFFSET {pagina * profondita - 1}", parametri
+    ).fetchone()
+    if ultima is None:
+        return None, None
+    sql = SELECT + condizione + " AND (r.data_riferimento, r.id) < (?, ?)" + ORDINE + f" LIMIT {pagina}"
+    return sql, parametri + (ultima[1], ultima[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--impianti", type=int, default=20)
+    parser.add_argument("--giorni", type=int, default=730)
+    parser.add_argument("--pagina", type=int, default=200)
+    parser.add_argument("--ripetizioni", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="salva i risultati in questo file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn, n_righe = crea_database(os.path.join(tmp, "bench.db"), args.impianti, args.giorni, args.seed)
+        print(f"{n_righe} righe, pagine da {args.pagina}\n")
+
+        risultati = {}
+        print(f"{'filtro':<10} {'pagina':>7} {'offset ms':>10} {'keyset ms':>10}")
+        for filtro in FILTRI:
+            for profondita in (0, 10, 50, 200, 500):
+                sql_k, par_k = sql_keyset(conn, filtro, args.pagina, profondita)
+                if sql_k is None:
+                    continue
+                sql_o, par_o = sql_offset(filtro, args.pagina, profondita)
+                ms_o, righe_o = misura(conn, sql_o, args.ripetizioni, par_o)
+                ms_k, righe_k = misura(conn, sql_k, args.ripetizioni, par_k)
+                if righe_o != righe_k:
+                    raise SystemExit(f"Pagine diverse tra OFFSET e keyset ({filtro}, pagina {profondita})")
+                risultati[f"{filtro} / {profondita}"] = {
+                    "offset_ms": round(ms_o, 2),
+                    "keyset_ms": round(ms_k, 2),
+                    "piano_keyset": piano(conn, sql_k, par_k),
+                }
+                print(f"{filtro:<10} {profondita:>7} {ms_o:>10.2f} {ms_k:>10.2f}")
+        conn.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"parametri": vars(args), "righe": n_righe, "risultati": risultati}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
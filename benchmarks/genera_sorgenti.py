@@ -0,0 +1,328 @@
+"""
+Generatore di file sorgente sintetici per i benchmark del motore.
+
+Scrive in una cartella i sei export con le stesse intestazioni (e righe di
+titolo) dei file reali, riconosciuti da classificatore.py e letti dai loader di
+sorgenti.py:
+    A_FORTECH.xlsx          fogli Vendite e Incassi, una riga per PV e giorno
+    1_AS400.xlsx            un versamento contanti per PV e giorno, da 0 a 4 giorni dopo
+    2_NUMIA.xlsx            transazioni carte bancarie
+    3_IPORTAL_CARTE.xlsx    transazioni carte petrolifere
+    4_IPORTAL_BUONI.xlsx    buoni, registrati scarto_giorni_buoni giorni dopo
+    5_SATISPAY.xlsx         pagamenti Satispay
+Le transazioni di ogni PV e giorno sono --transazioni in media (Poisson),
+divise tra i canali con QUOTA_CANALI; gli incassi Fortech sono le somme delle
+transazioni, con un errore sul QUOTA_ANOMALIE delle celle.
+I codici PV sono 40001..; crea_anagrafica() scrive gli impianti corrispondenti
+(C.d.C. AS400 e negozio Satispay compresi).
+
+Uso:
+    python benchmarks/genera_sorgenti.py CARTELLA [--pv 10] [--giorni 30] [--transazioni 100] [--seed 42]
+"""
+import argparse
+import datetime
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(PROJECT_ROOT)
+
+from backend.riconciliazione.configurazione import valore  # noqa: E402
+
+PRIMO_GIORNO = "2026-01-01"
+CODICE_BASE = 40000
+
+# canale -> quota delle transazioni giornaliere, importo minimo e massimo
+QUOTA_CANALI = {
+    'carte': (0.60, 5.0, 120.0),
+    'petrolifere': (0.20, 20.0, 150.0),
+    'buoni': (0.12, None, None),
+    'satispay': (0.08, 3.0, 60.0),
+}
+TAGLI_BUONI = (10, 20, 50)
+CONTANTI_GIORNO = (300.0, 1500.0)
+QUOTA_ANOMALIE = 0.05
+
+INTESTAZIONE_AS400 = [
+    'Stato', 'Allegati', 'R', 'Registrazione//Data', 'Registrazione//Tipo', 'Registrazione//Numero',
+    'Descrizione', 'C.d.C.', 'Importo', 'S', 'Importo segnato', 'Progressivo', 'Documento//Tipo',
+    'Documento//Data', 'Documento//Numero', 'Descrizione 2', 'Data comp.', 'Analitica//Data',
+    'Analitica//Numero', 'Data val.', 'Cambio', 'Val.', 'Importo valuta', 'Progressivo val.', 'Nr.Rata',
+    'Dt.comp.Iva', 'Documento', 'Cee', 'Registrazione originaria//TR', 'Registrazione originaria//Numero',
+    'Registrazione originaria//Data', 'Intestatario//Tipo', 'Intestatario//Codice',
+]
+INTESTAZIONE_NUMIA = [
+    'Data e ora', 'Codice autorizzazione', 'Numero carta', 'Importo', 'Circuito', 'Tipo transazione',
+    'Stato operazione', 'Importo in valuta originale', 'Valuta originale', 'Importo Cashback',
+    'Punto vendita', 'ID Punto vendita', 'MID', 'ID Terminale / TML', 'Alias Terminale', 'ID Transazione',
+    'Codice ordine', 'Codice IUV',
+]
+INTESTAZIONE_PETROLIFERE = [
+    'Gestore', 'PV', 'Data\noperazione', 'Ora\noperazione', 'Circuito', 'Cod. Prod.', 'Prodotto',
+    'Riferimento\nScontrino', 'Quantità', 'Prezzo', 'Importo', 'Segno', 'Numero Fattura', 'Data Fattura',
+]
+INTESTAZIONE_BUONI = [
+    'Data\ndocumento', 'Codice cliente', 'Ragione sociale\ncliente', 'Numero documento',
+    'Numero documento\nriferimento', 'Codice\nRete', 'Data registrazione\ndocumento', 'Indirizzo', 'Cap',
+    'Localita', 'Provincia', 'Nazione', 'Importo totale', 'Data operazione', 'Ora operazione', 'Terminale',
+    'Esercente', 'Descrizione esercente', 'Pan', 'Serial number', 'Importo', 'Quantita', 'Prodotto',
+    'Prezzo unit.', 'Punto vendita', 'Valuta',
+]
+INTESTAZIONE_SATISPAY = [
+    'id transazione', 'data transazione', 'negozio', 'codice negozio', 'importo totale',
+    'totale commissioni', 'tipo transazione', 'codice transazione', 'id gruppo',
+]
+INTESTAZIONE_INCASSI = [
+    'CodicePV', 'DataContabile', 'DataInizio', 'DataFine', 'StatoGiornata', 'BANCOMAT GESTORE',
+    'CARTA CREDITO GESTORE', 'CONTANTI', 'AMEX', 'DKV', 'UTA', 'BUONI', 'PAGAMENTIINNOVATIVI', 'CARTAMAXIMA',
+    'CLIENTI CON FATTURA FINE MESE', 'CARTAPETROLIFERA', 'CARTA CREDITO GENERICA', 'PAGOBANCOMAT',
+    'CODICERESTO', 'MANCATO EROGATO',
+]
+INTESTAZIONE_VENDITE = [
+    'CodicePV', 'DataContabile', 'DataInizio', 'DataFine', 'StatoGiornata', 'Corrispettivo Totale',
+]
+
+
+def codice_pv(i):
+    return CODICE_BASE + i
+
+
+def codice_as400(i):
+    return f"CP{i:03d}"
+
+
+def codice_satispay(i):
+    return f"{codice_pv(i)} - OPT1"
+
+
+def crea_anagrafica(conn, n_pv):
+    """Impianti 1..n_pv con i codici usati dal generatore. Non esegue commit."""
+    conn.executemany(
+        "INSERT INTO impianti (id, nome_impianto, codice_pv_fortech, codice_contabile_as400, "
+        "codice_negozio_satispay, tipo_gestione, citta) VALUES (?, ?, ?, ?, ?, 'PRESIDIATO', 'Milano')",
+        [(i, f"Impianto {i:03d}", str(codice_pv(i)), codice_as400(i), codice_satispay(i)) for i in range(1, n_pv + 1)]
+    )
+
+
+def _transazioni(rng, n_pv, giorni, media):
+    """Indici (pv, giorno) di ogni transazione: Poisson(media) per cella."""
+    conteggi = rng.poisson(media, size=(n_pv, giorni))
+    celle = np.repeat(np.arange(n_pv * giorni), conteggi.ravel())
+    return celle // giorni, celle % giorni
+
+
+def _scrivi(path, fogli):
+    """fogli: {nome: (righe di titolo, intestazione, {colonna: valori})}; colonne assenti vuote."""
+    workbook = xlsxwriter.Workbook(path, {
+        'constant_memory': True, 'default_date_format': 'dd/mm/yyyy hh:mm:ss'
+    })
+    for nome, (titoli, intestazione, colonne) in fogli.items():
+        foglio = workbook.add_worksheet(nome)
+        for i, riga in enumerate(titoli):
+            foglio.write_row(i, 0, riga)
+        r = len(titoli)
+        foglio.write_row(r, 0, intestazione)
+        n = len(next(iter(colonne.values())))
+        valori = [colonne.get(c) for c in intestazione]
+        for k in range(n):
+            r += 1
+            foglio.write_row(r, 0, ["" if v is None else v[k] for v in valori])
+    workbook.close()
+
+
+def genera(cartella, n_pv=10, giorni=30, transazioni=100, seed=42):
+    """Scrive i sei file in cartella. Ritorna {tipo: path} e il numero di righe per file."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(cartella, exist_ok=True)
+    date = pd.date_range(PRIMO_GIORNO, periods=giorni, freq="D").to_pydatetime()
+    pv = np.array([codice_pv(i) for i in range(1, n_pv + 1)])
+    totali = {}
+    righe = {}
+    percorsi = {}
+
+    def secondi(n):
+        return [datetime.timedelta(seconds=int(s)) for s in rng.integers(6 * 3600, 22 * 3600, n)]
+
+    # Numia
+    q, lo, hi = QUOTA_CANALI['carte']
+    i_pv, i_g = _transazioni(rng, n_pv, giorni, transazioni * q)
+    importi = np.round(rng.uniform(lo, hi, len(i_pv)), 2)
+    totali['carte'] = np.bincount(i_pv * giorni + i_g, importi, n_pv * giorni)
+    n = len(i_pv)
+    percorsi['carte'] = os.path.join(cartella, "2_NUMIA.xlsx")
+    _scrivi(percorsi['carte'], {'Transazioni': (
+        [[], [f"Lista transazioni dal {date[0]:%d/%m/%y} 00:00:00 al {date[-1]:%d/%m/%y} 23:59:59"]],
+        INTESTAZIONE_NUMIA,
+        {
+            'Data e ora': [date[g] + s for g, s in zip(i_g, secondi(n))],
+            'Codice autorizzazione': [f"{x:06d}" for x in rng.integers(0, 10 ** 6, n)],
+            'Numero carta': ["455777xxxxxxxxx1288"] * n,
+            'Importo': importi.tolist(),
+            'Circuito': ["VISA"] * n,
+            'Tipo transazione': ["Acquisto"] * n,
+            'Stato operazione': ["Acquisto approvato"] * n,
+            'Valuta originale': ["Euro"] * n,
+            'Punto vendita': ["IP"] * n,
+            'ID Punto vendita': [str(p) for p in pv[i_pv]],
+            'ID Transazione': [f"{k:018d}" for k in range(n)],
+        },
+    )})
+    righe['carte'] = n
+
+    # iP Portal carte petrolifere
+    q, lo, hi = QUOTA_CANALI['petrolifere']
+    i_pv, i_g = _transazioni(rng, n_pv, giorni, transazioni * q)
+    importi = np.round(rng.uniform(lo, hi, len(i_pv)), 2)
+    totali['petrolifere'] = np.bincount(i_pv * giorni + i_g, importi, n_pv * giorni)
+    n = len(i_pv)
+    percorsi['petrolifere'] = os.path.join(cartella, "3_IPORTAL_CARTE.xlsx")
+    _scrivi(percorsi['petrolifere'], {'IPortal': (
+        [['TRANSAZIONI FUELCARD RIMBORSATE']],
+        INTESTAZIONE_PETROLIFERE,
+        {
+            'Gestore': ["181706"] * n,
+            'PV': [str(p) for p in pv[i_pv]],
+            'Data\noperazione': [f"{date[g]:%d/%m/%Y}" for g in i_g],
+            'Ora\noperazione': [str(s).zfill(8) for s in secondi(n)],
+            'Circuito': ["CM IPPLUS"] * n,
+            'Cod. Prod.': ["202"] * n,
+            'Prodotto': ["SsPb self"] * n,
+            'Riferimento\nScontrino': [f"{k:08d}" for k in range(n)],
+            'Quantità': np.round(importi / 1.699, 2).tolist(),
+            'Prezzo': [1.699] * n,
+            'Importo': importi.tolist(),
+            'Segno': ["+"] * n,
+        },
+    )})
+    righe['petrolifere'] = n
+
+    # iP Portal buoni: registrati scarto_giorni_buoni giorni dopo l'operazione
+    scarto = datetime.timedelta(days=valore("scarto_giorni_buoni"))
+    i_pv, i_g = _transazioni(rng, n_pv, giorni, transazioni * QUOTA_CANALI['buoni'][0])
+    importi = rng.choice(TAGLI_BUONI, len(i_pv))
+    totali['buoni'] = np.bincount(i_pv * giorni + i_g, importi, n_pv * giorni)
+    n = len(i_pv)
+    registrazione = [f"{date[g] + scarto:%Y-%m-%d}" for g in i_g]
+    percorsi['buoni'] = os.path.join(cartella, "4_IPORTAL_BUONI.xlsx")
+    _scrivi(percorsi['buoni'], {'IPortal': (
+        [['DETTAGLIO TRANSAZIONI BUONI']],
+        INTESTAZIONE_BUONI,
+        {
+            'Data\ndocumento': registrazione,
+            'Codice cliente': ["0000181706"] * n,
+            'Ragione sociale\ncliente': ["CALOR SYSTEMS SRL"] * n,
+            'Numero documento': [f"30{k // 50:08d}" for k in range(n)],
+            'Data registrazione\ndocumento': registrazione,
+            'Importo totale': importi.tolist(),
+            'Data operazione': [f"{date[g]:%Y-%m-%d}" for g in i_g],
+            'Ora operazione': [str(s).zfill(8) for s in secondi(n)],
+            'Serial number': [f"70101000{k:08d}" for k in range(n)],
+            'Importo': importi.tolist(),
+            'Punto vendita': [f"{p:010d}" for p in pv[i_pv]],
+            'Valuta': ["EUR"] * n,
+        },
+    )})
+    righe['buoni'] = n
+
+    # Satispay
+    q, lo, hi = QUOTA_CANALI['satispay']
+    i_pv, i_g = _transazioni(rng, n_pv, giorni, transazioni * q)
+    importi = np.round(rng.uniform(lo, hi, len(i_pv)), 2)
+    totali['satispay'] = np.bincount(i_pv * giorni + i_g, importi, n_pv * giorni)
+    n = len(i_pv)
+    percorsi['satispay'] = os.path.join(cartella, "5_SATISPAY.xlsx")
+    _scrivi(percorsi['satispay'], {'Payment report': (
+        [],
+        INTESTAZIONE_SATISPAY,
+        {
+            'id transazione': [f"sat-{k:012d}" for k in range(n)],
+            'data transazione': [date[g] + s for g, s in zip(i_g, secondi(n))],
+            'negozio': ["ip"] * n,
+            'codice negozio': [f"{p} - OPT1" for p in pv[i_pv]],
+            'importo totale': importi.tolist(),
+            'totale commissioni': np.round(importi * 0.003, 2).tolist(),
+            'tipo transazione': ["TO_BUSINESS"] * n,
+            'codice transazione': ["0"] * n,
+        },
+    )})
+    righe['satispay'] = n
+
+    # Contanti: un versamento AS400 per PV e giorno, arrotondato all'euro, da 0 a 4 giorni dopo
+    contanti = np.round(rng.uniform(*CONTANTI_GIORNO, n_pv * giorni), 2)
+    totali['contanti'] = contanti
+    ritardo = rng.integers(0, 5, n_pv * giorni)
+    celle = np.arange(n_pv * giorni)
+    i_pv, i_g = celle // giorni, celle % giorni
+    ordine = np.argsort(i_g + ritardo, kind="stable")
+    n = len(celle)
+    percorsi['contanti'] = os.path.join(cartella, "1_AS400.xlsx")
+    versato = np.round(contanti, 0)[ordine]
+    _scrivi(percorsi['contanti'], {'WGREC01': (
+        [],
+        INTESTAZIONE_AS400,
+        {
+            'Registrazione//Data': [date[0] + datetime.timedelta(days=int(g)) for g in (i_g + ritardo)[ordine]],
+            'Registrazione//Tipo': ["03"] * n,
+            'Registrazione//Numero': list(range(150000, 150000 + n)),
+            'Descrizione': ["Versamento contanti"] * n,
+            'C.d.C.': [codice_as400(p + 1) for p in i_pv[ordine]],
+            'Importo': versato.tolist(),
+            'S': ["A"] * n,
+            'Importo segnato': (-versato).tolist(),
+        },
+    )})
+    righe['contanti'] = n
+
+    # Fortech: incassi teorici = somme delle transazioni, con qualche anomalia
+    def teorico(canale):
+        errore = np.where(rng.random(n_pv * giorni) < QUOTA_ANOMALIE, rng.uniform(-50, 50, n_pv * giorni), 0.0)
+        return np.round(totali[canale] + errore, 2)
+
+    carte = teorico('carte')
+    bancomat = np.round(carte * 0.4, 2)
+    giorno = [date[g] for g in i_g]
+    inizio = [date[g] - datetime.timedelta(seconds=1) for g in i_g]
+    fine = [date[g] + datetime.timedelta(hours=23, minutes=59, seconds=59) for g in i_g]
+    comuni = {
+        'CodicePV': pv[i_pv].tolist(), 'DataContabile': giorno, 'DataInizio': inizio, 'DataFine': fine,
+        'StatoGiornata': ["Rettificata"] * n,
+    }
+    incassi = {
+        **comuni,
+        'BANCOMAT GESTORE': bancomat.tolist(),
+        'CARTA CREDITO GESTORE': np.round(carte - bancomat, 2).tolist(),
+        'CONTANTI': teorico('contanti').tolist(),
+        'DKV': teorico('petrolifere').tolist(),
+        'BUONI': teorico('buoni').tolist(),
+        'PAGAMENTIINNOVATIVI': teorico('satispay').tolist(),
+    }
+    corrispettivo = sum(np.array(incassi[c]) for c in ('BANCOMAT GESTORE', 'CARTA CREDITO GESTORE', 'CONTANTI', 'DKV', 'BUONI', 'PAGAMENTIINNOVATIVI'))
+    percorsi['fortech'] = os.path.join(cartella, "A_FORTECH.xlsx")
+    _scrivi(percorsi['fortech'], {
+        'Vendite': ([], INTESTAZIONE_VENDITE, {**comuni, 'Corrispettivo Totale': np.round(corrispettivo, 2).tolist()}),
+        'Incassi': ([], INTESTAZIONE_INCASSI, incassi),
+    })
+    righe['fortech'] = n
+    return percorsi, righe
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cartella")
+    parser.add_argument("--pv", type=int, default=10)
+    parser.add_argument("--giorni", type=int, default=30)
+    parser.add_argument("--transazioni", type=int, default=100, help="transazioni medie per PV e giorno")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    percorsi, righe = genera(args.cartella, args.pv, args.giorni, args.transazioni, args.seed)
+    for tipo, path in percorsi.items():
+        print(f"{tipo:<12} {righe[tipo]:>8} righe  {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,9 @@
 -- ============================================================================
 
 -- Pulisci tabelle esistenti (ordine inverso per rispettare foreign keys)
+DROP TABLE IF EXISTS meta_versioni;
+DROP TABLE IF EXISTS report_stato_corrente;
+DROP TABLE IF EXISTS report_rollup_giornaliero;
 DROP TABLE IF EXISTS report_riconciliazioni;
 DROP TABLE IF EXISTS eventi_sicurezza_casse;
 DROP TABLE IF EXISTS verifica_credito_clienti;
@@ -129,6 +132,8 @@ CREATE TABLE import_fortech_master (
 -- Indice per ricerche veloci per data e impianto
 CREATE INDEX idx_fortech_data_impianto ON import_fortech_master(data_contabile, impianto_id);
 CREATE INDEX idx_fortech_codice_pv ON import_fortech_master(codice_pv);
+-- Una sola giornata per impianto: chiave dell'import incrementale (UPSERT)
+CREATE UNIQUE INDEX ux_fortech_impianto_data ON import_fortech_master(impianto_id, data_contabile);
 
 -- ============================================================================
 -- 3A. 💰 VERIFICA CONTANTI (Fonte: AS400/Contabilità) - GIALLO
@@ -433,6 +438,14 @@ CREATE INDEX idx_report_data ON report_riconciliazioni(data_riferimento);
 CREATE INDEX idx_report_stato ON report_riconciliazioni(stato);
 CREATE INDEX idx_report_impianto ON report_riconciliazioni(impianto_id);
 CREATE INDEX idx_report_categoria ON report_riconciliazioni(categoria);
+-- Una sola riga per cella (impianto, giorno, categoria): chiave dell'UPSERT del motore
+CREATE UNIQUE INDEX ux_report_impianto_data_categoria ON report_riconciliazioni(impianto_id, data_riferimento, categoria);
+-- Indice coprente per i conteggi per stato di /api/impianti
+CREATE INDEX idx_report_impianto_stato ON report_riconciliazioni(impianto_id, stato, risolto, data_riferimento);
+-- Paginazione keyset per (data_riferimento, id) filtrata per impianto, categoria, stato
+CREATE INDEX idx_report_impianto_data ON report_riconciliazioni(impianto_id, data_riferimento);
+CREATE INDEX idx_report_categoria_data ON report_riconciliazioni(categoria, data_riferimento);
+CREATE INDEX idx_report_stato_data ON report_riconciliazioni(stato, data_riferimento);
 
 -- ============================================================================
 -- 6. 📝 TABELLA LOG IMPORT
@@ -458,6 +471,153 @@ CREATE TABLE log_importazioni (
     note TEXT
 );
 
+-- ============================================================================
+-- 7. 🔖 VERSIONI DATI (invalidazione cache)
+-- ============================================================================
+-- Contatori di versione: il motore rilegge l'anagrafica impianti solo quando la
+-- versione 'impianti' (trigger) cambia; le API della dashboard usano le versioni
+-- come ETag.
+
+CREATE TABLE meta_versioni (
+    chiave VARCHAR(50) PRIMARY KEY,
+    versione INTEGER NOT NULL DEFAULT 0,
+    aggiornato_il TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO meta_versioni (chiave, versione) VALUES ('impianti', 0);
+-- 'dati' (report e master Fortech): incrementata da orchestratore ed endpoint di modifica
+INSERT INTO meta_versioni (chiave, versione) VALUES ('dati', 0);
+
+CREATE TRIGGER trg_impianti_versione_insert AFTER INSERT ON impianti
+BEGIN
+    UPDATE meta_versioni SET versione = versione + 1, aggiornato_il = CURRENT_TIMESTAMP WHERE chiave = 'impianti';
+END;
+
+CREATE TRIGGER trg_impianti_versione_update AFTER UPDATE ON impianti
+BEGIN
+    UPDATE meta_versioni SET versione = versione + 1, aggiornato_il = CURRENT_TIMESTAMP WHERE chiave = 'impianti';
+END;
+
+CREATE TRIGGER trg_impianti_versione_delete AFTER DELETE ON impianti
+BEGIN
+    UPDATE meta_versioni SET versione = versione + 1, aggiornato_il = CURRENT_TIMESTAMP WHERE chiave = 'impianti';
+END;
+
+-- ============================================================================
+-- 8. 📌 TABELLE DERIVATE PER LA DASHBOARD
+-- ============================================================================
+-- Per ogni (impianto, categoria) la riga piu' recente di report_riconciliazioni,
+-- mantenuta dai trigger: /api/stato-verifiche legge impianti x categorie righe.
+
+CREATE TABLE report_stato_corrente (
+    impianto_id INTEGER NOT NULL,
+    categoria VARCHAR(50) NOT NULL,
+    report_id INTEGER NOT NULL,
+    data_riferimento DATE NOT NULL,
+    PRIMARY KEY (impianto_id, categoria)
+);
+
+CREATE TRIGGER trg_report_stato_insert AFTER INSERT ON report_riconciliazioni
+BEGIN
+    INSERT INTO report_stato_corrente (impianto_id, categoria, report_id, data_riferimento)
+    VALUES (NEW.impianto_id, NEW.categoria, NEW.id, NEW.data_riferimento)
+    ON CONFLICT(impianto_id, categoria) DO UPDATE SET
+        report_id = excluded.report_id,
+        data_riferimento = excluded.data_riferimento
+    WHERE excluded.data_riferimento >= report_stato_corrente.data_riferimento;
+END;
+
+CREATE TRIGGER trg_report_stato_delete AFTER DELETE ON report_riconciliazioni
+WHEN OLD.id = (
+    SELECT report_id FROM report_stato_corrente
+    WHERE impianto_id = OLD.impianto_id AND categoria = OLD.categoria
+)
+BEGIN
+    DELETE FROM report_stato_corrente WHERE impianto_id = OLD.impianto_id AND categoria = OLD.categoria;
+    INSERT INTO report_stato_corrente (impianto_id, categoria, report_id, data_riferimento)
+    SELECT impianto_id, categoria, id, data_riferimento FROM report_riconciliazioni
+    WHERE impianto_id = OLD.impianto_id AND categoria = OLD.categoria
+    ORDER BY data_riferimento DESC LIMIT 1;
+END;
+
+CREATE TRIGGER trg_report_stato_update AFTER UPDATE OF impianto_id, categoria, data_riferimento ON report_riconciliazioni
+BEGIN
+    DELETE FROM report_stato_corrente WHERE impianto_id = OLD.impianto_id AND categoria = OLD.categoria;
+    INSERT INTO report_stato_corrente (impianto_id, categoria, report_id, data_riferimento)
+    SELECT impianto_id, categoria, id, data_riferimento FROM report_riconciliazioni
+    WHERE impianto_id = OLD.impianto_id AND categoria = OLD.categoria
+    ORDER BY data_riferimento DESC LIMIT 1;
+    DELETE FROM report_stato_corrente WHERE impianto_id = NEW.impianto_id AND categoria = NEW.categoria;
+    INSERT INTO report_stato_corrente (impianto_id, categoria, report_id, data_riferimento)
+    SELECT impianto_id, categoria, id, data_riferimento FROM report_riconciliazioni
+    WHERE impianto_id = NEW.impianto_id AND categoria = NEW.categoria
+    ORDER BY data_riferimento DESC LIMIT 1;
+END;
+
+-- Conteggi e somme per (giorno, categoria, stato, risolto): /api/chart-data e /api/stats.
+-- Aggiornata per differenza dai trigger; ricostruzione: python -m backend.riconciliazione.aggregati
+
+CREATE TABLE report_rollup_giornaliero (
+    data_riferimento DATE NOT NULL,
+    categoria VARCHAR(50) NOT NULL,
+    stato VARCHAR(50) NOT NULL,
+    risolto INTEGER NOT NULL,
+    num_record INTEGER NOT NULL DEFAULT 0,
+    tot_fortech REAL NOT NULL DEFAULT 0,
+    tot_reale REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (data_riferimento, categoria, stato, risolto)
+);
+
+CREATE TRIGGER trg_report_rollup_insert
+AFTER INSERT ON report_riconciliazioni
+BEGIN
+    INSERT INTO report_rollup_giornaliero
+    (data_riferimento, categoria, stato, risolto, num_record, tot_fortech, tot_reale)
+    VALUES (NEW.data_riferimento, NEW.categoria, COALESCE(NEW.stato, ''), COALESCE(NEW.risolto, 0),
+            1, COALESCE(NEW.valore_fortech, 0), COALESCE(NEW.valore_reale, 0))
+    ON CONFLICT(data_riferimento, categoria, stato, risolto) DO UPDATE SET
+        num_record = num_record + 1,
+        tot_fortech = tot_fortech + excluded.tot_fortech,
+        tot_reale = tot_reale + excluded.tot_reale;
+END;
+
+CREATE TRIGGER trg_report_rollup_delete
+AFTER DELETE ON report_riconciliazioni
+BEGIN
+    UPDATE report_rollup_giornaliero SET
+        num_record = num_record - 1,
+        tot_fortech = tot_fortech - COALESCE(OLD.valore_fortech, 0),
+        tot_reale = tot_reale - COALESCE(OLD.valore_reale, 0)
+    WHERE data_riferimento = OLD.data_riferimento AND categoria = OLD.categoria
+      AND stato = COALESCE(OLD.stato, '') AND risolto = COALESCE(OLD.risolto, 0);
+    DELETE FROM report_rollup_giornaliero
+    WHERE data_riferimento = OLD.data_riferimento AND categoria = OLD.categoria
+      AND stato = COALESCE(OLD.stato, '') AND risolto = COALESCE(OLD.risolto, 0) AND num_record <= 0;
+END;
+
+CREATE TRIGGER trg_report_rollup_update
+AFTER UPDATE OF data_riferimento, categoria, stato, risolto, valore_fortech, valore_reale
+ON report_riconciliazioni
+BEGIN
+    UPDATE report_rollup_giornaliero SET
+        num_record = num_record - 1,
+        tot_fortech = tot_fortech - COALESCE(OLD.valore_fortech, 0),
+        tot_reale = tot_reale - COALESCE(OLD.valore_reale, 0)
+    WHERE data_riferimento = OLD.data_riferimento AND categoria = OLD.categoria
+      AND stato = COALESCE(OLD.stato, '') AND risolto = COALESCE(OLD.risolto, 0);
+    DELETE FROM report_rollup_giornaliero
+    WHERE data_riferimento = OLD.data_riferimento AND categoria = OLD.categoria
+      AND stato = COALESCE(OLD.stato, '') AND risolto = COALESCE(OLD.risolto, 0) AND num_record <= 0;
+    INSERT INTO report_rollup_giornaliero
+    (data_riferimento, categoria, stato, risolto, num_record, tot_fortech, tot_reale)
+    VALUES (NEW.data_riferimento, NEW.categoria, COALESCE(NEW.stato, ''), COALESCE(NEW.risolto, 0),
+            1, COALESCE(NEW.valore_fortech, 0), COALESCE(NEW.valore_reale, 0))
+    ON CONFLICT(data_riferimento, categoria, stato, risolto) DO UPDATE SET
+        num_record = num_record + 1,
+        tot_fortech = tot_fortech + excluded.tot_fortech,
+        tot_reale = tot_reale + excluded.tot_reale;
+END;
+
 -- ============================================================================
 -- 📌 DATI INIZIALI: IMPIANTO DI ESEMPIO (Milano Repubblica)
 -- ============================================================================
@@ -211,15 +211,29 @@ async function processFiles() {
             body: formData,
         });
 
-        pct.textContent = '90%';
-        fill.style.width = '90%';
-
-        const data = await resp.json();
+        const avvio = await resp.json();
 
         if (!resp.ok) {
-            throw new Error(data.error || 'Errore sconosciuto');
+            throw new Error(avvio.error || 'Errore sconosciuto');
         }
 
+        (avvio.file || []).forEach(f => {
+            const tipo = f.tipo ? `${f.tipo} (${Math.round(f.confidenza * 100)}%${f.metodo === 'nome' ? ', dal nome' : ''})` : 'non riconosciuto';
+            logLine(log, `${f.file}: ${tipo}`);
+        });
+        logLine(log, `Job ${avvio.job_id} avviato, elaborazione in background...`);
+
+        // Polling dello stato del job fino al termine
+        const data = await attendiJob(avvio.job_id, (job) => {
+            const perc = Math.max(30, job.percentuale || 0);
+            pct.textContent = `${perc}%`;
+            fill.style.width = `${perc}%`;
+            if (job.fase && job.fase !== phase.textContent) {
+                phase.textContent = job.fase;
+                logLine(log, job.fase);
+            }
+        });
+
         // Show logs from server
         if (data.logs) {
             data.logs.forEach(msg => logLine(log, msg));
@@ -251,6 +265,23 @@ async function processFiles() {
     }
 }
 
+const JOB_POLL_MS = 1000;
+
+async function attendiJob(jobId, onProgress) {
+    // Interroga /api/jobs/<id> finche' il job non e' COMPLETATO o in ERRORE
+    while (true) {
+        const resp = await fetch(`/api/jobs/${jobId}`);
+        const job = await resp.json();
+        if (!resp.ok) {
+            throw new Error(job.error || 'Job non trovato');
+        }
+        onProgress(job);
+        if (job.stato === 'COMPLETATO') return job.risultato || {};
+        if (job.stato === 'ERRORE') throw new Error(job.errore || 'Elaborazione fallita');
+        await new Promise(r => setTimeout(r, JOB_POLL_MS));
+    }
+}
+
 function logLine(container, msg) {
     const time = new Date().toLocaleTimeString('it-IT');
     container.innerHTML += `[${time}] ${msg}\n`;
@@ -263,18 +294,10 @@ function logLine(container, msg) {
 
 async function apiFetch(endpoint, options = {}) {
     try {
-        // Prevent aggressive browser caching for all our API endpoints
-        const defaultOptions = { cache: 'no-store', ...options };
-        let url = endpoint;
-
-        // Manual cache-busting query parameter solo per GET
-        if (!options.method || options.method.toUpperCase() === 'GET') {
-            url = endpoint.includes('?')
-                ? `${endpoint}&_t=${Date.now()}`
-                : `${endpoint}?_t=${Date.now()}`;
-        }
+        // Il browser rivalida sempre con l'ETag: 304 (copia in cache) finche' i dati non cambiano
+        const defaultOptions = { cache: 'no-cache', ...options };
 
-        const resp = await fetch(url, defaultOptions);
+        const resp = await fetch(endpoint, defaultOptions);
         if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
         return await resp.json();
     } catch (err) {
@@ -283,6 +306,18 @@ async function apiFetch(endpoint, options = {}) {
     }
 }
 
+// Liste paginate: { dati, cursore } con il cursore della pagina successiva (header X-Next-Cursor)
+async function apiFetchPagina(endpoint) {
+    try {
+        const resp = await fetch(endpoint, { cache: 'no-cache' });
+        if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+        return { dati: await resp.json(), cursore: resp.headers.get('X-Next-Cursor') };
+    } catch (err) {
+        console.error(`API error (${endpoint}):`, err);
+        return null;
+    }
+}
+
 // ── Chart Incassi ──
 let _chartFortechInst = null;
 let _chartRealeInst = null;
@@ -462,15 +497,44 @@ async function loadStatoVerifiche() {
 }
 
 // ── Riconciliazioni ──
-async function loadRiconciliazioni() {
-    const da = document.getElementById('filterDa').value;
-    const a = document.getElementById('filterA').value;
+const FILTRI_RICONCILIAZIONI = {
+    da: 'filterDa',
+    a: 'filterA',
+    impianto: 'filterImpianto',
+    categoria: 'filterCategoria',
+    stato: 'filterStato',
+};
+
+// Righe gia' caricate e cursore della pagina successiva
+let _ricRighe = [];
+let _ricCursore = null;
+
+async function caricaFiltroImpianti() {
+    const select = document.getElementById('filterImpianto');
+    if (select.options.length > 1) return;
+    const impianti = await apiFetch('/api/impianti');
+    (impianti || []).forEach(imp => select.add(new Option(imp.nome, imp.id)));
+}
 
-    let url = '/api/riconciliazioni?';
-    if (da) url += `da=${da}&`;
-    if (a) url += `a=${a}&`;
+async function loadRiconciliazioni(altri = false) {
+    await caricaFiltroImpianti();
+    const params = new URLSearchParams();
+    for (const [nome, id] of Object.entries(FILTRI_RICONCILIAZIONI)) {
+        const valore = document.getElementById(id).value;
+        if (valore) params.set(nome, valore);
+    }
+    if (altri && _ricCursore) params.set('cursor', _ricCursore);
+
+    const pagina = await apiFetchPagina(`/api/riconciliazioni?${params}`);
+    if (!altri) _ricRighe = [];
+    if (pagina) _ricRighe = _ricRighe.concat(pagina.dati);
+    _ricCursore = pagina ? pagina.cursore : null;
+    document.getElementById('btnAltreRiconciliazioni').style.display = _ricCursore ? 'block' : 'none';
+    renderRiconciliazioni();
+}
 
-    const data = await apiFetch(url);
+function renderRiconciliazioni() {
+    const data = _ricRighe;
     const container = document.getElementById('riconciliazioniTablesContainer');
 
     if (!data || data.length === 0) {
@@ -613,26 +677,28 @@ async function salvaModificheRic(id) {
     }
 }
 
-function esportaExcel() {
+// formato: 'excel' (default) o 'csv', con i filtri correnti della vista
+function esportaExcel(formato = 'excel') {
     const token = localStorage.getItem("access_token");
     if (!token) {
         showToast("Errore di sessione: esegui nuovamente il login", "error");
         return;
     }
-    const da = document.getElementById('filterDa').value;
-    const a = document.getElementById('filterA').value;
+    const params = new URLSearchParams();
+    for (const [nome, id] of Object.entries(FILTRI_RICONCILIAZIONI)) {
+        const valore = document.getElementById(id).value;
+        if (valore) params.set(nome, valore);
+    }
+    const estensione = formato === 'excel' ? 'xlsx' : formato;
 
-    let url = '/api/riconciliazioni/export/excel';
-    let params = [];
-    if (da) params.push(`da=${da}`);
-    if (a) params.push(`a=${a}`);
-    if (params.length > 0) url += '?' + params.join('&');
+    let url = `/api/riconciliazioni/export/${formato}`;
+    if (params.toString()) url += '?' + params;
 
     fetch(url, {
         headers: { 'Authorization': `Bearer ${token}` }
     })
         .then(response => {
-            if (!response.ok) throw new Error("Errore generazione Excel");
+            if (!response.ok) throw new Error(`Errore generazione ${formato}`);
             return response.blob();
         })
         .then(blob => {
@@ -640,7 +706,7 @@ function esportaExcel() {
             const aElement = document.createElement('a');
             aElement.style.display = 'none';
             aElement.href = url;
-            const filename = `Riconciliazioni_${new Date().toISOString().split('T')[0]}.xlsx`;
+            const filename = `Riconciliazioni_${new Date().toISOString().split('T')[0]}.${estensione}`;
             aElement.download = filename;
             document.body.appendChild(aElement);
             aElement.click();
@@ -648,7 +714,7 @@ function esportaExcel() {
         })
         .catch(err => {
             console.error(err);
-            showToast("Impossibile esportare in Excel", "error");
+            showToast(`Impossibile esportare in ${formato.toUpperCase()}`, "error");
         });
 }
 
@@ -672,7 +738,7 @@ function esportaPDF() {
 
     html2pdf().set(opt).from(element).save().then(() => {
         // Ripristina l'UI
-        loadRiconciliazioni();
+        renderRiconciliazioni();
     });
 }
 
@@ -694,8 +760,21 @@ function renderTipoMatch(tipo) {
     return `<span class="tipo-match-badge ${t.css}">${t.icon} ${t.label}</span>`;
 }
 
-async function loadContantiBanca() {
-    const data = await apiFetch('/api/contanti-banca');
+// Righe gia' caricate e cursore della pagina successiva
+let _contantiRighe = [];
+let _contantiCursore = null;
+
+async function loadContantiBanca(altri = false) {
+    const url = altri && _contantiCursore
+        ? `/api/contanti-banca?cursor=${encodeURIComponent(_contantiCursore)}`
+        : '/api/contanti-banca';
+    const pagina = await apiFetchPagina(url);
+    if (!altri) _contantiRighe = [];
+    if (pagina) _contantiRighe = _contantiRighe.concat(pagina.dati);
+    _contantiCursore = pagina ? pagina.cursore : null;
+    document.getElementById('btnAltriContanti').style.display = _contantiCursore ? 'block' : 'none';
+
+    const data = _contantiRighe;
     const container = document.getElementById('contantiList');
     const statsContainer = document.getElementById('contantiStats');
 
@@ -1179,6 +1258,27 @@ async function updateConfig(e) {
     }
 }
 
+// Ricalcola i report dall'archivio delle sorgenti con le tolleranze correnti (job in background)
+async function rieseguiDaArchivio() {
+    const status = document.getElementById('cfg-status');
+    status.className = 'status-message show';
+    status.style.color = 'var(--text-secondary)';
+    status.textContent = 'Riconciliazione in coda...';
+    try {
+        const resp = await fetch('/api/riconciliazioni/riesegui', { method: 'POST' });
+        const avvio = await resp.json();
+        if (!resp.ok) throw new Error(avvio.error || 'Errore sconosciuto');
+        const data = await attendiJob(avvio.job_id, (job) => {
+            status.textContent = `${job.fase || 'In corso'} (${job.percentuale || 0}%)`;
+        });
+        status.textContent = `✔ ${data.message}`;
+        status.style.color = 'var(--status-ok)';
+    } catch (err) {
+        status.textContent = `✖ ${err.message}`;
+        status.style.color = 'var(--status-danger)';
+    }
+}
+
 async function updatePassword(e) {
     e.preventDefault();
     const status = document.getElementById('pw-status');
@@ -3,9 +3,10 @@ import pandas as pd
 import numpy as np
 import os
 import re
-import glob
 from datetime import datetime, timedelta
 
+from backend.riconciliazione.classificatore import classifica_cartella
+
 # ==========================================
 # CONFIGURAZIONI GLOBALI
 # ==========================================
@@ -23,30 +24,21 @@ FILE_SATISPAY = None
 
 def identifica_file(input_dir):
     global FILE_FORTECH, FILE_CONTANTI, FILE_CARTE, FILE_PETROLIFERE, FILE_BUONI, FILE_SATISPAY
-    
-    # Reset all variables to prevent leakage between runs
-    FILE_FORTECH = FILE_CONTANTI = FILE_CARTE = FILE_PETROLIFERE = FILE_BUONI = FILE_SATISPAY = None
 
-    file_excel = glob.glob(os.path.join(input_dir, "*.xlsx")) + glob.glob(os.path.join(input_dir, "*.xls")) + glob.glob(os.path.join(input_dir, "*.csv"))
-    
-    for file_path in file_excel:
-        nome_file = os.path.basename(file_path).lower()
-        # Normalizziamo sia gli underscore che gli spazi in un formato unico per il match
-        nome_norm = nome_file.replace("_", " ")
-        
-        # Logica di identificazione
-        if "fortech" in nome_norm or nome_file.startswith("a_"):
-            FILE_FORTECH = file_path
-        elif "contanti" in nome_norm or nome_file.startswith("1_"):
-            FILE_CONTANTI = file_path
-        elif ("carte bancarie" in nome_norm or "numia" in nome_norm or nome_file.startswith("2_")) and "petrolifere" not in nome_norm:
-            FILE_CARTE = file_path
-        elif "petrolifere" in nome_norm or "azzurro" in nome_norm or nome_file.startswith("3_"):
-            FILE_PETROLIFERE = file_path
-        elif "buoni" in nome_norm or "rosso" in nome_norm or nome_file.startswith("4_"):
-            FILE_BUONI = file_path
-        elif "satispay" in nome_norm or "grigio" in nome_norm or nome_file.startswith("5_"):
-            FILE_SATISPAY = file_path
+
+    # Tipo di ogni file riconosciuto dal contenuto (intestazioni e nomi dei fogli).
+    # Questo script legge un solo file per tipo: con piu' file vale l'ultimo in ordine di nome.
+    file_per_tipo, esiti = classifica_cartella(input_dir)
+    ultimo = {tipo: percorsi[-1] for tipo, percorsi in file_per_tipo.items()}
+    FILE_FORTECH = ultimo.get('fortech')
+    FILE_CONTANTI = ultimo.get('contanti')
+    FILE_CARTE = ultimo.get('carte')
+    FILE_PETROLIFERE = ultimo.get('petrolifere')
+    FILE_BUONI = ultimo.get('buoni')
+    FILE_SATISPAY = ultimo.get('satispay')
+
+    for esito in esiti:
+        print(f"{esito['file']}: {esito['tipo']} (confidenza {esito['confidenza']}, {esito['metodo']})")
 
     print("\n--- FILE IDENTIFICATI ---")
     print(f"FORTECH:           {FILE_FORTECH}")
@@ -12,7 +12,9 @@ import threading
 import tempfile
 import shutil
 import time
-from flask import Flask, render_template, jsonify, request
+from functools import wraps
+from collections import OrderedDict
+from flask import Flask, render_template, jsonify, request, make_response, Response
 from werkzeug.utils import secure_filename
 
 # Add project root to sys path
@@ -20,12 +22,22 @@ PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(PROJECT_ROOT)
 
 from backend.riconciliazione.orchestratore import Orchestratore
-from backend.riconciliazione.db_manager import get_db_connection
+from backend.riconciliazione.db_manager import (
+    connessione_pool, attiva_wal, assicura_schema, incrementa_versione, leggi_versioni
+)
+from backend.riconciliazione.configurazione import (
+    CONFIG_PATH, BANDE_TOLLERANZA, configurazione, bande_tolleranza,
+    ricarica as ricarica_configurazione
+)
 from backend.riconciliazione.ai_report import get_saved_api_key, generate_report
 
 from flask_jwt_extended import JWTManager, jwt_required
 from backend.auth import auth_bp
 from backend.models import init_auth_db
+from backend.jobs import CodaJobs, init_jobs_db, leggi_job
+from backend import esportazione
+from backend.riconciliazione import cache_letture
+from backend.riconciliazione.classificatore import classifica_cartella
 import datetime
 
 DB_PATH = os.path.join(PROJECT_ROOT, "database_riconciliazioni.db")
@@ -42,12 +54,110 @@ app.config['JWT_REFRESH_TOKEN_EXPIRES'] = datetime.timedelta(days=7)
 jwt = JWTManager(app)
 
 app.register_blueprint(auth_bp)
-init_auth_db(DB_PATH)
+
+
+def init_db():
+    """WAL e schema allineato (indici, meta_versioni) prima di servire richieste."""
+    attiva_wal(DB_PATH)
+    conn = connessione_pool(DB_PATH)
+    try:
+        assicura_schema(conn)
+    finally:
+        conn.close()
+
+
+# I worker "spawn" della riconciliazione reimportano questo modulo come __mp_main__:
+# schema e tabella jobs restano al processo del server
+if __name__ != "__mp_main__":
+    init_db()
+    init_auth_db(DB_PATH)
+    init_jobs_db(DB_PATH)
+
+# Coda dei job in background (upload): un worker = una elaborazione alla volta
+coda_jobs = CodaJobs(DB_PATH, max_workers=int(os.environ.get("JOBS_WORKERS", 1)))
 
 
 def get_readonly_db():
-    conn = get_db_connection(DB_PATH)
-    return conn
+    """Connessione in sola lettura (URI mode=ro) dal pool; close() la restituisce."""
+    return connessione_pool(DB_PATH, sola_lettura=True)
+
+
+def get_write_db():
+    """Connessione in lettura/scrittura dal pool, per gli endpoint che modificano i dati."""
+    return connessione_pool(DB_PATH)
+
+
+# ============================================================================
+# CACHE HTTP (ETag / Last-Modified dalla versione dei dati)
+# ============================================================================
+
+# Versioni di meta_versioni da cui dipendono le API in sola lettura
+CHIAVI_VERSIONE = ('dati', 'impianti')
+MAX_RISPOSTE_IN_CACHE = 256
+
+_cache_risposte = OrderedDict()
+_cache_etag = [None]
+_lock_cache = threading.Lock()
+
+
+def _versione_dati():
+    """(etag, last_modified) dalle versioni correnti di meta_versioni."""
+    conn = get_readonly_db()
+    try:
+        versioni = leggi_versioni(conn)
+    finally:
+        conn.close()
+    etag = "v" + "-".join(str(versioni.get(k, (0, None))[0]) for k in CHIAVI_VERSIONE)
+    date = [versioni[k][1] for k in CHIAVI_VERSIONE if k in versioni and versioni[k][1]]
+    last_modified = None
+    if date:
+        last_modified = datetime.datetime.strptime(max(date), "%Y-%m-%d %H:%M:%S").replace(
+            tzinfo=datetime.timezone.utc
+        )
+    return etag, last_modified
+
+
+def risposta_versionata(view):
+    """
+    GET in sola lettura: ETag e Last-Modified dalla versione dei dati, 304 alle
+    richieste condizionali e cache in memoria delle risposte per
+    (endpoint, parametri, versione). Un upload o una modifica cambiano la
+    versione e con essa la chiave, la cache vecchia viene svuotata.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        etag, last_modified = _versione_dati()
+        if request.if_none_match.contains(etag):
+            risposta = Response(status=304)
+        else:
+            parametri = tuple(sorted((k, v) for k, v in request.args.items(multi=True) if k != '_t'))
+            chiave = (request.path, parametri)
+            with _lock_cache:
+                if _cache_etag[0] != etag:
+                    _cache_risposte.clear()
+                    _cache_etag[0] = etag
+                cached = _cache_risposte.get(chiave)
+                if cached is not None:
+                    _cache_risposte.move_to_end(chiave)
+            if cached is None:
+                risposta = make_response(view(*args, **kwargs))
+                if risposta.status_code == 200:
+                    with _lock_cache:
+                        if _cache_etag[0] == etag:
+                            _cache_risposte[chiave] = (risposta.get_data(), list(risposta.headers.items()))
+                            while len(_cache_risposte) > MAX_RISPOSTE_IN_CACHE:
+                                _cache_risposte.popitem(last=False)
+            else:
+                risposta = Response(cached[0], headers=cached[1])
+        if risposta.status_code not in (200, 304):
+            return risposta
+        risposta.set_etag(etag)
+        if last_modified:
+            risposta.last_modified = last_modified
+        # Il browser tiene la risposta ma la rivalida sempre (304 se i dati non sono cambiati)
+        risposta.headers['Cache-Control'] = 'private, no-cache'
+        return risposta.make_conditional(request)
+    return wrapper
 
 # ============================================================================
 # PAGES
@@ -65,6 +175,7 @@ def login_page():
 # ============================================================================
 @app.route("/api/chart-data")
 @jwt_required()
+@risposta_versionata
 def api_chart_data():
     """Aggregated Fortech vs Reale totals per category for dashboard pie charts."""
     conn = get_readonly_db()
@@ -73,10 +184,10 @@ def api_chart_data():
         cur.execute("""
             SELECT
                 categoria,
-                ROUND(SUM(COALESCE(valore_fortech, 0)), 2) AS tot_fortech,
-                ROUND(SUM(COALESCE(valore_reale,   0)), 2) AS tot_reale,
-                COUNT(*) AS num_record
-            FROM report_riconciliazioni
+                ROUND(SUM(tot_fortech), 2) AS tot_fortech,
+                ROUND(SUM(tot_reale),   2) AS tot_reale,
+                SUM(num_record) AS num_record
+            FROM report_rollup_giornaliero
             GROUP BY categoria
             ORDER BY tot_fortech DESC
         """)
@@ -90,61 +201,34 @@ def api_chart_data():
 
 @app.route("/api/stats")
 @jwt_required()
+@risposta_versionata
 def api_stats():
     """Global statistics for the dashboard header."""
     conn = get_readonly_db()
     try:
         cur = conn.cursor()
 
-        # Total impianti
-        cur.execute("SELECT COUNT(*) as c FROM impianti WHERE attivo = 1")
-        total_impianti = cur.fetchone()['c']
-
-        # Total giornate analizzate
-        cur.execute("SELECT COUNT(DISTINCT data_riferimento) as c FROM report_riconciliazioni")
-        total_giornate = cur.fetchone()['c']
-
-        # Anomalie
-        cur.execute("""
-            SELECT COUNT(*) as c FROM report_riconciliazioni 
-            WHERE stato IN ('ANOMALIA_LIEVE', 'ANOMALIA_GRAVE') AND risolto = 0
-        """)
-        anomalie_aperte = cur.fetchone()['c']
-
-        # Quadrate
-        cur.execute("SELECT COUNT(*) as c FROM report_riconciliazioni WHERE stato = 'QUADRATO'")
-        quadrate = cur.fetchone()['c']
-
-        # Anomalie gravi
+        # Contatori dal rollup giornaliero (una sola lettura, non scorre lo storico)
         cur.execute("""
-            SELECT COUNT(*) as c FROM report_riconciliazioni 
-            WHERE stato = 'ANOMALIA_GRAVE' AND risolto = 0
+            SELECT
+                (SELECT COUNT(*) FROM impianti WHERE attivo = 1) AS total_impianti,
+                COUNT(DISTINCT ru.data_riferimento) AS total_giornate,
+                COALESCE(SUM(CASE WHEN ru.stato IN ('ANOMALIA_LIEVE', 'ANOMALIA_GRAVE') AND ru.risolto = 0
+                             THEN ru.num_record END), 0) AS anomalie_aperte,
+                COALESCE(SUM(CASE WHEN ru.stato = 'ANOMALIA_GRAVE' AND ru.risolto = 0
+                             THEN ru.num_record END), 0) AS anomalie_gravi,
+                COALESCE(SUM(CASE WHEN ru.stato = 'QUADRATO' THEN ru.num_record END), 0) AS quadrate,
+                (SELECT COUNT(*) FROM import_fortech_master) AS fortech_records,
+                (SELECT MAX(data_importazione) FROM import_fortech_master) AS last_import
+            FROM report_rollup_giornaliero ru
         """)
-        anomalie_gravi = cur.fetchone()['c']
-
-        # Total records imported
-        cur.execute("SELECT COUNT(*) as c FROM import_fortech_master")
-        fortech_records = cur.fetchone()['c']
-        
-        # Last import date
-        cur.execute("SELECT MAX(data_importazione) as md FROM import_fortech_master")
-        row = cur.fetchone()
-        last_import = row['md'] if row else None
-
-        return jsonify({
-            "total_impianti": total_impianti,
-            "total_giornate": total_giornate,
-            "anomalie_aperte": anomalie_aperte,
-            "anomalie_gravi": anomalie_gravi,
-            "quadrate": quadrate,
-            "fortech_records": fortech_records,
-            "last_import": last_import,
-        })
+        return jsonify(dict(cur.fetchone()))
     finally:
         conn.close()
 
 @app.route("/api/impianti")
 @jwt_required()
+@risposta_versionata
 def api_impianti():
     """List all impianti with their latest reconciliation status."""
     conn = get_readonly_db()
@@ -158,6 +242,8 @@ def api_impianti():
                 i.tipo_gestione,
                 i.citta,
                 i.attivo,
+                -- Conteggi: ricerche solo-indice su idx_report_impianto_stato; data: su
+                -- ux_report_impianto_data_categoria (vedi benchmarks/bench_api_impianti.py)
                 (SELECT COUNT(*) FROM report_riconciliazioni r 
                  WHERE r.impianto_id = i.id AND r.stato = 'QUADRATO') as cnt_ok,
                 (SELECT COUNT(*) FROM report_riconciliazioni r 
@@ -182,6 +268,7 @@ def api_impianti():
 
 @app.route("/api/impianti/<int:impianto_id>/andamento")
 @jwt_required()
+@risposta_versionata
 def api_andamento(impianto_id):
     """Andamento riconciliazione per un singolo impianto nel tempo."""
     conn = get_readonly_db()
@@ -264,17 +351,86 @@ def api_andamento(impianto_id):
     finally:
         conn.close()
 
+# ============================================================================
+# PAGINAZIONE A CURSORE DEI REPORT
+# ============================================================================
+
+# parametro della query string -> (condizione, conversione)
+FILTRI_REPORT = {
+    "impianto": ("r.impianto_id = ?", int),
+    "categoria": ("r.categoria = ?", str),
+    "stato": ("r.stato = ?", str),
+    "risolto": ("r.risolto = ?", lambda v: 1 if v.lower() in ("1", "true", "si") else 0),
+    "da": ("r.data_riferimento >= ?", str),
+    "a": ("r.data_riferimento <= ?", str),
+}
+MAX_RIGHE_PAGINA = 1000
+
+
+def _filtri_report(condizioni=(), parametri=()):
+    """Condizioni e parametri SQL dei filtri di FILTRI_REPORT presenti nella richiesta."""
+    condizioni = list(condizioni)
+    parametri = list(parametri)
+    for nome, (condizione, conversione) in FILTRI_REPORT.items():
+        valore = request.args.get(nome)
+        if valore:
+            condizioni.append(condizione)
+            parametri.append(conversione(valore))
+    return condizioni, parametri
+
+
+def _pagina_report(select, condizioni=(), parametri=(), limite_default=200):
+    """
+    Una pagina di report_riconciliazioni (alias r) ordinata per
+    (data_riferimento, id) decrescenti, con i filtri di FILTRI_REPORT presenti
+    nella richiesta. Paginazione keyset: il cursore 'data,id' e' l'ultima riga
+    della pagina precedente e la pagina successiva parte dall'indice subito
+    dopo, senza OFFSET, quindi il tempo non dipende dalla profondita'.
+    Ritorna (righe, cursore successivo o None); ValueError se i parametri non sono validi.
+    """
+    condizioni, parametri = _filtri_report(condizioni, parametri)
+
+    cursore = request.args.get("cursor")
+    if cursore:
+        data_cursore, _, id_cursore = cursore.rpartition(",")
+        if not data_cursore:
+            raise ValueError("cursor non valido")
+        condizioni.append("(r.data_riferimento, r.id) < (?, ?)")
+        parametri += [data_cursore, int(id_cursore)]
+
+    limite = min(max(request.args.get("limit", limite_default, type=int), 1), MAX_RIGHE_PAGINA)
+    query = select
+    if condizioni:
+        query += " WHERE " + " AND ".join(condizioni)
+    # Una riga in piu' per sapere se esiste la pagina successiva
+    query += " ORDER BY r.data_riferimento DESC, r.id DESC LIMIT ?"
+    parametri.append(limite + 1)
+
+    conn = get_readonly_db()
+    try:
+        righe = [dict(r) for r in conn.execute(query, parametri).fetchall()]
+    finally:
+        conn.close()
+    if len(righe) <= limite:
+        return righe, None
+    righe = righe[:limite]
+    return righe, f"{righe[-1]['data']},{righe[-1]['id']}"
+
+
+def _risposta_pagina(righe, cursore):
+    """Lista JSON della pagina; il cursore della successiva va nell'header X-Next-Cursor."""
+    risposta = jsonify(righe)
+    if cursore:
+        risposta.headers["X-Next-Cursor"] = cursore
+    return risposta
+
+
 @app.route("/api/riconciliazioni")
 @jwt_required()
+@risposta_versionata
 def api_riconciliazioni():
-    conn = get_readonly_db()
     try:
-        cur = conn.cursor()
-        limit = request.args.get("limit", 200, type=int)
-        da = request.args.get("da")
-        a = request.args.get("a")
-
-        query = """
+        righe, cursore = _pagina_report("""
             SELECT 
                 r.id,
                 r.data_riferimento as data,
@@ -288,28 +444,14 @@ def api_riconciliazioni():
                 r.note
             FROM report_riconciliazioni r
             JOIN impianti i ON r.impianto_id = i.id
-            WHERE 1=1
-        """
-        params = []
-        
-        if da:
-            query += " AND r.data_riferimento >= ?"
-            params.append(da)
-        if a:
-            query += " AND r.data_riferimento <= ?"
-            params.append(a)
-            
-        query += " ORDER BY r.data_riferimento DESC, i.nome_impianto LIMIT ?"
-        params.append(limit)
-
-        cur.execute(query, params)
-        rows = cur.fetchall()
-        return jsonify([dict(r) for r in rows])
-    finally:
-        conn.close()
+        """)
+    except ValueError as e:
+        return jsonify({"error": f"Parametri non validi: {e}"}), 400
+    return _risposta_pagina(righe, cursore)
 
 @app.route("/api/stato-verifiche")
 @jwt_required()
+@risposta_versionata
 def api_stato_verifiche():
     conn = get_readonly_db()
     try:
@@ -326,14 +468,11 @@ def api_stato_verifiche():
                 r.differenza,
                 r.stato,
                 r.note
-            FROM report_riconciliazioni r
-            JOIN impianti i ON r.impianto_id = i.id
-            WHERE r.data_riferimento = (
-                SELECT MAX(r2.data_riferimento) 
-                FROM report_riconciliazioni r2 
-                WHERE r2.impianto_id = r.impianto_id AND r2.categoria = r.categoria
-            )
-            AND i.attivo = 1
+            -- Riga piu' recente per (impianto, categoria), mantenuta dai trigger
+            FROM report_stato_corrente s
+            JOIN report_riconciliazioni r ON r.id = s.report_id
+            JOIN impianti i ON s.impianto_id = i.id
+            WHERE i.attivo = 1
             ORDER BY i.nome_impianto, r.categoria
         """)
         
@@ -364,11 +503,10 @@ def api_stato_verifiche():
 
 @app.route("/api/contanti-banca")
 @jwt_required()
+@risposta_versionata
 def api_contanti_banca():
-    conn = get_readonly_db()
     try:
-        cur = conn.cursor()
-        cur.execute("""
+        righe, cursore = _pagina_report("""
             SELECT 
                 r.id,
                 r.data_riferimento as data,
@@ -385,17 +523,12 @@ def api_contanti_banca():
                 r.data_verifica
             FROM report_riconciliazioni r
             JOIN impianti i ON r.impianto_id = i.id
-            WHERE r.categoria = 'contanti'
-            ORDER BY r.data_riferimento DESC, i.nome_impianto
-            LIMIT 100
-        """)
-        rows = cur.fetchall()
-        res = [dict(r) for r in rows]
-        for r in res:
-            r['risolto'] = bool(r['risolto'])
-        return jsonify(res)
-    finally:
-        conn.close()
+        """, ["r.categoria = 'contanti'"], limite_default=100)
+    except ValueError as e:
+        return jsonify({"error": f"Parametri non validi: {e}"}), 400
+    for r in righe:
+        r['risolto'] = bool(r['risolto'])
+    return _risposta_pagina(righe, cursore)
 
 @app.route("/api/sicurezza")
 @jwt_required()
@@ -446,7 +579,7 @@ def api_ai_report():
 @jwt_required()
 def api_contanti_conferma():
     """Conferma o rifiuta un matching Contanti dalla Vista Simona."""
-    conn = get_readonly_db()
+    conn = get_write_db()
     try:
         data = request.get_json()
         rec_id = data.get("id")
@@ -476,6 +609,7 @@ def api_contanti_conferma():
             )
             nuovo_stato = "segnalato"
 
+        incrementa_versione(conn, 'dati')
         conn.commit()
         return jsonify({"message": f"Record {nuovo_stato}", "stato": nuovo_stato}), 200
 
@@ -490,7 +624,7 @@ def api_contanti_conferma():
 @app.route("/api/riconciliazioni/edit", methods=["POST"])
 @jwt_required()
 def api_riconciliazioni_edit():
-    conn = get_readonly_db()
+    conn = get_write_db()
     try:
         data = request.get_json()
         rec_id = data.get("id")
@@ -517,26 +651,11 @@ def api_riconciliazioni_edit():
         diff_netta = teorico - nuovo_reale
         diff_assoluta = abs(diff_netta)
         
-        # Leggi configurazioni
-        config_path = os.path.join(PROJECT_ROOT, "backend", "config.json")
-        import json
-        cfg = {}
-        try:
-            with open(config_path, "r") as f:
-                cfg = json.load(f)
-        except Exception:
-            pass
-            
-        toll_stretta = 0.50
-        toll_larga = 5.00
-        
-        if categoria == "contanti":
-            toll_stretta = float(cfg.get("tolleranza_contanti_arrotondamento", 5.00))
-            toll_larga = 20.00
-        elif categoria == "carte_bancarie":
-            toll_stretta = float(cfg.get("tolleranza_carte_fisiologica", 0.50))
-        elif categoria == "satispay":
-            toll_stretta = float(cfg.get("tolleranza_satispay", 0.01))
+        # Bande di tolleranza della categoria, le stesse usate dai motori
+        if categoria in BANDE_TOLLERANZA:
+            toll_stretta, toll_larga = bande_tolleranza(categoria)
+        else:
+            toll_stretta, toll_larga = 0.50, 5.00
             
         if teorico == 0 and nuovo_reale == 0:
             nuovo_stato = "QUADRATO"
@@ -554,6 +673,7 @@ def api_riconciliazioni_edit():
             SET valore_reale = ?, differenza = ?, stato = ?, note = ? 
             WHERE id = ?
         """, (nuovo_reale, diff_netta, nuovo_stato, nuove_note, rec_id))
+        incrementa_versione(conn, 'dati')
         conn.commit()
         
         return jsonify({"message": "Aggiornato con successo", "nuovo_stato": nuovo_stato, "differenza": diff_netta}), 200
@@ -564,71 +684,72 @@ def api_riconciliazioni_edit():
     finally:
         conn.close()
 
-import pandas as pd
-from io import BytesIO
-from flask import send_file
-
-@app.route("/api/riconciliazioni/export/excel", methods=["GET"])
+@app.route("/api/riconciliazioni/export/<formato>", methods=["GET"])
 @jwt_required()
-def api_export_excel():
-    conn = get_readonly_db()
+def api_export_riconciliazioni(formato):
+    """
+    Esporta i report filtrati (stessi filtri di /api/riconciliazioni) in
+    excel, csv o parquet. Le righe vengono lette e scritte a blocchi e la
+    risposta viene inviata a blocchi (vedi backend/esportazione.py).
+    """
+    if formato not in esportazione.ESTENSIONE:
+        return jsonify({"error": f"Formato non supportato: {formato}"}), 404
     try:
-        da = request.args.get("da")
-        a = request.args.get("a")
-
-        query = """
-            SELECT 
-                r.data_riferimento as Data,
-                i.nome_impianto as Impianto,
-                r.categoria as Categoria,
-                r.valore_fortech as Teorico_EUR,
-                r.valore_reale as Reale_EUR,
-                r.differenza as Differenza_EUR,
-                r.stato as Stato,
-                r.note as Note
-            FROM report_riconciliazioni r
-            JOIN impianti i ON r.impianto_id = i.id
-            WHERE 1=1
-        """
-        params = []
-        if da:
-            query += " AND r.data_riferimento >= ?"
-            params.append(da)
-        if a:
-            query += " AND r.data_riferimento <= ?"
-            params.append(a)
-            
-        query += " ORDER BY r.data_riferimento DESC, i.nome_impianto, r.categoria"
+        condizioni, params = _filtri_report()
+    except ValueError as e:
+        return jsonify({"error": f"Parametri non validi: {e}"}), 400
+
+    query = """
+        SELECT 
+            r.data_riferimento as Data,
+            i.nome_impianto as Impianto,
+            r.categoria as Categoria,
+            r.valore_fortech as Teorico_EUR,
+            r.valore_reale as Reale_EUR,
+            r.differenza as Differenza_EUR,
+            r.stato as Stato,
+            r.note as Note
+        FROM report_riconciliazioni r
+        JOIN impianti i ON r.impianto_id = i.id
+    """
+    if condizioni:
+        query += " WHERE " + " AND ".join(condizioni)
+    query += " ORDER BY r.data_riferimento DESC, i.nome_impianto, r.categoria"
+
+    da = request.args.get("da")
+    a = request.args.get("a")
+    filename = f"Riconciliazioni_{da or 'all'}_{a or 'all'}.{esportazione.ESTENSIONE[formato]}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
 
-        df = pd.read_sql_query(query, conn, params=params)
-        
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Riconciliazioni')
-            workbook = writer.book
-            worksheet = writer.sheets['Riconciliazioni']
-            
-            # Formattazione
-            money_fmt = workbook.add_format({'num_format': '€ #,##0.00'})
-            date_fmt = workbook.add_format({'num_format': 'yyyy-mm-dd'})
-            
-            for i, col in enumerate(df.columns):
-                col_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
-                worksheet.set_column(i, i, col_len)
-                if 'EUR' in col:
-                    worksheet.set_column(i, i, 15, money_fmt)
-                if col == 'Data':
-                    worksheet.set_column(i, i, 12, date_fmt)
-
-        output.seek(0)
-        filename = f"Riconciliazioni_{da or 'all'}_{a or 'all'}.xlsx"
-        return send_file(output, download_name=filename, as_attachment=True, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    conn = get_readonly_db()
+    if formato == 'csv':
+        # Streaming diretto dal cursore: la connessione si chiude a fine invio
+        def genera():
+            try:
+                yield from esportazione.csv_a_blocchi(conn.execute(query, params))
+            finally:
+                conn.close()
+        return Response(genera(), mimetype=esportazione.MIMETYPE[formato], headers=headers)
+
+    path = esportazione.file_temporaneo(esportazione.ESTENSIONE[formato])
+    try:
+        cur = conn.execute(query, params)
+        if formato == 'excel':
+            esportazione.scrivi_excel(cur, path)
+        else:
+            esportazione.scrivi_parquet(cur, path)
+    except ImportError:
+        os.remove(path)
+        return jsonify({"error": "Esportazione Parquet non disponibile: installare pyarrow"}), 501
     except Exception as e:
+        os.remove(path)
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
     finally:
         conn.close()
+    headers["Content-Length"] = str(os.path.getsize(path))
+    return Response(esportazione.file_a_blocchi(path), mimetype=esportazione.MIMETYPE[formato], headers=headers)
 
 # ============================================================================
 # API ENDPOINTS (WRITE / ACTION)
@@ -659,19 +780,23 @@ def api_update_password():
 @app.route("/api/settings/config", methods=["GET", "POST"])
 @jwt_required()
 def api_config():
-    config_path = os.path.join(PROJECT_ROOT, "backend", "config.json")
-    
     if request.method == "GET":
-        try:
-            with open(config_path, "r") as f:
-                return jsonify(json.load(f))
-        except FileNotFoundError:
-            return jsonify({}), 404
+        # Configurazione validata, con i default per le chiavi non salvate
+        return jsonify(configurazione())
             
     elif request.method == "POST":
         data = request.get_json()
-        with open(config_path, "w") as f:
-            json.dump(data, f, indent=4)
+        # Le chiavi non gestite dalla UI (es. modalita_abbinamento_contanti) vengono preservate
+        cfg = {}
+        try:
+            with open(CONFIG_PATH, "r") as f:
+                cfg = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+        cfg.update(data or {})
+        with open(CONFIG_PATH, "w") as f:
+            json.dump(cfg, f, indent=4)
+        ricarica_configurazione()
         return jsonify({"msg": "Configurazione aggiornata"}), 200
 
 @app.route("/api/upload", methods=["POST"])
@@ -686,6 +811,7 @@ def api_upload():
 
     temp_dir = tempfile.mkdtemp(prefix="calor_upload_")
     saved_paths = []
+    hash_file = {}
 
     try:
         # 1. Save files to isolated folder
@@ -693,37 +819,86 @@ def api_upload():
             if f.filename:
                 safe_name = secure_filename(f.filename)
                 path = os.path.join(temp_dir, safe_name)
-                f.save(path)
+                # SHA-256 calcolato durante il salvataggio: chiave della cache dei file gia' letti
+                hash_file[safe_name] = cache_letture.salva_upload(f.stream, path)
                 saved_paths.append(path)
         
         if not saved_paths:
-             return jsonify({"error": "Nessun file valido"}), 400
-
-        logs = ["File ricevuti. Avvio orchestratore..."]
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return jsonify({"error": "Nessun file valido"}), 400
 
-        # 2. Run Orchestratore from backend.riconciliazione
-        orchestratore = Orchestratore()
-        
-        # We pass the temporary directory to the orchestratore so it can find the files matching its patterns
-        pv_count = orchestratore.esegui(temp_dir)
+        # 2. Tipo di ogni file dal contenuto (poche righe per file), con la confidenza
+        _, classificazione = classifica_cartella(temp_dir)
 
-        logs.append(f"Elaborazione terminata per {pv_count} Punti Vendita.")
+        # 3. L'orchestratore gira in background: la risposta porta l'id del job
+        job_id = coda_jobs.invia("upload", _elabora_upload, temp_dir, len(saved_paths), hash_file)
 
         return jsonify({
-            "message": "Elaborazione completata",
+            "job_id": job_id,
+            "stato": "IN_CODA",
             "files_imported": len(saved_paths),
-            "days_analyzed": pv_count,
-            "logs": logs
-        })
+            "file": classificazione,
+        }), 202
 
     except Exception as e:
         import traceback
         traceback.print_exc()
+        shutil.rmtree(temp_dir, ignore_errors=True)
         return jsonify({"error": str(e)}), 500
+
+
+def _elabora_upload(temp_dir, n_file, hash_file, progresso):
+    """Job di upload: esegue l'orchestratore sulla cartella temporanea e poi la elimina."""
+    try:
+        logs = ["File ricevuti. Avvio orchestratore..."]
+        # We pass the temporary directory to the orchestratore so it can find the files matching its patterns
+        orchestratore = Orchestratore()
+        pv_count = orchestratore.esegui(temp_dir, progresso=progresso, hash_file=hash_file)
+        if orchestratore.file_da_cache:
+            logs.append(f"File gia' elaborati, letti dalla cache: {', '.join(orchestratore.file_da_cache)}.")
+        logs.append(f"Elaborazione terminata per {pv_count} Punti Vendita.")
+        return {
+            "message": "Elaborazione completata",
+            "files_imported": n_file,
+            "days_analyzed": pv_count,
+            "logs": logs
+        }
     finally:
         # Pulizia della cartella temporanea
         shutil.rmtree(temp_dir, ignore_errors=True)
 
+
+@app.route("/api/riconciliazioni/riesegui", methods=["POST"])
+@jwt_required()
+def api_riesegui():
+    """
+    Riconcilia di nuovo dall'archivio Parquet delle sorgenti (nessun upload),
+    ad es. dopo un cambio di tolleranze. Body opzionale {"da", "a"}.
+    Come l'upload risponde 202 con l'id del job.
+    """
+    data = request.get_json(silent=True) or {}
+    job_id = coda_jobs.invia("riesecuzione", _elabora_riesecuzione, data.get("da"), data.get("a"))
+    return jsonify({"job_id": job_id, "stato": "IN_CODA"}), 202
+
+
+def _elabora_riesecuzione(da, a, progresso):
+    pv_count = Orchestratore().riesegui(da, a, progresso=progresso)
+    return {
+        "message": "Riconciliazione dall'archivio completata",
+        "days_analyzed": pv_count,
+        "logs": [f"Riconciliazione dall'archivio terminata per {pv_count} Punti Vendita."]
+    }
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+@jwt_required()
+def api_job(job_id):
+    """Stato e avanzamento di un job in background (polling dal frontend)."""
+    job = leggi_job(DB_PATH, job_id)
+    if not job:
+        return jsonify({"error": "Job non trovato"}), 404
+    return jsonify(job)
+
 # ============================================================================
 # API SETTINGS — API KEY MANAGEMENT
 # ============================================================================
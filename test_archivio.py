@@ -0,0 +1,64 @@
+import sys
+import tempfile
+
+import pandas as pd
+
+from backend.riconciliazione import archivio
+
+
+def fortech(pv, importo, giorni=("2026-01-01", "2026-01-02")):
+    return pd.DataFrame({
+        "PV": [pv] * len(giorni),
+        "DATA": pd.to_datetime(list(giorni)),
+        "CONTANTI": [importo] * len(giorni),
+    })
+
+
+def run_tests():
+    print("🚀 Inizio collaudo Archivio Parquet...")
+    errori = 0
+    with tempfile.TemporaryDirectory() as radice:
+        # 1. Due impianti archiviati uno dopo l'altro sulle stesse date
+        print("-> Test: archivia Fortech di PV 1 e poi di PV 2")
+        archivio.archivia("fortech", fortech("1", 100.0), "pv1.xlsx", radice=radice)
+        archivio.archivia("fortech", fortech("2", 200.0), "pv2.xlsx", radice=radice)
+        df = archivio.carica("fortech", radice=radice)
+        per_pv = df.groupby("PV").size().to_dict()
+        if per_pv == {"1": 2, "2": 2}:
+            print("✅ Le righe di entrambi gli impianti sono in archivio")
+        else:
+            print(f"❌ Righe per PV inattese: {per_pv}")
+            errori += 1
+
+        # 2. Un nuovo file dello stesso impianto sostituisce solo le sue giornate
+        print("-> Test: nuovo Fortech di PV 1 sul 2 gennaio")
+        archivio.archivia("fortech", fortech("1", 150.0, ("2026-01-02",)), "pv1_bis.xlsx", radice=radice)
+        df = archivio.carica("fortech", radice=radice)
+        pv1 = df[df["PV"] == "1"].set_index("DATA")["CONTANTI"].to_dict()
+        pv2 = df[df["PV"] == "2"]["CONTANTI"].tolist()
+        if pv1 == {pd.Timestamp("2026-01-01"): 100.0, pd.Timestamp("2026-01-02"): 150.0} and pv2 == [200.0, 200.0]:
+            print("✅ Sostituito il 2 gennaio di PV 1, PV 2 intatto")
+        else:
+            print(f"❌ Archivio inatteso: PV 1 {pv1}, PV 2 {pv2}")
+            errori += 1
+
+        # 3. Fonte senza codice impianto: sostituzione per sole date
+        print("-> Test: Numia (pv=tutti) sostituito per intervallo di date")
+        numia = pd.DataFrame({"Data_Norm": pd.to_datetime(["2026-01-01", "2026-01-02"]), "Importo_Numia": [10.0, 20.0]})
+        archivio.archivia("carte", numia, "numia.xlsx", radice=radice)
+        archivio.archivia("carte", numia.iloc[[1]].assign(Importo_Numia=25.0), "numia_bis.xlsx", radice=radice)
+        importi = archivio.carica("carte", radice=radice)["Importo_Numia"].tolist()
+        if sorted(importi) == [10.0, 25.0]:
+            print("✅ Numia: sostituita solo la giornata del nuovo file")
+        else:
+            print(f"❌ Numia: importi inattesi {importi}")
+            errori += 1
+
+    if errori:
+        print(f"❌ {errori} test dell'archivio falliti")
+        sys.exit(1)
+    print("🚀 Tutti i test dell'archivio sono passati con successo!")
+
+
+if __name__ == "__main__":
+    run_tests()